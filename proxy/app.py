@@ -18,6 +18,10 @@ import threading
 # DBモジュールをインポート
 import db
 import fetch_programs
+import radiko_client
+import crawler
+import now_playing
+from singleflight import SingleFlight
 
 app = Flask(__name__)
 app.config['JSON_AS_ASCII'] = False  # 日本語などの非ASCII文字をそのまま出力
@@ -506,23 +510,28 @@ def embed_metadata_after_recording(file_path: str, title: str, station: str):
 # DB初期化
 db.init_database()
 
-# スケジューラー設定（深夜3時に実行）
+# スケジューラー設定（番組表の定期更新）
 scheduler = BackgroundScheduler(daemon=True, timezone='Asia/Tokyo')
 scheduler.add_job(
-    func=fetch_programs.update_all_areas,
-    trigger='cron',
-    hour=3,  # 毎日3:00AMに実行
-    minute=0,
+    func=crawler.run_scheduled,
+    trigger='interval',
+    minutes=crawler.CRAWL_INTERVAL_MINUTES,  # 鮮度の優先度に従い期限切れの分だけ取得
+    next_run_time=datetime.now(scheduler.timezone) + timedelta(minutes=1),
+    max_instances=1,
+    coalesce=True,
     id='update_programs',
-    name='Update radiko programs daily at 3:00 AM',
+    name=f'Update radiko programs by freshness every {crawler.CRAWL_INTERVAL_MINUTES} minutes',
     replace_existing=True
 )
 scheduler.start()
 
+# 前回中断された番組表クロールがあれば続きから再開
+crawler.resume_interrupted()
+
 # アプリ終了時にスケジューラーをシャットダウン
 atexit.register(lambda: scheduler.shutdown())
 
-logger.info('✅ Scheduler started: updating programs daily at 3:00 AM JST')
+logger.info(f'✅ Scheduler started: updating programs by freshness every {crawler.CRAWL_INTERVAL_MINUTES} minutes')
 
 @app.route('/health')
 def health():
@@ -532,17 +541,12 @@ def health():
 @app.route('/radiko/<path:path>')
 def proxy(path):
     """radikoへのリクエストをプロキシする"""
-    url = f'http://radiko.jp/{path}'
+    url = radiko_client.build_url(path)
     logger.info(f'Proxying request to: {url}')
 
     try:
-        resp = requests.get(
-            url,
-            timeout=30,
-            headers={
-                'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36'
-            }
-        )
+        # 共有HTTPクライアント（接続再利用・リトライ・サーキットブレーカー付き）
+        resp = radiko_client.get(url)
 
         return Response(
             resp.content,
@@ -1023,20 +1027,11 @@ def rename_file():
         relative_path = os.path.relpath(new_path, base_dir)
 
         # DBを更新（file_pathとfile_nameの両方を更新）
-        try:
-            conn = db.get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute('''
-                UPDATE recorded_files
-                SET file_path = ?, file_name = ?
-                WHERE file_path = ?
-            ''', (relative_path, new_name, file_path))
-            conn.commit()
-            conn.close()
+        # DBの更新に失敗してもファイルリネームは成功しているので、エラーは返さない
+        if db.rename_recorded_file(file_path, relative_path, new_name):
             logger.info(f'✅ DB updated: {file_path} -> {relative_path} (name: {new_name})')
-        except Exception as db_error:
-            logger.error(f'❌ DB update failed: {str(db_error)}')
-            # DBの更新に失敗してもファイルリネームは成功しているので、エラーは返さない
+        else:
+            logger.error(f'❌ DB update failed: {file_path} -> {relative_path}')
 
         logger.info(f'File renamed: {file_path} -> {new_name}')
 
@@ -1050,13 +1045,26 @@ def rename_file():
         logger.error(f'Rename file error: {str(e)}')
         return jsonify({'error': str(e)}), 500
 
+# ファイル一覧の1ページの最大件数
+FILES_PAGE_MAX_LIMIT = 1000
+
+
+def files_page_args():
+    """ファイル一覧のページング引数（?limit=件数&cursor=前のページのnext_cursor）"""
+    limit = request.args.get('limit', FILES_PAGE_MAX_LIMIT, type=int)
+    return max(1, min(limit, FILES_PAGE_MAX_LIMIT)), request.args.get('cursor') or None
+
+
 @app.route('/files', methods=['GET'])
 def list_files():
-    """録音済みファイル一覧を取得（ルートフォルダのみ、virtual_folder_id=NULL）"""
+    """録音済みファイル一覧を新しい順に取得（ルートフォルダのみ、virtual_folder_id=NULL）"""
     try:
         # DBからルートフォルダのファイルを取得（virtual_folder_id=NULL）
-        files = db.get_files_in_folder(folder_id=None, limit=1000, offset=0)
-        return jsonify({'files': files})
+        limit, after = files_page_args()
+        page = db.get_files_in_folder(folder_id=None, limit=limit, after=after)
+        return jsonify({'files': page['files'], 'next_cursor': page['next_cursor']})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f'List files error: {str(e)}')
         return jsonify({'error': str(e)}), 500
@@ -1774,40 +1782,88 @@ def search_programs_api():
         return jsonify({'error': str(e)}), 500
 
 
+# 同じエリア・日付の番組表取得を同時に1回だけ実行する
+area_programs_flight = SingleFlight()
+
+
+def refresh_area_programs(area_id, date):
+    """radiko APIからエリア・日付の番組表を取得してDBに保存（保存件数を返す）"""
+    fetched_programs = fetch_programs.fetch_area_programs(area_id, date)
+
+    if fetched_programs:
+        # DBに保存（既存データは削除される）
+        db.save_programs(fetched_programs, area_id, date)
+        logger.info(f'✅ Fetched and saved {len(fetched_programs)} programs for {area_id}/{date}')
+    else:
+        logger.warning(f'⚠️ No programs found from radiko API for {area_id}/{date}')
+
+    return len(fetched_programs)
+
+
+def schedule_area_programs_refresh(area_id, date):
+    """エリア・日付の番組表の再取得をバックグラウンドで予約（実行中なら何もしない）"""
+    key = (area_id, date, True)
+    if area_programs_flight.in_flight(key):
+        return False
+
+    scheduler.add_job(
+        func=area_programs_flight.do,
+        trigger='date',  # 即座に実行
+        args=[key, refresh_area_programs, area_id, date],
+        id=f'refresh_programs_{area_id}_{date}',
+        name=f'Refresh programs {area_id}/{date}',
+        replace_existing=True
+    )
+    return True
+
+
 @app.route('/programs/area/<area_id>/date/<date>', methods=['GET'])
 def get_area_programs_api(area_id, date):
-    """特定エリア・日付の番組を取得（DBになければradiko APIから取得）"""
+    """特定エリア・日付の番組を取得（stale-while-revalidate）
+
+    - DBにデータがあれば即座に返し、強制更新（force=true）または
+      クローラーの鮮度基準（crawler.is_due）より古い場合はバックグラウンドで再取得する
+      （結果は次回のリクエストで反映される）。放送が終わった日付は、
+      放送終了後に取得済みなら再取得しない
+    - DBにデータがない場合のみ、radiko APIから取得してから返す
+    """
     try:
         # 強制更新フラグ
         force_refresh = request.args.get('force', 'false').lower() == 'true'
 
         programs = db.get_programs_by_area_date(area_id, date)
+        updated_at = db.get_area_date_updated_at(area_id, date)
+        refreshing = False
 
-        # 強制更新 または DBにデータがない場合、radiko APIから取得してDBに保存
-        if force_refresh or len(programs) == 0:
-            if force_refresh:
-                logger.info(f'🔄 Force refresh for {area_id}/{date}, fetching from radiko API...')
-            else:
-                logger.info(f'📥 No data in DB for {area_id}/{date}, fetching from radiko API...')
-
-            # radiko APIから取得
-            fetched_programs = fetch_programs.fetch_area_programs(area_id, date)
+        if len(programs) == 0:
+            logger.info(f'📥 No data in DB for {area_id}/{date}, fetching from radiko API...')
 
-            if fetched_programs:
-                # DBに保存（既存データは削除される）
-                db.save_programs(fetched_programs, area_id, date)
-                logger.info(f'✅ Fetched and saved {len(fetched_programs)} programs for {area_id}/{date}')
+            # 同じエリア・日付の取得が実行中なら、その完了を待って結果を共有する
+            fetched_count = area_programs_flight.do(
+                (area_id, date, force_refresh), refresh_area_programs, area_id, date
+            )
 
+            if fetched_count:
                 # 保存したデータを再取得してフォーマット
                 programs = db.get_programs_by_area_date(area_id, date)
+                updated_at = db.get_area_date_updated_at(area_id, date)
+
+        elif force_refresh or crawler.is_due(date, updated_at):
+            if force_refresh:
+                logger.info(f'🔄 Force refresh for {area_id}/{date}, revalidating in background...')
             else:
-                logger.warning(f'⚠️ No programs found from radiko API for {area_id}/{date}')
+                logger.info(f'🔄 Stale data for {area_id}/{date} (updated_at={updated_at}), revalidating in background...')
+
+            schedule_area_programs_refresh(area_id, date)
+            refreshing = True
 
         return jsonify({
             'success': True,
             'area_id': area_id,
             'date': date,
             'count': len(programs),
+            'updated_at': updated_at,
+            'refreshing': refreshing,
             'programs': programs
         })
 
@@ -1816,11 +1872,44 @@ def get_area_programs_api(area_id, date):
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/programs/now/<area_id>', methods=['GET'])
+def get_now_programs_api(area_id):
+    """エリアの各放送局の放送中・次の番組を取得
+
+    - DBの番組表から作ったメモリ上のインデックス（now_playing）で返す
+    - DBに放送中の番組がない場合のみ、radikoのnow.xmlから取得して返す
+    """
+    try:
+        if area_id not in fetch_programs.ALL_AREA_IDS:
+            return jsonify({'error': f'Unknown area: {area_id}'}), 400
+
+        stations = now_playing.get_now_programs(area_id)
+        source = 'db'
+
+        if not any(station['now'] for station in stations):
+            logger.info(f'📥 No current programs in DB for {area_id}, fetching from radiko API...')
+            stations = fetch_programs.fetch_now_programs(area_id)
+            source = 'radiko'
+
+        return jsonify({
+            'success': True,
+            'area_id': area_id,
+            'source': source,
+            'stations': stations
+        })
+
+    except Exception as e:
+        logger.error(f'Get now programs API error: {str(e)}')
+        return jsonify({'error': str(e)}), 500
+
+
 @app.route('/programs/update/status', methods=['GET'])
 def get_update_status_api():
     """番組表の更新ステータスを取得"""
     try:
         status = db.get_update_status()
+        job = crawler.get_current_job()
+        status['crawl'] = job.to_dict() if job else None
         return jsonify(status)
 
     except Exception as e:
@@ -1830,22 +1919,25 @@ def get_update_status_api():
 
 @app.route('/programs/update/trigger', methods=['POST'])
 def trigger_update_api():
-    """番組表の即時更新をトリガー"""
+    """番組表の即時更新をトリガー（実行中の場合はそのクロールを返す）
+
+    scope: all（デフォルト）/ failed（失敗分のみ）/ stale（未取得・失敗・古いもののみ）
+    """
     try:
-        logger.info('Manual update triggered via API')
+        scope = request.args.get('scope') or (request.get_json(silent=True) or {}).get('scope') or 'all'
+        if scope not in crawler.CRAWL_SCOPES:
+            return jsonify({'error': f'Invalid scope: {scope}'}), 400
+
+        logger.info(f'Manual update triggered via API (scope={scope})')
 
         # バックグラウンドで実行（リクエストをブロックしない）
-        scheduler.add_job(
-            func=fetch_programs.update_all_areas,
-            trigger='date',  # 即座に実行
-            id='manual_update',
-            name='Manual update',
-            replace_existing=True
-        )
+        job, started = crawler.start_crawl(trigger='api', scope=scope)
 
         return jsonify({
             'success': True,
-            'message': 'Update started in background'
+            'message': 'Update started in background' if started else 'Update already running',
+            'started': started,
+            'job': job.to_dict()
         })
 
     except Exception as e:
@@ -1857,80 +1949,60 @@ def trigger_update_api():
 
 @app.route('/admin/update-programs-stream', methods=['GET'])
 def admin_update_programs_stream():
-    """管理画面からの番組表一括更新（SSEストリーミング）"""
-    def generate():
+    """管理画面からの番組表一括更新（SSEストリーミング）
+
+    クロールが実行中ならそれに合流し、これまでの進捗から送信する。
+    切断してもクロールは継続し、再接続時（Last-Event-ID）は続きから送信する。
+    """
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+
+    if last_event_id:
+        # 再接続: 同じクロールの続きから送信する
+        job_id, _, seq = last_event_id.partition(':')
+        job = crawler.get_current_job()
+        if job is None or job.id != job_id:
+            # クロールが見つからない（サーバー再起動など）: 204で再接続を止める
+            return Response(status=204)
+        after = int(seq) if seq.isdigit() else 0
+        attached = False
+    else:
         try:
             days = int(request.args.get('days', 3))
-            logger.info(f'Admin: manual program update for {days} days (streaming)')
-
-            # 進捗情報をストリーミング送信
-            yield f"data: {json.dumps({'type': 'start', 'message': f'{days}日分の番組表更新を開始します...'})}\n\n"
-
-            # fetch_programs.pyのALL_AREA_IDSを取得
-            from fetch_programs import ALL_AREA_IDS
-            from datetime import datetime, timedelta
-            import time
+        except ValueError:
+            return jsonify({'error': f'Invalid days: {request.args.get("days")}'}), 400
+        if days < 1:
+            return jsonify({'error': f'Invalid days: {days}'}), 400
 
-            # 日付リストを生成（今日から指定日数分）
-            today = datetime.now()
-            if today.hour < 5:
-                today = today - timedelta(days=1)
+        scope = request.args.get('scope', 'all')
+        if scope not in crawler.CRAWL_SCOPES:
+            return jsonify({'error': f'Invalid scope: {scope}'}), 400
 
-            dates = []
-            for i in range(days):
-                date = today + timedelta(days=i)
-                date_str = date.strftime('%Y%m%d')
-                dates.append(date_str)
+        logger.info(f'Admin: manual program update for {days} days, scope={scope} (streaming)')
 
-            total_tasks = len(ALL_AREA_IDS) * len(dates)
-            completed = 0
-            total_programs = 0
-            success_count = 0
-            error_count = 0
-            warning_count = 0
-
-            yield f"data: {json.dumps({'type': 'info', 'message': f'全{len(ALL_AREA_IDS)}エリア × {len(dates)}日 = {total_tasks}件の処理'})}\n\n"
-
-            # 各エリアを処理
-            for idx, area_id in enumerate(ALL_AREA_IDS, 1):
-                yield f"data: {json.dumps({'type': 'progress', 'area': area_id, 'current': idx, 'total': len(ALL_AREA_IDS)})}\n\n"
-
-                for date in dates:
-                    try:
-                        programs = fetch_programs.fetch_area_programs(area_id, date)
-
-                        if programs:
-                            db.save_programs(programs, area_id, date)
-                            total_programs += len(programs)
-                            success_count += 1
-                            yield f"data: {json.dumps({'type': 'success', 'area': area_id, 'date': date, 'programs': len(programs)})}\n\n"
-                        else:
-                            warning_count += 1
-                            yield f"data: {json.dumps({'type': 'warning', 'area': area_id, 'date': date, 'message': 'No programs found'})}\n\n"
-
-                        completed += 1
-                        progress_percent = int((completed / total_tasks) * 100)
-                        yield f"data: {json.dumps({'type': 'percent', 'percent': progress_percent, 'completed': completed, 'total': total_tasks, 'success': success_count, 'error': error_count, 'warning': warning_count})}\n\n"
+        try:
+            # 今日から指定日数分
+            job, started = crawler.start_crawl(
+                dates=fetch_programs.crawl_dates(0, days - 1),
+                trigger='admin',
+                scope=scope
+            )
+        except Exception as e:
+            logger.error(f'Admin update programs stream error: {str(e)}')
+            return jsonify({'error': str(e)}), 500
+        after = 0
+        attached = not started
 
-                        time.sleep(0.2)  # レート制限対策
+    def generate():
+        try:
+            if attached:
+                yield f"data: {json.dumps({'type': 'info', 'message': '実行中の番組表更新に接続しました'})}\n\n"
 
-                    except Exception as e:
-                        error_count += 1
-                        error_msg = str(e)
-                        # タイムアウトエラーをわかりやすく
-                        if 'timed out' in error_msg or 'timeout' in error_msg.lower():
-                            error_msg = 'タイムアウト (radikoサーバー応答なし)'
-                        yield f"data: {json.dumps({'type': 'error', 'area': area_id, 'date': date, 'message': error_msg})}\n\n"
-                        completed += 1
-                        progress_percent = int((completed / total_tasks) * 100)
-                        yield f"data: {json.dumps({'type': 'percent', 'percent': progress_percent, 'completed': completed, 'total': total_tasks, 'success': success_count, 'error': error_count, 'warning': warning_count})}\n\n"
-
-            # 古いデータを削除
-            yield f"data: {json.dumps({'type': 'info', 'message': '古いデータを削除中...'})}\n\n"
-            db.cleanup_old_data(days_to_keep=15)
-
-            # 完了
-            yield f"data: {json.dumps({'type': 'complete', 'total_programs': total_programs, 'success': success_count, 'error': error_count, 'warning': warning_count, 'message': '更新が完了しました'})}\n\n"
+            for event in job.events(after=after):
+                if event is None:
+                    # 接続維持
+                    yield ': keep-alive\n\n'
+                    continue
+                yield f"id: {job.id}:{event['id']}\ndata: {json.dumps(event)}\n\n"
 
         except Exception as e:
             logger.error(f'Admin update programs stream error: {str(e)}')
@@ -2079,25 +2151,21 @@ def admin_disk_space():
 def admin_db_status():
     """DB統計情報を取得"""
     try:
-        import sqlite3
-
-        conn = sqlite3.connect(db.DB_PATH)
-        cursor = conn.cursor()
+        with db.connection() as conn:
+            cursor = conn.cursor()
 
-        # 総番組数
-        cursor.execute('SELECT COUNT(*) FROM programs')
-        total_programs = cursor.fetchone()[0]
+            # 総番組数
+            cursor.execute('SELECT COUNT(*) FROM programs')
+            total_programs = cursor.fetchone()[0]
 
-        # 更新履歴数
-        cursor.execute('SELECT COUNT(*) FROM update_log')
-        total_updates = cursor.fetchone()[0]
+            # 更新履歴数
+            cursor.execute('SELECT COUNT(*) FROM update_log')
+            total_updates = cursor.fetchone()[0]
 
         # DBファイルサイズ
         db_size = os.path.getsize(db.DB_PATH)
         db_size_mb = round(db_size / 1024 / 1024, 2)
 
-        conn.close()
-
         return jsonify({
             'success': True,
             'total_programs': total_programs,
@@ -2109,21 +2177,29 @@ def admin_db_status():
         logger.error(f'Admin DB status error: {str(e)}')
         return jsonify({'error': str(e)}), 500
 
+@app.route('/admin/http-stats')
+def admin_http_stats():
+    """radiko向けHTTPクライアントの統計（接続再利用数など）を取得"""
+    try:
+        return jsonify({
+            'success': True,
+            'stats': radiko_client.get_stats()
+        })
+
+    except Exception as e:
+        logger.error(f'Admin HTTP stats error: {str(e)}')
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/admin/cleanup-orphaned-records', methods=['POST'])
 def cleanup_orphaned_records():
     """物理ファイルが存在しないDBレコードを削除"""
     try:
-        import sqlite3
-
-        conn = sqlite3.connect(db.DB_PATH)
-        cursor = conn.cursor()
-
         # 全ての録音ファイルレコードを取得
-        cursor.execute('SELECT id, file_path FROM recorded_files')
-        all_records = cursor.fetchall()
+        with db.connection() as conn:
+            all_records = conn.execute('SELECT id, file_path FROM recorded_files').fetchall()
 
         orphaned = []
-        cleaned = []
+        deletions = []
 
         for record_id, file_path in all_records:
             if not file_path:
@@ -2138,14 +2214,15 @@ def cleanup_orphaned_records():
                     'path': file_path
                 })
 
-                # DBから削除
-                cursor.execute('DELETE FROM recorded_files WHERE id = ?', (record_id,))
+                # DBから削除（続けてキューに入れ、書き込みスレッドでまとめてコミットさせる）
+                deletions.append((file_path, db.submit_write(db.delete_recorded_file, file_path)))
+
+        cleaned = []
+        for file_path, future in deletions:
+            if future.result():
                 cleaned.append(file_path)
                 logger.info(f'Orphaned record cleaned: {file_path}')
 
-        conn.commit()
-        conn.close()
-
         return jsonify({
             'success': True,
             'orphaned_count': len(orphaned),
@@ -2306,18 +2383,12 @@ def batch_update_metadata():
     """すべての録音ファイルのメタデータを一括更新"""
     try:
         # DBから全ての録音ファイルを取得
-        import sqlite3
-        conn = sqlite3.connect(db.DB_PATH)
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            SELECT file_path, program_title, station_name
-            FROM recorded_files
-            WHERE file_path IS NOT NULL
-        ''')
-
-        files = cursor.fetchall()
-        conn.close()
+        with db.connection() as conn:
+            files = conn.execute('''
+                SELECT file_path, program_title, station_name
+                FROM recorded_files
+                WHERE file_path IS NOT NULL
+            ''').fetchall()
 
         processed = 0
         success_count = 0
@@ -2574,14 +2645,13 @@ def move_file():
 
 @app.route('/folders/<int:folder_id>/files', methods=['GET'])
 def get_folder_files(folder_id):
-    """仮想フォルダ内のファイルを取得"""
+    """仮想フォルダ内のファイルを新しい順に取得"""
     try:
-        page = request.args.get('page', 1, type=int)
-        limit = request.args.get('limit', 1000, type=int)
-        offset = (page - 1) * limit
-
-        files = db.get_files_in_folder(folder_id, limit, offset)
-        return jsonify({'success': True, 'files': files})
+        limit, after = files_page_args()
+        page = db.get_files_in_folder(folder_id, limit, after)
+        return jsonify({'success': True, 'files': page['files'], 'next_cursor': page['next_cursor']})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f'Get folder files error: {str(e)}')
         return jsonify({'error': str(e)}), 500
@@ -2738,4 +2808,6 @@ def upload_file():
 
 if __name__ == '__main__':
     # 開発環境用（本番ではgunicornを使用）
+    # spawnで起動した解析プロセスがこのスクリプト（スケジューラー等）を再実行しないよう、解析はスレッドで行う
+    fetch_programs.PARSE_PROCESSES = 0
     app.run(host='0.0.0.0', port=8080, debug=False, threaded=True)
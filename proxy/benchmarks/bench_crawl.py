@@ -0,0 +1,190 @@
+"""
+番組表クローラーのベンチマーク
+
+スタンドインサーバー（benchmarks/standin_server.py）を別プロセスで起動し、
+一時ディレクトリのDBに対して fetch_programs.update_all_areas を実行して
+所要時間・リクエスト数・リクエスト/秒・DB書き込み時間・ピークRSSを表示する。
+2回目以降の実行では条件付き取得（304/内容ハッシュ）の効果も確認できる。
+
+使い方:
+    cd proxy && python benchmarks/bench_crawl.py [--days 7] [--mode weekly] [--runs 2]
+        [--latency 20] [--jitter 5] [--error-rate 0] [--unthrottled] [--json]
+
+--unthrottled を付けると radiko_client の流量制限を実質無効にする（クローラー自体の速度を測る場合）。
+--url を指定すると、起動済みのスタンドインサーバーを使う。
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+
+# DB書き込み時間として計測する db の関数
+DB_WRITE_FUNCTIONS = (
+    'save_date_programs',
+    'save_area_stations',
+    'save_fetch_cache',
+    'save_crawl_units',
+    'cleanup_old_data',
+)
+
+
+def _get_json(url: str) -> dict:
+    with urllib.request.urlopen(url, timeout=5) as response:
+        return json.loads(response.read())
+
+
+def start_server(args) -> tuple:
+    """スタンドインサーバーを別プロセスで起動し、(プロセス, URL) を返す"""
+    command = [
+        sys.executable, os.path.join(BENCH_DIR, 'standin_server.py'),
+        '--port', str(args.port),
+        '--latency', str(args.latency),
+        '--jitter', str(args.jitter),
+        '--error-rate', str(args.error_rate),
+        '--seed', '1',
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{args.port}'
+
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            _get_json(f'{url}/__stats')
+            return process, url
+        except OSError:
+            time.sleep(0.1)
+
+    process.kill()
+    raise RuntimeError('stand-in server did not start')
+
+
+def peak_rss_mb() -> float:
+    """このプロセスのピークRSS（MB）"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linuxはキロバイト、macOSはバイト
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description='番組表クローラーのベンチマーク')
+    parser.add_argument('--days', type=int, default=7, help='update_all_areas の days（-days〜+days日）')
+    parser.add_argument('--mode', choices=('daily', 'weekly'), default=None, help='取得モード（省略時は FETCH_MODE）')
+    parser.add_argument('--runs', type=int, default=2, help='同じDBに対して続けて実行する回数')
+    parser.add_argument('--no-conditional', action='store_true', help='条件付き取得を無効にする')
+    parser.add_argument('--latency', type=float, default=20.0, help='サーバーの応答遅延の平均（ミリ秒）')
+    parser.add_argument('--jitter', type=float, default=5.0, help='サーバーの応答遅延の標準偏差（ミリ秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='サーバーがエラーを返す割合（0〜1）')
+    parser.add_argument('--port', type=int, default=18089, help='スタンドインサーバーのポート')
+    parser.add_argument('--url', default=None, help='起動済みのスタンドインサーバーのURL')
+    parser.add_argument('--unthrottled', action='store_true', help='radiko_client の流量制限を実質無効にする')
+    parser.add_argument('--json', action='store_true', help='結果をJSONで出力')
+    args = parser.parse_args()
+
+    process = None
+    if args.url:
+        url = args.url.rstrip('/')
+    else:
+        process, url = start_server(args)
+
+    data_dir = tempfile.TemporaryDirectory(prefix='bench_crawl_')
+    os.makedirs(os.path.join(data_dir.name, 'data'))
+
+    # プロジェクトのモジュールは環境変数を読み込み時に参照するため、設定してからimportする
+    os.environ['RADIKO_BASE_URL'] = url
+    os.environ['BASE_DIR'] = data_dir.name
+    if args.unthrottled:
+        os.environ.setdefault('RADIKO_RATE', '100000')
+        os.environ.setdefault('RADIKO_RATE_MAX', '100000')
+        os.environ.setdefault('RADIKO_RATE_BURST', '1000')
+
+    import logging
+    logging.basicConfig(level=logging.WARNING)
+
+    import db  # noqa: E402
+    import fetch_programs  # noqa: E402
+
+    db.init_database()
+
+    # DB書き込み時間を計測
+    db_time = {'seconds': 0.0}
+
+    def timed(func):
+        def wrapper(*func_args, **func_kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*func_args, **func_kwargs)
+            finally:
+                db_time['seconds'] += time.perf_counter() - started
+        return wrapper
+
+    for name in DB_WRITE_FUNCTIONS:
+        setattr(db, name, timed(getattr(db, name)))
+
+    results = []
+    try:
+        for run in range(1, args.runs + 1):
+            _get_json(f'{url}/__reset')
+            db_time['seconds'] = 0.0
+
+            started = time.perf_counter()
+            result = fetch_programs.update_all_areas(
+                days=args.days,
+                mode=args.mode,
+                conditional=False if args.no_conditional else None
+            )
+            wall = time.perf_counter() - started
+
+            stats = _get_json(f'{url}/__stats')
+            results.append({
+                'run': run,
+                'wall_time': round(wall, 3),
+                'requests': stats['requests'],
+                'requests_per_sec': round(stats['requests'] / wall, 1) if wall else 0,
+                'not_modified': stats['not_modified'],
+                'bytes': stats['bytes'],
+                'db_write_time': round(db_time['seconds'], 3),
+                'programs': result['programs'],
+                'success': result['success'],
+                'unchanged': result['unchanged'],
+                'errors': result['errors'],
+                'peak_rss_mb': round(peak_rss_mb(), 1),
+            })
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        data_dir.cleanup()
+
+    if args.json:
+        print(json.dumps({
+            'mode': args.mode or fetch_programs.FETCH_MODE,
+            'days': args.days,
+            'latency_ms': args.latency,
+            'unthrottled': args.unthrottled,
+            'runs': results
+        }, indent=2))
+        return 0
+
+    print(f'mode={args.mode or fetch_programs.FETCH_MODE} days=-{args.days}..+{args.days} '
+          f'latency={args.latency}ms±{args.jitter} error_rate={args.error_rate} '
+          f'{"unthrottled" if args.unthrottled else "throttled"}')
+    print(f'{"run":>3} {"wall(s)":>8} {"requests":>8} {"req/s":>7} {"304":>5} {"KB":>7} '
+          f'{"db(s)":>7} {"db%":>5} {"programs":>8} {"errors":>6} {"RSS(MB)":>8}')
+    for r in results:
+        db_share = r['db_write_time'] / r['wall_time'] * 100 if r['wall_time'] else 0
+        print(f'{r["run"]:>3} {r["wall_time"]:>8.2f} {r["requests"]:>8} {r["requests_per_sec"]:>7.1f} '
+              f'{r["not_modified"]:>5} {r["bytes"] / 1024:>7.0f} {r["db_write_time"]:>7.2f} {db_share:>5.1f} '
+              f'{r["programs"]:>8} {r["errors"]:>6} {r["peak_rss_mb"]:>8.1f}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,115 @@
+"""
+DB接続のマイクロベンチマーク
+
+一時ディレクトリのDBに対して、1回の呼び出しあたりのオーバーヘッドを比較する。
+- connect per call:       呼び出しごとに sqlite3.connect して閉じる（変更前の大半の関数）
+- connect+pragma per call: さらに PRAGMA journal_mode=WAL / busy_timeout を毎回発行（変更前の get_db_connection）
+- db.connection():        スレッドごとの接続を使い回す
+
+使い方:
+    cd proxy && python benchmarks/bench_db.py [--calls 5000] [--rows 2000]
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+READ_SQL = 'SELECT updated_at FROM update_log WHERE area_id = ? AND date = ?'
+WRITE_SQL = '''
+    INSERT OR REPLACE INTO fetch_cache (station_id, date, etag, last_modified, content_hash, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+
+
+def legacy_connect(db):
+    return sqlite3.connect(db.DB_PATH)
+
+
+def legacy_connect_pragma(db):
+    conn = sqlite3.connect(db.DB_PATH, timeout=db.DB_TIMEOUT, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute(f'PRAGMA busy_timeout={int(db.DB_TIMEOUT * 1000)}')
+    return conn
+
+
+def measure_legacy(db, connect, sql, make_params, calls, write):
+    start = time.perf_counter()
+    for i in range(calls):
+        conn = connect(db)
+        cursor = conn.cursor()
+        cursor.execute(sql, make_params(i))
+        cursor.fetchall()
+        if write:
+            conn.commit()
+        conn.close()
+    return (time.perf_counter() - start) / calls
+
+
+def measure_managed(db, sql, make_params, calls, write):
+    start = time.perf_counter()
+    for i in range(calls):
+        with db.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql, make_params(i))
+            cursor.fetchall()
+    return (time.perf_counter() - start) / calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description='DB接続のマイクロベンチマーク')
+    parser.add_argument('--calls', type=int, default=5000, help='1パターンあたりの呼び出し回数')
+    parser.add_argument('--rows', type=int, default=2000, help='update_logに入れておく行数')
+    args = parser.parse_args()
+
+    data_dir = tempfile.TemporaryDirectory(prefix='bench_db_')
+    os.makedirs(os.path.join(data_dir.name, 'data'))
+    # db はDB_PATHを読み込み時に決めるため、設定してからimportする
+    os.environ['BASE_DIR'] = data_dir.name
+
+    import logging
+    logging.basicConfig(level=logging.WARNING)
+
+    import db  # noqa: E402
+
+    try:
+        db.init_database()
+        with db.connection() as conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO update_log (area_id, date, updated_at, status) VALUES (?, ?, ?, ?)',
+                [(f'JP{i % 47 + 1}', f'{20260000 + i}', '2026-01-01T00:00:00', 'success') for i in range(args.rows)]
+            )
+
+        def read_params(i):
+            return (f'JP{i % 47 + 1}', f'{20260000 + i % args.rows}')
+
+        def write_params(i):
+            return (f'BENCH{i % 100}', f'{20260000 + i}', None, None, 'x', '2026-01-01T00:00:00')
+
+        print(f'calls={args.calls} rows={args.rows} sqlite={sqlite3.sqlite_version}')
+        print(f'  {"":26s} {"read (us/call)":>15} {"write (us/call)":>16}')
+        results = {}
+        for name, measure in (
+            ('connect per call', lambda sql, params, write: measure_legacy(db, legacy_connect, sql, params, args.calls, write)),
+            ('connect+pragma per call', lambda sql, params, write: measure_legacy(db, legacy_connect_pragma, sql, params, args.calls, write)),
+            ('db.connection()', lambda sql, params, write: measure_managed(db, sql, params, args.calls, write)),
+        ):
+            read = measure(READ_SQL, read_params, False)
+            write = measure(WRITE_SQL, write_params, True)
+            results[name] = (read, write)
+            print(f'  {name:26s} {read * 1e6:15.1f} {write * 1e6:16.1f}')
+
+        managed_read, managed_write = results['db.connection()']
+        for name in ('connect per call', 'connect+pragma per call'):
+            read, write = results[name]
+            print(f'  vs {name}: read x{read / managed_read:.1f}, write x{write / managed_write:.1f}')
+    finally:
+        data_dir.cleanup()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
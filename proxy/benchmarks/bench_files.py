@@ -0,0 +1,114 @@
+"""
+録音ファイル一覧（db.get_files_in_folder）のベンチマーク
+
+一時ディレクトリのDBに録音ファイルを登録し、ページの深さごとに
+変更前の LIMIT/OFFSET による取得とキーセットページング（next_cursor）のクエリの所要時間を比較する
+（どちらもインデックス idx_recorded_files_folder_modified がある状態。行→辞書の変換は含まない）。
+
+使い方:
+    cd proxy && python benchmarks/bench_files.py [--files 50000] [--limit 50] [--repeat 20]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# 変更前の get_files_in_folder（ルート）のクエリ
+OFFSET_SQL = '''
+    SELECT
+        rf.*,
+        p.title as program_db_title,
+        p.description as program_description,
+        p.performer as program_performer,
+        p.info as program_db_info,
+        p.url as program_url
+    FROM recorded_files rf
+    LEFT JOIN programs p ON rf.program_id = p.id
+    WHERE rf.virtual_folder_id IS NULL
+    ORDER BY rf.file_modified DESC
+    LIMIT ? OFFSET ?
+'''
+
+
+def measure(func, repeat: int) -> float:
+    """repeat回実行した所要時間の中央値（ミリ秒）"""
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - started) * 1000)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='録音ファイル一覧のベンチマーク')
+    parser.add_argument('--files', type=int, default=50000, help='登録する録音ファイル数')
+    parser.add_argument('--limit', type=int, default=50, help='1ページの件数')
+    parser.add_argument('--repeat', type=int, default=20, help='1パターンあたりの繰り返し回数')
+    args = parser.parse_args()
+
+    data_dir = tempfile.TemporaryDirectory(prefix='bench_files_')
+    os.makedirs(os.path.join(data_dir.name, 'data'))
+    # db はDB_PATHを読み込み時に決めるため、設定してからimportする
+    os.environ['BASE_DIR'] = data_dir.name
+
+    import logging
+    logging.basicConfig(level=logging.WARNING)
+
+    import db  # noqa: E402
+
+    try:
+        db.init_database()
+        random.seed(1)
+        with db.connection() as conn:
+            conn.execute("INSERT INTO virtual_folders (name) VALUES ('bench')")
+            conn.executemany(
+                'INSERT INTO recorded_files (file_path, file_name, file_size, file_modified, virtual_folder_id) '
+                'VALUES (?, ?, ?, ?, ?)',
+                [(f'bench/{i}.m4a', f'{i}.m4a', 1000,
+                  datetime.fromtimestamp(1.7e9 + random.randrange(10 ** 8)).isoformat(),
+                  None if i % 4 else 1) for i in range(args.files)]
+            )
+            root_files = conn.execute(
+                'SELECT COUNT(*) FROM recorded_files WHERE virtual_folder_id IS NULL').fetchone()[0]
+
+        # 各ページの先頭のカーソルを集めておく
+        cursors = [None]
+        while len(cursors) * args.limit < root_files:
+            page = db.get_files_in_folder(None, args.limit, cursors[-1])
+            cursors.append(page['next_cursor'])
+
+        print(f'{root_files} root files, limit={args.limit}, repeat={args.repeat}')
+        print(f'  {"page":>6} {"offset(ms)":>11} {"keyset(ms)":>11} {"speedup":>8}')
+        for page_number in sorted({1, 10, 100, len(cursors) // 2, len(cursors)}):
+            if page_number < 1 or page_number > len(cursors):
+                continue
+
+            def by_offset():
+                with db.connection() as conn:
+                    conn.row_factory = sqlite3.Row
+                    conn.execute(OFFSET_SQL, (args.limit, (page_number - 1) * args.limit)).fetchall()
+
+            def by_keyset():
+                with db.connection() as conn:
+                    conn.row_factory = sqlite3.Row
+                    db._select_recorded_files_page(conn.cursor(), 'rf.virtual_folder_id IS NULL', [],
+                                                   args.limit, cursors[page_number - 1])
+
+            offset_time = measure(by_offset, args.repeat)
+            keyset_time = measure(by_keyset, args.repeat)
+            print(f'  {page_number:>6} {offset_time:11.2f} {keyset_time:11.2f} {offset_time / keyset_time:7.1f}x')
+    finally:
+        data_dir.cleanup()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,87 @@
+"""
+放送中・次の番組（now_playing.get_now_programs）のベンチマーク
+
+スタンドインサーバー（benchmarks/standin_server.py）から全エリア・前後1日分の番組表を
+一時ディレクトリのDBに取り込み、エリアごとに
+メモリ上のインデックスによる検索と、radikoのnow.xml（/radiko/ プロキシ経由と同じ取得）の所要時間を比較する。
+スタンドインサーバーはローカルで応答するため、実際のradikoとの往復時間はこれより長い。
+
+使い方:
+    cd proxy && python benchmarks/bench_now.py [--repeat 200] [--area JP13 --area JP27 ...]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+
+import standin_server  # noqa: E402
+
+DEFAULT_AREAS = ('JP1', 'JP13', 'JP27', 'JP40', 'JP47')
+
+
+def measure(func, repeat: int):
+    """repeat回実行した所要時間の中央値（マイクロ秒）と結果"""
+    times = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        times.append((time.perf_counter() - started) * 1e6)
+    return statistics.median(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='放送中・次の番組のベンチマーク')
+    parser.add_argument('--area', action='append', help='エリアID（複数指定可）')
+    parser.add_argument('--repeat', type=int, default=200, help='インデックス検索の繰り返し回数')
+    parser.add_argument('--fetch-repeat', type=int, default=10, help='now.xml取得の繰り返し回数')
+    args = parser.parse_args()
+
+    server = standin_server.start()
+    data_dir = tempfile.TemporaryDirectory(prefix='bench_now_')
+    os.makedirs(os.path.join(data_dir.name, 'data'))
+
+    # プロジェクトのモジュールは環境変数を読み込み時に参照するため、設定してからimportする
+    os.environ['RADIKO_BASE_URL'] = f'http://127.0.0.1:{server.server_address[1]}'
+    os.environ['BASE_DIR'] = data_dir.name
+    os.environ.setdefault('RADIKO_RATE', '100000')
+    os.environ.setdefault('RADIKO_RATE_MAX', '100000')
+    os.environ.setdefault('RADIKO_RATE_BURST', '1000')
+
+    import logging
+    logging.basicConfig(level=logging.WARNING)
+
+    import db  # noqa: E402
+    import fetch_programs  # noqa: E402
+    import now_playing  # noqa: E402
+
+    try:
+        db.init_database()
+        fetch_programs.update_all_areas(days=1, mode='date')
+
+        now = int(time.time())
+        started = time.perf_counter()
+        now_playing._get_index(now)
+        build_time = (time.perf_counter() - started) * 1000
+        print(f'index build {build_time:.1f}ms, window={now_playing.NOW_INDEX_HOURS}h, repeat={args.repeat}')
+        print(f'  {"area":>5} {"stations":>8} {"playing":>7} {"index(us)":>10} {"now.xml(us)":>12} {"speedup":>8}')
+
+        for area_id in args.area or DEFAULT_AREAS:
+            index_time, stations = measure(lambda: now_playing.get_now_programs(area_id, now), args.repeat)
+            fetch_time, _ = measure(lambda: fetch_programs.fetch_now_programs(area_id), args.fetch_repeat)
+            playing = sum(1 for station in stations if station['now'])
+            print(f'  {area_id:>5} {len(stations):>8} {playing:>7} {index_time:10.1f} {fetch_time:12.1f} '
+                  f'{fetch_time / index_time:7.0f}x')
+    finally:
+        server.shutdown()
+        data_dir.cleanup()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,131 @@
+"""
+番組表XMLパーサーのマイクロベンチマーク
+
+benchmarks/fixtures 以下の番組表XML（v3/program/station/date, weekly）を対象に、
+旧実装（ET.fromstring + find + strptime）と
+fetch_programs.iter_station_programs（iterparse + スライスによる時刻変換）を比較する
+
+使い方:
+    cd proxy && python benchmarks/bench_parser.py [--repeat 20] [--fixtures DIR]
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from xml.etree import ElementTree as ET
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import fetch_programs  # noqa: E402
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def legacy_parse(content: bytes, station_id: str, station_name: str) -> list:
+    """変更前の fetch_area_programs と同じ解析処理"""
+    def parse_time(time_str):
+        try:
+            return datetime.strptime(time_str, '%Y%m%d%H%M%S').isoformat()
+        except Exception:
+            return time_str
+
+    programs = []
+    station_xml = ET.fromstring(content)
+    for prog in station_xml.findall('.//prog'):
+        title_elem = prog.find('title')
+        desc_elem = prog.find('desc')
+        pfm_elem = prog.find('pfm')
+        info_elem = prog.find('info')
+        url_elem = prog.find('url')
+
+        ft_str = prog.get('ft')
+        to_str = prog.get('to')
+        if not ft_str or not to_str:
+            continue
+
+        programs.append({
+            'stationId': station_id,
+            'stationName': station_name,
+            'title': title_elem.text if title_elem is not None else '',
+            'ft': parse_time(ft_str),
+            'to': parse_time(to_str),
+            'desc': desc_elem.text if desc_elem is not None else '',
+            'pfm': pfm_elem.text if pfm_elem is not None else '',
+            'info': info_elem.text if info_elem is not None else '',
+            'url': url_elem.text if url_elem is not None else ''
+        })
+    return programs
+
+
+def streaming_parse(content: bytes, station_id: str, station_name: str) -> list:
+    return list(fetch_programs.iter_station_programs(content, station_id, station_name))
+
+
+def measure(parser, documents, repeat):
+    """全fixtureをrepeat回解析した所要時間（最良値）とピークメモリを返す"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for content in documents:
+            parser(content, 'BENCH', 'BENCH')
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    peak = 0
+    for content in documents:
+        tracemalloc.start()
+        for _ in parser(content, 'BENCH', 'BENCH'):
+            pass
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    return best, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description='番組表XMLパーサーのベンチマーク')
+    parser.add_argument('--fixtures', default=FIXTURES_DIR, help='fixtureディレクトリ')
+    parser.add_argument('--repeat', type=int, default=20, help='繰り返し回数')
+    args = parser.parse_args()
+
+    paths = sorted(
+        glob.glob(os.path.join(args.fixtures, 'v3/program/station/**/*.xml'), recursive=True)
+    )
+    if not paths:
+        print(f'No fixtures found under {args.fixtures}')
+        return 1
+
+    documents = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            documents.append(f.read())
+
+    # 解析結果が一致することを確認（旧実装の空要素None→''の差は除く）
+    for content in documents:
+        legacy = [
+            {key: (value if value is not None else '') for key, value in prog.items()}
+            for prog in legacy_parse(content, 'BENCH', 'BENCH')
+        ]
+        assert legacy == streaming_parse(content, 'BENCH', 'BENCH'), 'parser output mismatch'
+
+    total_bytes = sum(len(content) for content in documents)
+    total_programs = sum(len(streaming_parse(content, 'BENCH', 'BENCH')) for content in documents)
+    print(f'{len(documents)} fixtures, {total_bytes / 1024:.0f} KB, {total_programs} programs, repeat={args.repeat}')
+
+    results = {}
+    for name, func in (('legacy (fromstring+strptime)', legacy_parse), ('streaming (iterparse)', streaming_parse)):
+        elapsed, peak = measure(func, documents, args.repeat)
+        results[name] = (elapsed, peak)
+        print(f'  {name:30s} {elapsed * 1000:8.2f} ms/pass  '
+              f'{total_programs / elapsed:10.0f} programs/s  peak {peak / 1024:8.1f} KB')
+
+    (legacy_time, legacy_peak), (stream_time, stream_peak) = results.values()
+    print(f'  speedup x{legacy_time / stream_time:.2f}, peak memory x{legacy_peak / max(stream_peak, 1):.2f} smaller')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
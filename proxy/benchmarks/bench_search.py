@@ -0,0 +1,93 @@
+"""
+番組検索（db.search_programs）のベンチマーク
+
+スタンドインサーバー（benchmarks/standin_server.py）から全エリア・前後7日分（15日）の番組表を
+一時ディレクトリのDBに取り込み、キーワードごとに
+全文検索インデックス（programs_fts）とLIKEによる検索の所要時間を比較する。
+
+使い方:
+    cd proxy && python benchmarks/bench_search.py [--repeat 20] [--keyword 伊集院 --keyword ニュース ...]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+
+import standin_server  # noqa: E402
+
+DEFAULT_KEYWORDS = ('伊集院光', 'ニュース', 'スタンバイ', 'お昼の番組', 'ジャズ', 'ACTION', 'クラシック', '番組説明', 'Session')
+
+
+def measure(search, repeat: int):
+    """repeat回検索した所要時間の中央値（ミリ秒）と件数"""
+    times = []
+    count = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        count = len(search())
+        times.append((time.perf_counter() - started) * 1000)
+    return statistics.median(times), count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='番組検索のベンチマーク')
+    parser.add_argument('--keyword', action='append', help='検索キーワード（複数指定可）')
+    parser.add_argument('--area', default='JP13', help='エリア指定検索に使うエリアID')
+    parser.add_argument('--repeat', type=int, default=20, help='1キーワードあたりの繰り返し回数')
+    args = parser.parse_args()
+
+    server = standin_server.start()
+    data_dir = tempfile.TemporaryDirectory(prefix='bench_search_')
+    os.makedirs(os.path.join(data_dir.name, 'data'))
+
+    # プロジェクトのモジュールは環境変数を読み込み時に参照するため、設定してからimportする
+    os.environ['RADIKO_BASE_URL'] = f'http://127.0.0.1:{server.server_address[1]}'
+    os.environ['BASE_DIR'] = data_dir.name
+    os.environ.setdefault('RADIKO_RATE', '100000')
+    os.environ.setdefault('RADIKO_RATE_MAX', '100000')
+    os.environ.setdefault('RADIKO_RATE_BURST', '1000')
+
+    import logging
+    logging.basicConfig(level=logging.WARNING)
+
+    import db  # noqa: E402
+    import fetch_programs  # noqa: E402
+
+    try:
+        db.init_database()
+        fetch_programs.update_all_areas(days=7, mode='weekly')
+
+        with db.connection() as conn:
+            programs = conn.execute('SELECT COUNT(*) FROM programs').fetchone()[0]
+            mappings = sum(bin(mask).count('1') for (mask,) in conn.execute('SELECT area_mask FROM programs'))
+        print(f'{programs} programs, {mappings} area mappings, repeat={args.repeat}')
+        print(f'  {"keyword":16s} {"area":>5} {"hits":>5} {"fts(ms)":>8} {"like(ms)":>9} {"speedup":>8}')
+
+        fts_enabled = db._fts_enabled
+        for keyword in args.keyword or DEFAULT_KEYWORDS:
+            for area_id in (None, args.area):
+                def search():
+                    return db.search_programs(keyword, area_id)
+
+                db._fts_enabled = fts_enabled
+                fts_time, fts_count = measure(search, args.repeat)
+                db._fts_enabled = False
+                like_time, like_count = measure(search, args.repeat)
+                db._fts_enabled = fts_enabled
+
+                hits = str(fts_count) if fts_count == like_count else f'{fts_count}/{like_count}'
+                print(f'  {keyword:16s} {area_id or "-":>5} {hits:>5} {fts_time:8.2f} {like_time:9.2f} '
+                      f'{like_time / fts_time:7.1f}x')
+    finally:
+        server.shutdown()
+        data_dir.cleanup()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
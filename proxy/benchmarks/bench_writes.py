@@ -0,0 +1,91 @@
+"""
+同時書き込み（db.register_recorded_file）のベンチマーク
+
+一時ディレクトリのDBに対して、複数のスレッドから同時に録音ファイルを登録し、
+- direct:  各スレッドが自分の接続で書き込んでコミットする（変更前）
+- writer:  書き込み専用スレッドのキューに入れ、まとめてコミットする（db.submit_write）
+の書き込み件数/秒と、失敗（"database is locked" など）の件数を比較する。
+
+使い方:
+    cd proxy && python benchmarks/bench_writes.py [--threads 8] [--writes 500] [--busy-timeout 5]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+def run(threads: int, writes: int, write) -> tuple:
+    """threads個のスレッドからwrites件ずつ書き込み、(件数/秒, 失敗件数)を返す"""
+    failures = []
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(worker_id):
+        barrier.wait()
+        failed = 0
+        for i in range(writes):
+            if write(f'bench/{worker_id}/{i}.m4a') is None:
+                failed += 1
+        failures.append(failed)
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for thread in workers:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return threads * writes / elapsed, sum(failures)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='同時書き込みのベンチマーク')
+    parser.add_argument('--threads', type=int, default=8, help='書き込むスレッド数')
+    parser.add_argument('--writes', type=int, default=500, help='1スレッドあたりの書き込み件数')
+    parser.add_argument('--busy-timeout', type=float, default=5.0,
+                        help='ロック待ちのタイムアウト秒（DB_TIMEOUT。本番は30秒）')
+    args = parser.parse_args()
+
+    data_dir = tempfile.TemporaryDirectory(prefix='bench_writes_')
+    os.makedirs(os.path.join(data_dir.name, 'data'))
+    # db はDB_PATHを読み込み時に決めるため、設定してからimportする
+    os.environ['BASE_DIR'] = data_dir.name
+
+    import logging
+    logging.basicConfig(level=logging.CRITICAL)
+
+    import db  # noqa: E402
+
+    try:
+        db.DB_TIMEOUT = args.busy_timeout
+        db.init_database()
+
+        def register(func):
+            return lambda path: func(path, os.path.basename(path), program_title='ベンチマーク',
+                                     station_id='TBS', start_time='2026-01-01T12:00:00', file_size=1000)
+
+        print(f'threads={args.threads} writes/thread={args.writes} batch={db.DB_WRITE_BATCH_SIZE}')
+        print(f'  {"":8s} {"writes/s":>10} {"failed":>7}')
+        results = {}
+        for name, write in (
+            ('direct', register(db.register_recorded_file.__wrapped__)),
+            ('writer', register(db.register_recorded_file)),
+        ):
+            with db.connection() as conn:
+                conn.execute('DELETE FROM recorded_files')
+            results[name] = run(args.threads, args.writes, write)
+            print(f'  {name:8s} {results[name][0]:10.0f} {results[name][1]:7d}')
+
+        print(f'  speedup x{results["writer"][0] / results["direct"][0]:.1f}')
+    finally:
+        data_dir.cleanup()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
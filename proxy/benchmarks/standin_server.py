@@ -0,0 +1,316 @@
+"""
+radikoのスタンドイン（代替）HTTPサーバー
+
+benchmarks/fixtures 以下に記録した番組表XMLを、radikoと同じパスで返す。
+クローラーのベンチマークや動作確認で radiko.jp にアクセスせずに済むようにするためのもの。
+
+- v3/program/now/{area_id}.xml             fixtures/v3/program/now/{area_id}.xml
+- v3/program/station/date/{date}/{id}.xml  fixtures/v3/program/station/date/*/{id}.xml
+- v3/program/station/weekly/{id}.xml       fixtures/v3/program/station/weekly/{id}.xml
+
+番組表は要求された日付に合わせて ft/to/date をずらして返す（記録した日付に関係なく再生できる）。
+記録のない放送局は、記録済みの番組表の放送局ID・局名（now/*.xml の局名）を置き換えて返す。
+ETag（If-None-Match → 304）に対応し、遅延・エラーを注入できる。
+
+    GET /__stats  リクエスト数などの統計（JSON）
+    GET /__reset  統計をリセット
+
+使い方:
+    cd proxy && python benchmarks/standin_server.py [--port 18089] [--latency 20] [--jitter 5] [--error-rate 0.01]
+    RADIKO_BASE_URL=http://127.0.0.1:18089 python fetch_programs.py
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from xml.etree import ElementTree as ET
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+_NOW_RE = re.compile(r'^/v3/program/now/(JP\d+)\.xml$')
+_DATE_RE = re.compile(r'^/v3/program/station/date/(\d{8})/([^/]+)\.xml$')
+_WEEKLY_RE = re.compile(r'^/v3/program/station/weekly/([^/]+)\.xml$')
+_SHIFT_RE = re.compile(rb'(ft="|to="|<date>)(\d{8})')
+_STATION_RE = re.compile(rb'<station id="[^"]*">\s*<name>[^<]*</name>')
+
+
+def _broadcast_today() -> datetime:
+    """放送日基準（朝5時未満は前日扱い）の今日"""
+    today = datetime.now()
+    if today.hour < 5:
+        today = today - timedelta(days=1)
+    return today.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _shift_dates(content: bytes, days: int) -> bytes:
+    """ft/to属性と<date>要素の日付をdays日ずらす"""
+    if days == 0:
+        return content
+
+    def shift(match):
+        date = datetime.strptime(match.group(2).decode(), '%Y%m%d') + timedelta(days=days)
+        return match.group(1) + date.strftime('%Y%m%d').encode()
+
+    return _SHIFT_RE.sub(shift, content)
+
+
+def _escape(text: str) -> str:
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+class FixtureStore:
+    """記録した番組表XMLから、要求に応じた応答を組み立てる"""
+
+    def __init__(self, fixtures_dir: str):
+        self.fixtures_dir = fixtures_dir
+        self.lock = threading.Lock()
+        self.cache = {}
+
+        # 放送局ID → 局名（エリアの放送局一覧から）
+        self.station_names = {}
+        for path in sorted(glob.glob(os.path.join(fixtures_dir, 'v3/program/now/*.xml'))):
+            for station in ET.parse(path).getroot().iter('station'):
+                name = station.find('name')
+                self.station_names.setdefault(station.get('id'), name.text if name is not None else '')
+
+        # 放送局ID → [(記録した日付, パス)]
+        self.daily = {}
+        for path in sorted(glob.glob(os.path.join(fixtures_dir, 'v3/program/station/date/*/*.xml'))):
+            date = os.path.basename(os.path.dirname(path))
+            station_id = os.path.splitext(os.path.basename(path))[0]
+            self.daily.setdefault(station_id, []).append((date, path))
+
+        self.weekly = {
+            os.path.splitext(os.path.basename(path))[0]: path
+            for path in sorted(glob.glob(os.path.join(fixtures_dir, 'v3/program/station/weekly/*.xml')))
+        }
+
+    def _read(self, path: str) -> bytes:
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def _template(self, recorded: dict, station_id: str):
+        """記録がない放送局には、放送局IDから決まる記録済みの番組表を使う"""
+        if station_id in recorded:
+            return recorded[station_id], False
+        if not recorded:
+            return None, False
+        keys = sorted(recorded)
+        index = int(hashlib.md5(station_id.encode()).hexdigest(), 16) % len(keys)
+        return recorded[keys[index]], True
+
+    def _rename(self, content: bytes, station_id: str) -> bytes:
+        name = _escape(self.station_names.get(station_id, station_id))
+        replacement = f'<station id="{station_id}">\n<name>{name}</name>'.encode()
+        return _STATION_RE.sub(lambda _: replacement, content, count=1)
+
+    def _cached(self, key, build):
+        with self.lock:
+            if key in self.cache:
+                return self.cache[key]
+        content = build()
+        with self.lock:
+            self.cache[key] = content
+        return content
+
+    def now(self, area_id: str):
+        path = os.path.join(self.fixtures_dir, 'v3/program/now', f'{area_id}.xml')
+        if not os.path.exists(path):
+            return None
+        return self._cached(('now', area_id), lambda: self._read(path))
+
+    def station_date(self, date: str, station_id: str):
+        if station_id not in self.station_names and station_id not in self.daily:
+            return None
+
+        def build():
+            recordings, renamed = self._template(self.daily, station_id)
+            if recordings is None:
+                return None
+            recorded_date, path = recordings[0]
+            days = (datetime.strptime(date, '%Y%m%d') - datetime.strptime(recorded_date, '%Y%m%d')).days
+            content = _shift_dates(self._read(path), days)
+            return self._rename(content, station_id) if renamed else content
+
+        return self._cached(('date', date, station_id), build)
+
+    def station_weekly(self, station_id: str):
+        if station_id not in self.station_names and station_id not in self.weekly:
+            return None
+
+        today = _broadcast_today()
+
+        def build():
+            path, renamed = self._template(self.weekly, station_id)
+            if path is None:
+                return None
+            content = self._read(path)
+            # 記録した週間番組表の最終日を「今日から6日後」に合わせる
+            recorded_dates = [match.decode() for match in re.findall(rb'<date>(\d{8})</date>', content)]
+            last = datetime.strptime(max(recorded_dates), '%Y%m%d')
+            content = _shift_dates(content, (today + timedelta(days=6) - last).days)
+            return self._rename(content, station_id) if renamed else content
+
+        return self._cached(('weekly', today.strftime('%Y%m%d'), station_id), build)
+
+
+class StandinServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, store: FixtureStore, latency=0.0, jitter=0.0,
+                 error_rate=0.0, error_status=503, rate_limit=0, seed=None):
+        super().__init__(address, StandinHandler)
+        self.store = store
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.rate_limit = rate_limit
+        self.random = random.Random(seed)
+        self.stats_lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.stats = {
+                'requests': 0,
+                'now': 0,
+                'date': 0,
+                'weekly': 0,
+                'not_modified': 0,
+                'injected_errors': 0,
+                'rate_limited': 0,
+                'not_found': 0,
+                'bytes': 0,
+                'started_at': time.time(),
+            }
+            self.window = (int(time.time()), 0)
+
+    def count(self, key: str, value: int = 1):
+        with self.stats_lock:
+            self.stats[key] += value
+
+    def over_rate_limit(self) -> bool:
+        """1秒あたりのリクエスト数が rate_limit を超えたか"""
+        if not self.rate_limit:
+            return False
+        with self.stats_lock:
+            second, count = self.window
+            now = int(time.time())
+            if now != second:
+                second, count = now, 0
+            self.window = (second, count + 1)
+            return count + 1 > self.rate_limit
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: bytes = b'', content_type='text/xml; charset=utf-8', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if body and self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        path = self.path.split('?', 1)[0]
+
+        if path == '/__stats':
+            with server.stats_lock:
+                stats = dict(server.stats)
+            stats['elapsed'] = time.time() - stats.pop('started_at')
+            return self._send(200, json.dumps(stats).encode(), 'application/json')
+        if path == '/__reset':
+            server.reset_stats()
+            return self._send(200, b'{}', 'application/json')
+
+        server.count('requests')
+
+        if server.latency or server.jitter:
+            time.sleep(max(0.0, server.random.gauss(server.latency, server.jitter)) / 1000)
+
+        if server.over_rate_limit():
+            server.count('rate_limited')
+            return self._send(429, headers={'Retry-After': '1'})
+
+        if server.error_rate and server.random.random() < server.error_rate:
+            server.count('injected_errors')
+            return self._send(server.error_status)
+
+        content = None
+        if (match := _NOW_RE.match(path)):
+            server.count('now')
+            content = server.store.now(match.group(1))
+        elif (match := _DATE_RE.match(path)):
+            server.count('date')
+            content = server.store.station_date(match.group(1), match.group(2))
+        elif (match := _WEEKLY_RE.match(path)):
+            server.count('weekly')
+            content = server.store.station_weekly(match.group(1))
+
+        if content is None:
+            server.count('not_found')
+            return self._send(404)
+
+        etag = '"' + hashlib.sha1(content).hexdigest() + '"'
+        if self.headers.get('If-None-Match') == etag:
+            server.count('not_modified')
+            return self._send(304, headers={'ETag': etag})
+
+        server.count('bytes', len(content))
+        return self._send(200, content, headers={'ETag': etag})
+
+    do_HEAD = do_GET
+
+
+def start(port: int = 0, host: str = '127.0.0.1', fixtures_dir: str = FIXTURES_DIR, **options) -> StandinServer:
+    """スタンドインサーバーを別スレッドで起動（port=0 で空いているポート）"""
+    server = StandinServer((host, port), FixtureStore(fixtures_dir), **options)
+    threading.Thread(target=server.serve_forever, name='standin-server', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='radikoのスタンドインHTTPサーバー')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=18089)
+    parser.add_argument('--fixtures', default=FIXTURES_DIR, help='fixtureディレクトリ')
+    parser.add_argument('--latency', type=float, default=0.0, help='応答遅延の平均（ミリ秒）')
+    parser.add_argument('--jitter', type=float, default=0.0, help='応答遅延の標準偏差（ミリ秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='エラーを返す割合（0〜1）')
+    parser.add_argument('--error-status', type=int, default=503, help='注入するエラーのステータスコード')
+    parser.add_argument('--rate-limit', type=int, default=0, help='1秒あたりの上限（超えると429）。0で無制限')
+    parser.add_argument('--seed', type=int, default=None, help='遅延・エラー注入の乱数シード')
+    args = parser.parse_args()
+
+    server = StandinServer(
+        (args.host, args.port), FixtureStore(args.fixtures),
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+        error_status=args.error_status, rate_limit=args.rate_limit, seed=args.seed
+    )
+    print(f'radiko stand-in server listening on http://{args.host}:{server.server_address[1]}', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,378 @@
+"""
+番組表クロールの実行管理
+
+定期実行（CRAWL_INTERVAL_MINUTES ごとの scope='priority'）・/programs/update/trigger・
+管理画面のSSE更新は、すべてここからクロール（fetch_programs.update_all_areas）を開始する。
+- 同時に実行できるクロールは1つだけ。実行中に開始要求があった場合は
+  新しく始めずに実行中のクロールに合流する
+- 進捗イベントはジョブに記録され、SSEクライアントは途中からでも購読できる
+  （再接続時は続きから受信）。クライアントが切断してもクロールは止まらない
+- クロールの状態と放送局×日付ごとのチェックポイントをDBに記録し、
+  再起動などで中断したクロールは起動時に続きから再開する
+- scopeで取得対象を絞り込める
+  all: すべて / failed: 前回失敗した放送局×日付のみ / stale: 未取得・失敗・古いもののみ
+  priority: 鮮度の優先度に従って期限切れのものを1時間あたりの予算内で取得（定期実行用）
+
+priorityの鮮度基準（放送日基準）:
+- 今日・明日: CRAWL_NEAR_MAX_AGE_HOURS ごと
+- 明後日以降: CRAWL_FUTURE_MAX_AGE_HOURS ごと
+- 過去の日付: 放送終了後に1回だけ（放送済みの番組表は変わらないため）
+- 取得に失敗したもの: 失敗時刻から CRAWL_FAILURE_BACKOFF_HOURS 後（連続失敗ごとに倍、
+  最大 CRAWL_FAILURE_MAX_BACKOFF_HOURS）に、最終取得が失敗時刻のものとして再取得する
+"""
+import logging
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+import db
+import fetch_programs
+
+logger = logging.getLogger(__name__)
+
+CRAWL_SCOPES = ('all', 'failed', 'stale', 'priority')
+
+# scope='stale' で再取得する、最後の取得からの経過時間
+CRAWL_STALE_HOURS = float(os.environ.get('CRAWL_STALE_HOURS', '24'))
+
+# scope='priority'（定期実行）の設定
+CRAWL_INTERVAL_MINUTES = int(os.environ.get('CRAWL_INTERVAL_MINUTES', '30'))          # 実行間隔
+CRAWL_NEAR_MAX_AGE_HOURS = float(os.environ.get('CRAWL_NEAR_MAX_AGE_HOURS', '3'))     # 今日・明日
+CRAWL_FUTURE_MAX_AGE_HOURS = float(os.environ.get('CRAWL_FUTURE_MAX_AGE_HOURS', '24'))  # 明後日以降
+CRAWL_HOURLY_BUDGET = int(os.environ.get('CRAWL_HOURLY_BUDGET', '120'))               # 1時間あたりのリクエスト数
+CRAWL_PAST_DAYS = int(os.environ.get('CRAWL_PAST_DAYS', '7'))                         # 対象とする過去の日数
+CRAWL_FUTURE_DAYS = int(os.environ.get('CRAWL_FUTURE_DAYS', '7'))                     # 対象とする未来の日数
+CRAWL_FAILURE_BACKOFF_HOURS = float(os.environ.get('CRAWL_FAILURE_BACKOFF_HOURS', '1'))            # 失敗後の再取得間隔
+CRAWL_FAILURE_MAX_BACKOFF_HOURS = float(os.environ.get('CRAWL_FAILURE_MAX_BACKOFF_HOURS', '24'))  # その上限
+
+
+class CrawlJob:
+    """実行中（または最後に実行した）クロール1件"""
+
+    def __init__(self, dates: list, trigger: str, scope: str = 'all', job_id: str = None):
+        self.id = job_id or uuid.uuid4().hex[:12]
+        self.dates = list(dates)
+        self.trigger = trigger
+        self.scope = scope
+        self.resumed = job_id is not None
+        self.status = 'running'
+        self.started_at = datetime.now().isoformat()
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self._events = []
+        self._cond = threading.Condition()
+
+    @property
+    def running(self) -> bool:
+        return self.status == 'running'
+
+    def emit(self, event_type: str, **fields):
+        """進捗イベントを記録して購読者に通知（idは1からの連番）"""
+        with self._cond:
+            event = {'id': len(self._events) + 1, 'type': event_type}
+            event.update(fields)
+            self._events.append(event)
+            self._cond.notify_all()
+
+    def save(self):
+        """実行状態をDBに記録"""
+        db.save_crawl_job(self.id, self.trigger, self.scope, self.dates, self.status,
+                          self.started_at, self.finished_at, self.result, self.error)
+
+    def finish(self, status: str, result=None, error=None):
+        with self._cond:
+            self.status = status
+            self.result = result
+            self.error = error
+            self.finished_at = datetime.now().isoformat()
+        self.save()
+        with self._cond:
+            self._cond.notify_all()
+
+    def wait(self, timeout=None) -> bool:
+        """クロールの終了を待つ"""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self.running, timeout)
+
+    def events(self, after: int = 0, timeout: float = 15.0):
+        """
+        id が after より大きいイベントを順に返す
+
+        新しいイベントがtimeout秒なかった場合はNoneを返す（SSEのkeep-alive用）。
+        クロールが終了し、すべてのイベントを返した時点で終わる。
+        """
+        index = max(0, after)
+        while True:
+            with self._cond:
+                if index >= len(self._events) and self.running:
+                    self._cond.wait(timeout)
+                batch = self._events[index:]
+                finished = not self.running
+
+            if batch:
+                index += len(batch)
+                yield from batch
+            elif finished:
+                return
+            else:
+                yield None
+
+    def to_dict(self) -> dict:
+        return {
+            'id': self.id,
+            'status': self.status,
+            'trigger': self.trigger,
+            'scope': self.scope,
+            'resumed': self.resumed,
+            'date_from': self.dates[0] if self.dates else None,
+            'date_to': self.dates[-1] if self.dates else None,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'events': len(self._events),
+            'result': self.result,
+            'error': self.error
+        }
+
+
+_lock = threading.Lock()
+_current = None  # 実行中または最後に実行したクロール
+
+
+def _broadcast_end(date: str) -> str:
+    """放送日（YYYYMMDD）の放送終了時刻（翌日5:00）"""
+    return (datetime.strptime(date, '%Y%m%d') + timedelta(days=1, hours=5)).isoformat()
+
+
+def _freshness(date: str, now: datetime) -> tuple:
+    """
+    放送日の鮮度基準（モジュールのdocstringを参照）
+
+    Returns:
+        (優先度, この時刻（ISO形式）以降に取得していれば取得不要)
+    """
+    today = fetch_programs.broadcast_today()
+    if date in (today.strftime('%Y%m%d'), (today + timedelta(days=1)).strftime('%Y%m%d')):
+        return 0, (now - timedelta(hours=CRAWL_NEAR_MAX_AGE_HOURS)).isoformat()
+    if date > today.strftime('%Y%m%d'):
+        return 1, (now - timedelta(hours=CRAWL_FUTURE_MAX_AGE_HOURS)).isoformat()
+    # 過去の日付は放送終了後に取得済みなら以後は取得しない
+    return 2, _broadcast_end(date)
+
+
+def is_due(date: str, updated_at) -> bool:
+    """放送日の番組表の最終取得時刻（ISO形式、未取得はNone）が鮮度基準より古いか"""
+    return not updated_at or updated_at < _freshness(date, datetime.now())[1]
+
+
+def _failure_backoff(failures: int) -> timedelta:
+    """連続failures回失敗した放送局×日付を再取得するまでの間隔"""
+    hours = CRAWL_FAILURE_BACKOFF_HOURS * 2 ** min(max(failures, 1) - 1, 16)
+    return timedelta(hours=min(hours, CRAWL_FAILURE_MAX_BACKOFF_HOURS))
+
+
+def _select_by_priority(units: dict, station_ids: list, dates: list) -> set:
+    """
+    期限切れの放送局×日付を優先度順に選び、1時間あたりの予算内に収める
+
+    優先度: 今日・明日 > 明後日以降 > 過去の日付。同じ優先度では最終取得が古い順
+    （未取得が先。失敗したものは再取得の間隔が過ぎるまで選ばず、失敗時刻を最終取得とする）。
+    weeklyモードでは週間番組表1回で全日付を取得できるため、予算は放送局単位で数え、
+    選んだ放送局は期限切れの日付をまとめて取得する。
+    """
+    now = datetime.now()
+
+    due = []
+    for date in dates:
+        priority, fresh_after = _freshness(date, now)
+
+        for station_id in station_ids:
+            unit = units.get((station_id, date))
+            last = unit['updated_at'] if unit else ''
+            if unit and unit['status'] == 'failed':
+                if last > (now - _failure_backoff(unit['failures'])).isoformat():
+                    continue
+            elif last and last >= fresh_after:
+                continue
+            due.append((priority, last, station_id, date))
+
+    due.sort()
+
+    budget = CRAWL_HOURLY_BUDGET - db.get_crawl_request_count((now - timedelta(hours=1)).isoformat())
+    if budget <= 0 or not due:
+        logger.info(f'⏳ Priority crawl: {len(due)} units due, budget {max(budget, 0)} requests left this hour')
+        return set()
+
+    selected = set()
+    if fetch_programs.FETCH_MODE == 'weekly':
+        # 週間番組表に含まれない日付（翌週分など）は日付指定で補完されるため、その分も予算に含める
+        weekly_cache = {
+            station_id: set(entry.get('covered_dates') or [])
+            for (station_id, key), entry in db.get_fetch_cache().items()
+            if key == 'weekly'
+        }
+        due_by_station = {}
+        for _, _, station_id, date in due:
+            due_by_station.setdefault(station_id, []).append(date)
+
+        # 前回の記録がない放送局は、週間番組表が今日から6日後までを含むものとして見積もる
+        default_covered = set(fetch_programs.crawl_dates(-CRAWL_PAST_DAYS, 6))
+
+        cost = 0
+        for station_id, station_dates in due_by_station.items():
+            covered = weekly_cache.get(station_id) or default_covered
+            station_cost = 1 + sum(1 for date in station_dates if date not in covered)
+            if cost + station_cost > budget:
+                break
+            cost += station_cost
+            selected.update((station_id, date) for date in station_dates)
+    else:
+        selected = {(station_id, date) for _, _, station_id, date in due[:budget]}
+
+    logger.info(f'🎯 Priority crawl: {len(selected)} of {len(due)} due units selected (budget {budget} requests)')
+    return selected
+
+
+def _unit_selector(job: CrawlJob):
+    """scopeと再開状況から、取得する放送局×日付を選ぶ関数を作る（全件ならNone）"""
+    if job.scope == 'all' and not job.resumed:
+        return None
+
+    def select_units(station_ids, dates):
+        units = db.get_crawl_units(dates)
+
+        # 再開時はこのクロールで取得済みのものを飛ばす
+        done = {
+            key for key, unit in units.items()
+            if job.resumed and unit['job_id'] == job.id and unit['status'] == 'done'
+        }
+
+        if job.scope == 'priority':
+            return _select_by_priority(units, station_ids, dates) - done
+
+        stale_before = (datetime.now() - timedelta(hours=CRAWL_STALE_HOURS)).isoformat()
+        selected = set()
+        for station_id in station_ids:
+            for date in dates:
+                unit = units.get((station_id, date))
+                if (station_id, date) in done:
+                    continue
+                if job.scope == 'failed' and not (unit and unit['status'] == 'failed'):
+                    continue
+                if job.scope == 'stale' and unit and unit['status'] == 'done' and unit['updated_at'] >= stale_before:
+                    continue
+                selected.add((station_id, date))
+        return selected
+
+    return select_units
+
+
+def _run(job: CrawlJob):
+    try:
+        if job.resumed:
+            job.emit('info', message='中断されたクロールを再開します')
+        result = fetch_programs.update_all_areas(
+            dates=job.dates,
+            on_event=job.emit,
+            select_units=_unit_selector(job),
+            job_id=job.id
+        )
+    except Exception as e:
+        logger.error(f'❌ Crawl {job.id} failed: {str(e)}')
+        job.emit('complete', total_programs=0, success=0, error=1, warning=0,
+                 message=f'更新に失敗しました: {str(e)}')
+        job.finish('failed', error=str(e))
+        return
+
+    job.emit('complete',
+             total_programs=result['programs'],
+             success=result['success'] + result['unchanged'],
+             unchanged=result['unchanged'],
+             error=result['errors'],
+             warning=result['warnings'],
+             message='更新が完了しました')
+    job.finish('completed', result=result)
+    logger.info(f'✅ Crawl {job.id} completed')
+
+
+def start_crawl(dates=None, days: int = 7, trigger: str = 'manual', scope: str = 'all', job_id: str = None):
+    """
+    クロールを開始する
+
+    実行中のクロールがある場合は新しく始めずにそれを返す。
+
+    Args:
+        dates: 取得する日付リスト（省略時は -days日〜+days日。空のリストは不可）
+        days: datesを省略した場合の日数（1以上）
+        trigger: 開始要求元（ログ・ステータス表示用）
+        scope: 'all' / 'failed' / 'stale' / 'priority'（定期実行用。鮮度の優先度と1時間あたりの予算で選ぶ）
+        job_id: 中断したクロールを再開する場合のID
+
+    Returns:
+        (CrawlJob, 新しく開始したか)
+    """
+    global _current
+
+    if scope not in CRAWL_SCOPES:
+        raise ValueError(f'Invalid crawl scope: {scope}')
+    if dates is None:
+        if days < 1:
+            raise ValueError(f'Invalid crawl days: {days}')
+        dates = fetch_programs.crawl_dates(-days, days)
+    elif not dates:
+        raise ValueError('No dates to crawl')
+
+    with _lock:
+        if _current is not None and _current.running:
+            logger.info(f'🔁 Crawl {_current.id} is already running, attaching ({trigger})')
+            return _current, False
+
+        job = CrawlJob(dates, trigger, scope, job_id)
+        job.save()
+        _current = job
+
+    logger.info(f'🚀 Crawl {job.id} started ({trigger}, scope={scope}, {job.dates[0]} to {job.dates[-1]})')
+    thread = threading.Thread(target=_run, args=(job,), name=f'crawl-{job.id}', daemon=True)
+    thread.start()
+    return job, True
+
+
+def run_scheduled():
+    """鮮度の優先度に従った定期クロール（スケジューラーから CRAWL_INTERVAL_MINUTES ごとに実行）"""
+    job = get_current_job()
+    if job is not None and job.running:
+        logger.info(f'⏭️ Crawl {job.id} is running, skipping scheduled crawl')
+        return None
+
+    job, _ = start_crawl(
+        dates=fetch_programs.crawl_dates(-CRAWL_PAST_DAYS, CRAWL_FUTURE_DAYS),
+        trigger='schedule',
+        scope='priority'
+    )
+    job.wait()
+    return job.result
+
+
+def resume_interrupted():
+    """
+    中断されたクロール（DB上でrunningのまま残っているもの）を再開する（起動時用）
+
+    最新の1件のみ続きから再開し、それ以前のものは interrupted にする。
+    """
+    jobs = db.get_running_crawl_jobs()
+    if not jobs:
+        return None
+
+    latest, older = jobs[0], jobs[1:]
+    for job in older:
+        db.save_crawl_job(job['id'], job['trigger'], job['scope'], job['dates'], 'interrupted', job['started_at'])
+
+    logger.info(f'♻️ Resuming interrupted crawl {latest["id"]} (started at {latest["started_at"]})')
+    job, _ = start_crawl(dates=latest['dates'], trigger='resume', scope=latest['scope'] or 'all', job_id=latest['id'])
+    return job
+
+
+def get_current_job():
+    """実行中または最後に実行したクロール（未実行ならNone）"""
+    return _current
@@ -2,8 +2,17 @@
 番組表キャッシュ用のデータベースモジュール
 """
 import sqlite3
+import base64
+import itertools
+import json
 import logging
-from datetime import datetime
+import queue
+import threading
+import unicodedata
+from concurrent.futures import Future
+from contextlib import contextmanager
+from functools import lru_cache, wraps
+from datetime import datetime, timedelta, timezone
 from typing import List, Dict, Optional
 import os
 import time
@@ -17,224 +26,623 @@ DB_PATH = os.path.join(BASE_DIR, 'data', 'programs.db')
 
 # DB接続設定
 DB_TIMEOUT = 30.0  # 30秒タイムアウト（デフォルト5秒から延長）
-MAX_RETRIES = 3    # 最大リトライ回数
 
+# 書き込み専用スレッドが1つのトランザクションにまとめる書き込みの最大数
+DB_WRITE_BATCH_SIZE = int(os.environ.get('DB_WRITE_BATCH_SIZE', '64'))
 
-def get_db_connection():
+
+# 接続ごとにキャッシュするプリペアドステートメントの数（sqlite3のデフォルトは128）
+DB_CACHED_STATEMENTS = int(os.environ.get('DB_CACHED_STATEMENTS', '256'))
+
+# スレッドごとのSQLite接続
+_local = threading.local()
+
+# 番組検索に全文検索インデックス（programs_fts）を使うか（Noneは未確認）
+_fts_enabled = None
+
+# 番組表の更新回数（このプロセス内）。番組表から作るキャッシュ（now_playing）の無効化に使う
+_programs_versions = itertools.count(1)
+_programs_version = 0
+
+# trigramで索引検索できる最短のキーワード長（これより短い場合はLIKEで検索）
+FTS_MIN_KEYWORD_LENGTH = 3
+
+# 検索用に正規化した列（元の列 → 正規化した列）
+SEARCH_KEY_COLUMNS = {
+    'programs': {'title': 'title_key', 'performer': 'performer_key', 'description': 'description_key'},
+    'recorded_files': {'program_title': 'program_title_key', 'file_name': 'file_name_key'},
+}
+
+# カタカナ → ひらがな（ァ〜ヶ → ぁ〜ゖ）
+_KANA_FOLD = {code: code - 0x60 for code in range(0x30A1, 0x30F7)}
+
+
+def search_key(text) -> str:
+    """
+    検索用に正規化した文字列
+
+    - NFKC（全角英数字・半角カナなどを統一: ＡＢＣ→ABC、ｶﾅ→カナ）
+    - カタカナをひらがなに
+    - 英字を小文字に
+    """
+    if not text:
+        return ''
+    return unicodedata.normalize('NFKC', text).translate(_KANA_FOLD).lower()
+
+
+# 番組表・録音の時刻（タイムゾーンなし）は日本時間
+LOCAL_TZ = timezone(timedelta(hours=9))
+
+# 時刻の列 → エポック秒（INTEGER）の列。時間帯の絞り込みはエポック秒の列で行う
+EPOCH_COLUMNS = {
+    'programs': {'start_time': 'start_ts', 'end_time': 'end_ts'},
+    'recorded_files': {'start_time': 'start_ts'},
+}
+
+
+def to_epoch(value) -> Optional[int]:
+    """
+    時刻をエポック秒に変換（解釈できない場合はNone）
+
+    ISO形式（YYYY-MM-DDTHH:MM:SS）のほか、YYYYMMDDHHmm / YYYYMMDDHHmmss も受け付ける。
+    タイムゾーンのない時刻は日本時間として扱う。
+    """
+    if not value:
+        return None
+    text = str(value)
+    if text.isdigit() and len(text) in (12, 14):
+        text = f'{text[0:4]}-{text[4:6]}-{text[6:8]}T{text[8:10]}:{text[10:12]}:{text[12:14] or "00"}'
+    try:
+        dt = datetime.fromisoformat(text)
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=LOCAL_TZ)
+    return int(dt.timestamp())
+
+
+# エリア数（JP1〜JP47）。programs.area_mask のビット i がエリア JP{i+1}
+AREA_COUNT = 47
+
+
+def area_bit(area_id: str) -> int:
+    """エリアIDに対応する area_mask のビット"""
+    number = int(area_id[2:]) if area_id.startswith('JP') and area_id[2:].isdigit() else 0
+    if not 1 <= number <= AREA_COUNT:
+        raise ValueError(f'Unknown area: {area_id}')
+    return 1 << (number - 1)
+
+
+@lru_cache(maxsize=4096)
+def _area_ids_from_mask(area_mask: int) -> tuple:
+    area_ids = []
+    while area_mask:
+        bit = area_mask & -area_mask
+        area_ids.append(f'JP{bit.bit_length()}')
+        area_mask ^= bit
+    return tuple(area_ids)
+
+
+def area_ids_from_mask(area_mask: int) -> List[str]:
+    """area_mask をエリアIDのリストに戻す（JP1, JP2, ... の順）"""
+    # 同じ放送局の番組は同じ area_mask になるため、変換結果を使い回す
+    return list(_area_ids_from_mask(area_mask))
+
+
+def programs_version() -> int:
+    """番組表が更新されるたびに増える番号（このプロセス内で保存・削除した分）"""
+    return _programs_version
+
+
+def _programs_changed():
+    """番組表の更新回数を進める（コミット後。コミット前に読まれたキャッシュが新しい版として残らないように）"""
+    def bump():
+        global _programs_version
+        _programs_version = next(_programs_versions)
+    _after_commit(bump)
+
+
+def _open_connection():
     """
-    SQLite接続を取得（同時アクセス対応設定付き）
+    SQLite接続を作成（同時アクセス対応設定付き）
 
     - WALモード: 読み書き同時実行可能
     - 長いタイムアウト: ロック待ち30秒
-    - isolation_level=None: autocommitモード（デッドロック回避）
     """
-    conn = sqlite3.connect(DB_PATH, timeout=DB_TIMEOUT, isolation_level=None)
+    # 初回起動時（データディレクトリがない場合）も接続できるように作っておく
+    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+    conn = sqlite3.connect(DB_PATH, timeout=DB_TIMEOUT, cached_statements=DB_CACHED_STATEMENTS)
     # WALモードを有効化（読み書き同時実行可能）
     conn.execute('PRAGMA journal_mode=WAL')
     # BUSY時のタイムアウトを設定
     conn.execute(f'PRAGMA busy_timeout={int(DB_TIMEOUT * 1000)}')
+    # 一時テーブル（番組の一括書き込み用）はメモリに置く
+    conn.execute('PRAGMA temp_store=MEMORY')
     return conn
 
 
-def execute_with_retry(func, *args, **kwargs):
+@contextmanager
+def connection():
     """
-    DB操作をリトライ付きで実行
+    このスレッドのSQLite接続を使う
+
+    接続はスレッドごとに1回だけ開いて使い回す（PRAGMAの設定も1回だけ）。
+    同じ接続を使い続けるため、sqlite3のプリペアドステートメントのキャッシュも効く。
+    ブロックを抜けるとコミット、例外の場合はロールバックする（入れ子の場合は一番外側のブロックで）。
+    トランザクション中の入れ子のブロックはセーブポイントになり、例外の場合はそのブロックの変更だけ取り消す。
+    書き込みは書き込み専用スレッド（submit_write / @_writes）で行い、他のスレッドの接続は読み込みに使う。
 
-    OperationalError (database is locked) が発生した場合、
-    指数バックオフでリトライする
+        with db.connection() as conn:
+            conn.execute(...)
     """
-    for attempt in range(MAX_RETRIES):
-        try:
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.path != DB_PATH or _local.pid != os.getpid():
+        # fork後の子プロセスでは親の接続を使わない（閉じると親の接続に影響するため破棄だけする）
+        if conn is not None and _local.pid == os.getpid():
+            conn.close()
+        conn = _open_connection()
+        _local.conn = conn
+        _local.path = DB_PATH
+        _local.pid = os.getpid()
+        _local.depth = 0
+        _local.after_commit = []
+
+    outermost = _local.depth == 0
+    savepoint = None
+    if outermost:
+        conn.row_factory = None
+        _local.after_commit = []
+    elif conn.in_transaction:
+        # トランザクション中の入れ子のブロックはセーブポイントにし、例外の場合はブロック内の変更だけ取り消す
+        savepoint = f'nested_{_local.depth}'
+        conn.execute(f'SAVEPOINT {savepoint}')
+
+    _local.depth += 1
+    try:
+        yield conn
+    except BaseException:
+        if outermost:
+            _local.after_commit = []
+            if conn.in_transaction:
+                conn.rollback()
+        elif savepoint is not None and conn.in_transaction:
+            conn.execute(f'ROLLBACK TO {savepoint}')
+            conn.execute(f'RELEASE {savepoint}')
+        raise
+    else:
+        if savepoint is not None:
+            conn.execute(f'RELEASE {savepoint}')
+        if outermost:
+            if conn.in_transaction:
+                try:
+                    conn.commit()
+                except BaseException:
+                    _local.after_commit = []
+                    conn.rollback()
+                    raise
+            callbacks, _local.after_commit = _local.after_commit, []
+            for callback in callbacks:
+                callback()
+    finally:
+        _local.depth -= 1
+
+
+def _after_commit(callback):
+    """
+    このスレッドのトランザクションがコミットされた後にcallbackを実行する
+    （connection()のブロックの外で呼ばれた場合はすぐに実行する。ロールバックされた場合は実行しない）
+    """
+    if getattr(_local, 'depth', 0) > 0:
+        _local.after_commit.append(callback)
+    else:
+        callback()
+
+
+class _Writer:
+    """
+    書き込み専用スレッド
+
+    DBへの書き込みはすべてこのスレッドの接続（唯一の書き込み用の接続）で行う。
+    キューに溜まった書き込みを最大 DB_WRITE_BATCH_SIZE 件ずつ1つのトランザクション
+    （BEGIN IMMEDIATE）で実行し、コミットしてから各呼び出し元のFutureに結果を返す。
+    書き込み同士がロックを奪い合わないため "database is locked" にならず、コミットの回数も減る。
+
+    1件ごとにセーブポイントで区切るため、例外になった書き込みの変更だけが取り消される。
+    コミットに失敗した場合は、まとめた書き込みを1件ずつのトランザクションでやり直す。
+    """
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+        self.thread.start()
+
+    def submit(self, func, args, kwargs) -> Future:
+        future = Future()
+        self.queue.put((future, func, args, kwargs))
+        return future
+
+    def _run(self):
+        _local.writer = True
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < DB_WRITE_BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            batch = [op for op in batch if op[0].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            try:
+                outcomes = self._execute(batch)
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0][0].set_exception(e)
+                    continue
+                logger.warning(f'⚠️ DB write batch of {len(batch)} failed, retrying one by one: {str(e)}')
+                for op in batch:
+                    try:
+                        (outcome,) = self._execute([op])
+                    except Exception as retry_error:
+                        op[0].set_exception(retry_error)
+                    else:
+                        self._resolve(op[0], outcome)
+                continue
+
+            for op, outcome in zip(batch, outcomes):
+                self._resolve(op[0], outcome)
+
+    @staticmethod
+    def _execute(batch) -> list:
+        """書き込みをまとめて1つのトランザクションで実行し、[(結果, 例外), ...]を返す"""
+        outcomes = []
+        with connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            for _, func, args, kwargs in batch:
+                conn.row_factory = None
+                try:
+                    with connection():
+                        outcomes.append((func(*args, **kwargs), None))
+                except Exception as e:
+                    outcomes.append((None, e))
+        return outcomes
+
+    @staticmethod
+    def _resolve(future: Future, outcome):
+        result, error = outcome
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def submit_write(func, *args, **kwargs) -> Future:
+    """
+    書き込み（func(*args, **kwargs)）を書き込み専用スレッドのキューに入れ、Futureを返す
+
+    funcは書き込み専用スレッドで、他の書き込みとまとめたトランザクションの中で実行される
+    （func内の connection() は入れ子のブロックになる）。Futureはコミット後に結果が入る。
+
+        future = db.submit_write(db.delete_recorded_file, path)
+        deleted = future.result()
+    """
+    global _writer
+    writer = _writer
+    if writer is None or writer.pid != os.getpid():
+        with _writer_lock:
+            # fork後の子プロセスには親の書き込みスレッドがないため作り直す
+            if _writer is None or _writer.pid != os.getpid():
+                _writer = _Writer()
+            writer = _writer
+    return writer.submit(func, args, kwargs)
+
+
+def _writes(func):
+    """
+    書き込みを行う関数を、書き込み専用スレッドで実行するようにする（呼び出し元はコミットまで待つ）
+
+    書き込み専用スレッドの中から呼ばれた場合（書き込みの中の書き込み）はそのまま実行する。
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if getattr(_local, 'writer', False):
             return func(*args, **kwargs)
-        except sqlite3.OperationalError as e:
-            if 'locked' in str(e).lower() and attempt < MAX_RETRIES - 1:
-                wait_time = 0.1 * (2 ** attempt)  # 0.1s, 0.2s, 0.4s
-                logger.warning(f'⚠️ DB locked, retrying in {wait_time}s... (attempt {attempt + 1}/{MAX_RETRIES})')
-                time.sleep(wait_time)
-            else:
-                raise
-    raise sqlite3.OperationalError(f'Failed after {MAX_RETRIES} retries')
+        return submit_write(func, *args, **kwargs).result()
+    return wrapper
 
+@_writes
 def init_database():
     """データベースを初期化"""
     try:
-        # データディレクトリを作成
-        os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+        with connection() as conn:
+            cursor = conn.cursor()
 
-        conn = get_db_connection()
-        cursor = conn.cursor()
+            logger.info('🔧 Initializing database with WAL mode for concurrent access...')
 
-        logger.info('🔧 Initializing database with WAL mode for concurrent access...')
+            # programsテーブル：番組データ本体（重複なし）
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS programs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    station_id TEXT NOT NULL,
+                    station_name TEXT,
+                    title TEXT NOT NULL,
+                    start_time TEXT NOT NULL,
+                    end_time TEXT NOT NULL,
+                    description TEXT,
+                    performer TEXT,
+                    info TEXT,
+                    url TEXT,
+                    date TEXT NOT NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    title_key TEXT,
+                    performer_key TEXT,
+                    description_key TEXT,
+                    area_mask INTEGER NOT NULL DEFAULT 0,
+                    start_ts INTEGER,
+                    end_ts INTEGER,
+                    UNIQUE(station_id, start_time)
+                )
+            ''')
 
-        # programsテーブル：番組データ本体（重複なし）
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS programs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                station_id TEXT NOT NULL,
-                station_name TEXT,
-                title TEXT NOT NULL,
-                start_time TEXT NOT NULL,
-                end_time TEXT NOT NULL,
-                description TEXT,
-                performer TEXT,
-                info TEXT,
-                url TEXT,
-                date TEXT NOT NULL,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(station_id, start_time)
-            )
-        ''')
+            # マイグレーション：program_areas → programs.area_mask
+            migrate_program_area_mask(cursor)
 
-        # program_areasテーブル：どのエリアで聴けるかのマッピング
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS program_areas (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                program_id INTEGER NOT NULL,
-                area_id TEXT NOT NULL,
-                UNIQUE(program_id, area_id),
-                FOREIGN KEY (program_id) REFERENCES programs(id) ON DELETE CASCADE
-            )
-        ''')
+            # インデックス作成
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_search
+                ON programs(title, performer, description)
+            ''')
 
-        # インデックス作成
-        cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_search
-            ON programs(title, performer, description)
-        ''')
+            # エリア・日付の番組表用（area_mask は索引の中で判定し、該当する番組だけ読む）
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_programs_date_area
+                ON programs(date, start_time, area_mask)
+            ''')
+            cursor.execute('DROP INDEX IF EXISTS idx_date')
 
-        cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_date
-            ON programs(date)
-        ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_station_start
+                ON programs(station_id, start_time)
+            ''')
 
-        cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_station_start
-            ON programs(station_id, start_time)
-        ''')
+            # 放送局マスタ
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS stations (
+                    station_id TEXT PRIMARY KEY,
+                    station_name TEXT,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
 
-        cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_program_areas_area
-            ON program_areas(area_id)
-        ''')
+            # エリア→放送局一覧のキャッシュ（v3/program/now/{area}.xml の代わり）
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS area_stations (
+                    area_id TEXT NOT NULL,
+                    station_id TEXT NOT NULL,
+                    sort_order INTEGER DEFAULT 0,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (area_id, station_id)
+                )
+            ''')
 
-        cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_program_areas_program
-            ON program_areas(program_id)
-        ''')
+            # 番組表XMLの条件付き取得用キャッシュ（放送局×日付、週間番組表はdate='weekly'）
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS fetch_cache (
+                    station_id TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    etag TEXT,
+                    last_modified TEXT,
+                    content_hash TEXT,
+                    covered_dates TEXT,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (station_id, date)
+                )
+            ''')
 
-        # メタデータテーブル（最終更新時刻を記録）
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS update_log (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                area_id TEXT NOT NULL,
-                date TEXT NOT NULL,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                status TEXT,
-                UNIQUE(area_id, date)
-            )
-        ''')
+            # 取得した番組表XMLのアーカイブ索引（実体は xml_archive のディレクトリに内容アドレスで保存）
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS xml_archive (
+                    kind TEXT NOT NULL,
+                    station_id TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    digest TEXT NOT NULL,
+                    size INTEGER,
+                    fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE(kind, station_id, date, digest)
+                )
+            ''')
 
-        # cron予約テーブル（定期録音）
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS cron_jobs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                minute TEXT NOT NULL,
-                hour TEXT NOT NULL,
-                day_of_month TEXT NOT NULL,
-                month TEXT NOT NULL,
-                day_of_week TEXT NOT NULL,
-                command TEXT NOT NULL,
-                title TEXT,
-                station TEXT,
-                start_time TEXT,
-                end_time TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_xml_archive_latest
+                ON xml_archive(kind, station_id, date, fetched_at)
+            ''')
 
-        # at予約テーブル（1回限りの録音）
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS at_jobs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                job_id TEXT UNIQUE,
-                schedule_time TEXT NOT NULL,
-                command TEXT NOT NULL,
-                title TEXT,
-                station TEXT,
-                start_time TEXT,
-                end_time TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+            # 番組表クロールの実行履歴（再開用）
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS crawl_jobs (
+                    id TEXT PRIMARY KEY,
+                    trigger TEXT,
+                    scope TEXT,
+                    dates TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    started_at TIMESTAMP,
+                    finished_at TIMESTAMP,
+                    result TEXT,
+                    error TEXT
+                )
+            ''')
 
-        # アートワークテーブル（番組タイトルごとのアートワーク）
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS artworks (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT NOT NULL UNIQUE,
-                image_data BLOB NOT NULL,
-                mime_type TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+            # クロールのチェックポイント（放送局×日付ごとの最新の取得結果）
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS crawl_units (
+                    station_id TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    job_id TEXT,
+                    error TEXT,
+                    failures INTEGER NOT NULL DEFAULT 0,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (station_id, date)
+                )
+            ''')
 
-        # 録音ファイル管理テーブル
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS recorded_files (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                file_path TEXT NOT NULL UNIQUE,
-                file_name TEXT NOT NULL,
-                program_id INTEGER,
-                program_title TEXT,
-                station_id TEXT,
-                station_name TEXT,
-                broadcast_date TEXT,
-                start_time TEXT,
-                end_time TEXT,
-                file_size INTEGER,
-                duration REAL,
-                file_modified TIMESTAMP,
-                virtual_folder_id INTEGER,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (program_id) REFERENCES programs(id) ON DELETE SET NULL,
-                FOREIGN KEY (virtual_folder_id) REFERENCES virtual_folders(id) ON DELETE SET NULL
-            )
-        ''')
+            # マイグレーション：連続失敗回数（失敗した放送局×日付の再取得の間隔に使う）
+            cursor.execute('PRAGMA table_info(crawl_units)')
+            if 'failures' not in [row[1] for row in cursor.fetchall()]:
+                cursor.execute('ALTER TABLE crawl_units ADD COLUMN failures INTEGER NOT NULL DEFAULT 0')
 
-        # 仮想フォルダテーブル
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS virtual_folders (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                parent_id INTEGER,
-                color TEXT,
-                icon TEXT,
-                sort_order INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (parent_id) REFERENCES virtual_folders(id) ON DELETE CASCADE
-            )
-        ''')
+            # メタデータテーブル（最終更新時刻を記録）
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS update_log (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    area_id TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    status TEXT,
+                    UNIQUE(area_id, date)
+                )
+            ''')
 
-        # 録音ファイル用インデックス
-        cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_recorded_files_program_title
-            ON recorded_files(program_title)
-        ''')
+            # cron予約テーブル（定期録音）
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS cron_jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    minute TEXT NOT NULL,
+                    hour TEXT NOT NULL,
+                    day_of_month TEXT NOT NULL,
+                    month TEXT NOT NULL,
+                    day_of_week TEXT NOT NULL,
+                    command TEXT NOT NULL,
+                    title TEXT,
+                    station TEXT,
+                    start_time TEXT,
+                    end_time TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
 
-        cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_recorded_files_broadcast_date
-            ON recorded_files(broadcast_date)
-        ''')
+            # at予約テーブル（1回限りの録音）
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS at_jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_id TEXT UNIQUE,
+                    schedule_time TEXT NOT NULL,
+                    command TEXT NOT NULL,
+                    title TEXT,
+                    station TEXT,
+                    start_time TEXT,
+                    end_time TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
 
-        cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_recorded_files_station
-            ON recorded_files(station_id)
-        ''')
+            # アートワークテーブル（番組タイトルごとのアートワーク）
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS artworks (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    title TEXT NOT NULL UNIQUE,
+                    image_data BLOB NOT NULL,
+                    mime_type TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+            # 録音ファイル管理テーブル
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS recorded_files (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    file_path TEXT NOT NULL UNIQUE,
+                    file_name TEXT NOT NULL,
+                    program_id INTEGER,
+                    program_title TEXT,
+                    station_id TEXT,
+                    station_name TEXT,
+                    broadcast_date TEXT,
+                    start_time TEXT,
+                    end_time TEXT,
+                    file_size INTEGER,
+                    duration REAL,
+                    file_modified TIMESTAMP,
+                    virtual_folder_id INTEGER,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    program_title_key TEXT,
+                    file_name_key TEXT,
+                    start_ts INTEGER,
+                    FOREIGN KEY (program_id) REFERENCES programs(id) ON DELETE SET NULL,
+                    FOREIGN KEY (virtual_folder_id) REFERENCES virtual_folders(id) ON DELETE SET NULL
+                )
+            ''')
+
+            # 仮想フォルダテーブル
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS virtual_folders (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    parent_id INTEGER,
+                    color TEXT,
+                    icon TEXT,
+                    sort_order INTEGER DEFAULT 0,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (parent_id) REFERENCES virtual_folders(id) ON DELETE CASCADE
+                )
+            ''')
+
+            # 録音ファイル用インデックス
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_recorded_files_program_title
+                ON recorded_files(program_title)
+            ''')
+
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_recorded_files_broadcast_date
+                ON recorded_files(broadcast_date)
+            ''')
+
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_recorded_files_station
+                ON recorded_files(station_id)
+            ''')
+
+            # ファイル一覧（新しい順）のページング用インデックス
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_recorded_files_folder_modified
+                ON recorded_files(virtual_folder_id, file_modified)
+            ''')
+
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_recorded_files_modified
+                ON recorded_files(file_modified)
+            ''')
+
+            # マイグレーション：時刻のエポック秒の列を追加
+            migrate_epoch_columns(cursor)
+
+            # 時間帯の絞り込み用（開始時刻の範囲・放送中の番組）
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_programs_start_ts
+                ON programs(start_ts, end_ts)
+            ''')
+
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_recorded_files_start_ts
+                ON recorded_files(start_ts)
+            ''')
+
+            # マイグレーション：検索用に正規化した列を追加
+            migrate_search_keys(cursor)
 
-        conn.close()
+            # 番組検索用の全文検索インデックス
+            init_program_search_index(cursor)
 
         logger.info(f'✅ Database initialized: {DB_PATH} (WAL mode enabled)')
 
@@ -251,152 +659,842 @@ def init_database():
         return False
 
 
+def migrate_program_area_mask(cursor):
+    """
+    エリアのマッピングを program_areas テーブルから programs.area_mask に移す
+
+    area_mask がなければ追加し、program_areas が残っていれば
+    番組ごとのエリアをビットにまとめて書き込み、program_areas を削除する
+    """
+    cursor.execute('PRAGMA table_info(programs)')
+    if 'area_mask' not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute('ALTER TABLE programs ADD COLUMN area_mask INTEGER NOT NULL DEFAULT 0')
+        logger.info('✅ Migration: Added area_mask to programs table')
+
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'program_areas'")
+    if cursor.fetchone() is None:
+        return
+
+    masks = {}
+    cursor.execute('SELECT program_id, area_id FROM program_areas')
+    for program_id, area_id in cursor.fetchall():
+        try:
+            masks[program_id] = masks.get(program_id, 0) | area_bit(area_id)
+        except ValueError:
+            logger.warning(f'⚠️ Migration: Skipped unknown area {area_id} for program {program_id}')
+
+    cursor.executemany('UPDATE programs SET area_mask = ? WHERE id = ?',
+                       [(mask, program_id) for program_id, mask in masks.items()])
+    cursor.execute('DROP TABLE program_areas')
+    logger.info(f'✅ Migration: Moved area mappings of {len(masks)} programs to programs.area_mask')
+
+
+def migrate_epoch_columns(cursor):
+    """時刻のエポック秒の列（EPOCH_COLUMNS）がなければ追加し、既存の行を埋める"""
+    for table, epoch_columns in EPOCH_COLUMNS.items():
+        cursor.execute(f'PRAGMA table_info({table})')
+        existing = {row[1] for row in cursor.fetchall()}
+        added = [epoch_column for epoch_column in epoch_columns.values() if epoch_column not in existing]
+        if not added:
+            continue
+
+        for epoch_column in added:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {epoch_column} INTEGER')
+            logger.info(f'✅ Migration: Added {epoch_column} to {table} table')
+
+        cursor.execute(f'SELECT id, {", ".join(epoch_columns)} FROM {table}')
+        rows = cursor.fetchall()
+        assignments = ', '.join(f'{epoch_column} = ?' for epoch_column in epoch_columns.values())
+        cursor.executemany(
+            f'UPDATE {table} SET {assignments} WHERE id = ?',
+            [(*(to_epoch(value) for value in row[1:]), row[0]) for row in rows]
+        )
+        logger.info(f'✅ Migration: Filled epoch times for {len(rows)} rows in {table}')
+
+
+def migrate_search_keys(cursor):
+    """検索用に正規化した列（SEARCH_KEY_COLUMNS）がなければ追加し、未設定の行を埋める"""
+    for table, key_columns in SEARCH_KEY_COLUMNS.items():
+        cursor.execute(f'PRAGMA table_info({table})')
+        existing = {row[1] for row in cursor.fetchall()}
+        for key_column in key_columns.values():
+            if key_column not in existing:
+                cursor.execute(f'ALTER TABLE {table} ADD COLUMN {key_column} TEXT')
+                logger.info(f'✅ Migration: Added {key_column} to {table} table')
+
+        source_columns = list(key_columns)
+        first_key = next(iter(key_columns.values()))
+        cursor.execute(f'''
+            SELECT id, {', '.join(source_columns)} FROM {table}
+            WHERE {first_key} IS NULL
+        ''')
+        rows = cursor.fetchall()
+        if not rows:
+            continue
+
+        assignments = ', '.join(f'{key_column} = ?' for key_column in key_columns.values())
+        cursor.executemany(
+            f'UPDATE {table} SET {assignments} WHERE id = ?',
+            [(*(search_key(value) for value in row[1:]), row[0]) for row in rows]
+        )
+        logger.info(f'✅ Migration: Filled search keys for {len(rows)} rows in {table}')
+
+
+def init_program_search_index(cursor):
+    """
+    番組検索用の全文検索インデックス（programs_fts）を作成
+
+    FTS5のtrigramトークナイザーで title / performer / description を正規化した列
+    （title_key / performer_key / description_key）を索引する（日本語の部分一致も可）。
+    番組本体は programs に置いたまま（external content）、トリガーで同期する。
+    SQLiteがFTS5 / trigram（3.34以降）に対応していない場合は作らず、検索はLIKEで行う。
+    """
+    global _fts_enabled
+
+    key_columns = list(SEARCH_KEY_COLUMNS['programs'].values())
+
+    cursor.execute('PRAGMA table_info(programs_fts)')
+    columns = [row[1] for row in cursor.fetchall()]
+    if columns and columns != key_columns:
+        # 索引する列が変わった場合は作り直す
+        for trigger in ('programs_fts_insert', 'programs_fts_delete', 'programs_fts_update'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        cursor.execute('DROP TABLE programs_fts')
+        logger.info('🔧 Rebuilding full-text search index for programs (indexed columns changed)')
+        columns = []
+    exists = bool(columns)
+
+    try:
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS programs_fts USING fts5(
+                title_key, performer_key, description_key,
+                content='programs', content_rowid='id',
+                tokenize='trigram'
+            )
+        ''')
+    except sqlite3.OperationalError as e:
+        _fts_enabled = False
+        logger.warning(f'⚠️ Full-text search unavailable, falling back to LIKE: {str(e)}')
+        return
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS programs_fts_insert AFTER INSERT ON programs BEGIN
+            INSERT INTO programs_fts (rowid, title_key, performer_key, description_key)
+            VALUES (new.id, new.title_key, new.performer_key, new.description_key);
+        END
+    ''')
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS programs_fts_delete AFTER DELETE ON programs BEGIN
+            INSERT INTO programs_fts (programs_fts, rowid, title_key, performer_key, description_key)
+            VALUES ('delete', old.id, old.title_key, old.performer_key, old.description_key);
+        END
+    ''')
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS programs_fts_update
+        AFTER UPDATE OF title_key, performer_key, description_key ON programs BEGIN
+            INSERT INTO programs_fts (programs_fts, rowid, title_key, performer_key, description_key)
+            VALUES ('delete', old.id, old.title_key, old.performer_key, old.description_key);
+            INSERT INTO programs_fts (rowid, title_key, performer_key, description_key)
+            VALUES (new.id, new.title_key, new.performer_key, new.description_key);
+        END
+    ''')
+
+    if not exists:
+        # 既存の番組を索引する
+        cursor.execute("INSERT INTO programs_fts (programs_fts) VALUES ('rebuild')")
+        logger.info('✅ Built full-text search index for programs')
+
+    _fts_enabled = True
+
+
+@_writes
 def migrate_cron_jobs_add_folder_id():
     """cron_jobsテーブルにvirtual_folder_idカラムを追加（マイグレーション）"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        with connection() as conn:
+            cursor = conn.cursor()
+
+            # カラムが既に存在するかチェック
+            cursor.execute("PRAGMA table_info(cron_jobs)")
+            columns = [row[1] for row in cursor.fetchall()]
+
+            if 'virtual_folder_id' not in columns:
+                cursor.execute('''
+                    ALTER TABLE cron_jobs ADD COLUMN virtual_folder_id INTEGER
+                ''')
+                logger.info('✅ Migration: Added virtual_folder_id to cron_jobs table')
+            else:
+                logger.info('ℹ️ Migration: virtual_folder_id already exists in cron_jobs table')
+        return True
+
+    except Exception as e:
+        logger.error(f'❌ Migration error: {str(e)}')
+        return False
+
+
+def init_default_artwork():
+    """デフォルトアートワークをDBに登録（存在しない場合のみ）"""
+    try:
+        # 既にデフォルトアートワークが存在するかチェック
+        existing = get_artwork('__DEFAULT__')
+        if existing:
+            logger.info('ℹ️ Default artwork already exists')
+            return True
+
+        # img/jacket.pngを読み込んでDBに登録
+        import os
+        jacket_path = os.path.join(os.path.dirname(__file__), 'img', 'jacket.png')
+
+        if not os.path.exists(jacket_path):
+            logger.warning(f'⚠️ Default artwork file not found: {jacket_path}')
+            return False
+
+        with open(jacket_path, 'rb') as f:
+            image_data = f.read()
+
+        # __DEFAULT__というタイトルで保存
+        result = save_artwork('__DEFAULT__', image_data, 'image/png')
+
+        if result:
+            logger.info('✅ Default artwork registered successfully')
+        else:
+            logger.error('❌ Failed to register default artwork')
+
+        return result
+
+    except Exception as e:
+        logger.error(f'❌ Init default artwork error: {str(e)}')
+        return False
+
+
+def _stage_programs(cursor, rows):
+    """
+    番組データを一時テーブル（staged_programs）に入れる
+
+    検索用の正規化した列（title_key / description_key / performer_key）と
+    時刻のエポック秒（start_ts / end_ts）もここで求める
+
+    Args:
+        rows: [(station_id, station_name, title, ft, to, desc, pfm, info, url), ...]
+    """
+    # 一時テーブルは接続ごと（スレッドごと）に作られ、接続を使い回す間は残る
+    cursor.execute('''
+        CREATE TEMP TABLE IF NOT EXISTS staged_programs (
+            station_id TEXT NOT NULL,
+            station_name TEXT,
+            title TEXT,
+            start_time TEXT NOT NULL,
+            end_time TEXT,
+            description TEXT,
+            performer TEXT,
+            info TEXT,
+            url TEXT,
+            title_key TEXT,
+            description_key TEXT,
+            performer_key TEXT,
+            start_ts INTEGER,
+            end_ts INTEGER
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS temp.idx_staged_programs
+        ON staged_programs(station_id, start_time)
+    ''')
+    cursor.execute('DELETE FROM staged_programs')
+    cursor.executemany('''
+        INSERT INTO staged_programs (
+            station_id, station_name, title,
+            start_time, end_time, description, performer,
+            info, url, title_key, description_key, performer_key,
+            start_ts, end_ts
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (
+        (*row, search_key(row[2]), search_key(row[5]), search_key(row[6]), to_epoch(row[3]), to_epoch(row[4]))
+        for row in rows
+    ))
+
+
+def _upsert_staged_programs(cursor, date: str, now: str) -> int:
+    """
+    staged_programs の番組をprogramsにまとめて書き込む
+
+    新しい番組は追加し、既存の番組（station_id + start_time）は
+    タイトル・説明などが変わった場合だけ更新する
+
+    Returns:
+        追加・更新した番組数
+    """
+    # INSERT ... SELECT に ON CONFLICT を付ける場合は、構文の曖昧さを避けるため WHERE が必要
+    cursor.execute('''
+        INSERT INTO programs (
+            station_id, station_name, title,
+            start_time, end_time, description, performer,
+            info, url, title_key, description_key, performer_key,
+            start_ts, end_ts, date, updated_at
+        )
+        SELECT station_id, station_name, title,
+               start_time, end_time, description, performer,
+               info, url, title_key, description_key, performer_key,
+               start_ts, end_ts, ?, ?
+        FROM staged_programs WHERE true
+        ON CONFLICT(station_id, start_time) DO UPDATE SET
+            station_name = excluded.station_name,
+            title = excluded.title,
+            end_time = excluded.end_time,
+            description = excluded.description,
+            performer = excluded.performer,
+            info = excluded.info,
+            url = excluded.url,
+            title_key = excluded.title_key,
+            description_key = excluded.description_key,
+            performer_key = excluded.performer_key,
+            end_ts = excluded.end_ts,
+            updated_at = excluded.updated_at
+        WHERE programs.station_name IS NOT excluded.station_name
+           OR programs.title IS NOT excluded.title
+           OR programs.end_time IS NOT excluded.end_time
+           OR programs.description IS NOT excluded.description
+           OR programs.performer IS NOT excluded.performer
+           OR programs.info IS NOT excluded.info
+           OR programs.url IS NOT excluded.url
+    ''', (date, now))
+    return cursor.rowcount
+
+
+@_writes
+def save_programs(programs: List[Dict], area_id: str, date: str):
+    """番組データを保存（新スキーマ：programs + area_mask）
+
+    同じ番組（station_id + start_time）は1回だけprogramsに保存し、
+    どのエリアで聴けるかは programs.area_mask のビットで持つ
+    """
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+            now = datetime.now().isoformat()
+
+            _stage_programs(cursor, [
+                (
+                    prog.get('stationId', ''),
+                    prog.get('stationName', ''),
+                    prog.get('title', ''),
+                    prog.get('ft', ''),
+                    prog.get('to', ''),
+                    prog.get('desc', ''),
+                    prog.get('pfm', ''),
+                    prog.get('info', ''),
+                    prog.get('url', '')
+                )
+                for prog in programs
+            ])
+
+            # 番組データを追加・更新
+            changed_count = _upsert_staged_programs(cursor, date, now)
+
+            # 該当エリア・日付のマッピングを張り替え
+            bit = area_bit(area_id)
+            cursor.execute('''
+                UPDATE programs SET area_mask = area_mask & ~?
+                WHERE date = ? AND area_mask & ?
+            ''', (bit, date, bit))
+
+            cursor.execute('''
+                UPDATE programs SET area_mask = area_mask | ?
+                WHERE id IN (
+                    SELECT p.id
+                    FROM staged_programs s
+                    JOIN programs p ON p.station_id = s.station_id AND p.start_time = s.start_time
+                )
+            ''', (bit,))
+            saved_count = cursor.rowcount
+
+            # 更新ログを記録
+            cursor.execute('''
+                INSERT OR REPLACE INTO update_log (area_id, date, updated_at, status)
+                VALUES (?, ?, ?, ?)
+            ''', (area_id, date, now, 'success'))
+
+        _programs_changed()
+        logger.info(f'✅ Saved {saved_count} programs for {area_id} on {date} (added/updated: {changed_count})')
+        return True
+
+    except Exception as e:
+        logger.error(f'❌ Save programs error: {str(e)}')
+        return False
 
-        # カラムが既に存在するかチェック
-        cursor.execute("PRAGMA table_info(cron_jobs)")
-        columns = [row[1] for row in cursor.fetchall()]
 
-        if 'virtual_folder_id' not in columns:
+@_writes
+def save_date_programs(station_programs: Dict[str, List[tuple]], area_stations: Dict[str, List[str]], date: str,
+                       unchanged_stations=()):
+    """1日分の番組データを全エリアまとめて保存
+
+    放送局ごとに1回だけ取得した番組を1回だけprogramsに保存し、
+    その放送局を持つ全エリアのビットを programs.area_mask に書き込む
+
+    Args:
+        station_programs: {station_id: [番組レコード, ...]}
+                          番組レコードは (station_name, title, ft, to, desc, pfm, info, url) のタプル
+                          （fetch_programs.PROGRAM_RECORD_FIELDS）
+        area_stations: {area_id: [station_id, ...]}
+        date: YYYYMMDD形式
+        unchanged_stations: 前回から番組表が変わっていない放送局ID
+                            （番組は書き換えず、既存の番組をエリアに紐付けるだけ）
+
+    Returns:
+        {'success': 更新したエリア数, 'unchanged': 変更なしのエリア数}。失敗時はNone
+    """
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+            now = datetime.now().isoformat()
+
+            # 番組データをまとめて追加・更新
+            _stage_programs(cursor, [
+                (station_id, *record)
+                for station_id, programs in station_programs.items()
+                for record in programs
+            ])
+            changed_count = _upsert_staged_programs(cursor, date, now)
+            saved_count = cursor.execute('SELECT COUNT(*) FROM staged_programs').fetchone()[0]
+
+            # 放送局ごとに、その放送局を持つエリアのビットをまとめる
+            # （fetched=1: 今回取得した放送局, 0: 変更のない放送局）
+            unchanged_stations = set(unchanged_stations)
+            station_masks = {}
+            replaced_mask = 0
+            log_rows = []
+            for area_id, station_ids in area_stations.items():
+                fetched_ids = [station_id for station_id in station_ids if station_programs.get(station_id)]
+                unchanged_ids = [station_id for station_id in station_ids if station_id in unchanged_stations]
+                if not fetched_ids and not unchanged_ids:
+                    continue
+
+                bit = area_bit(area_id)
+                for station_id in fetched_ids + unchanged_ids:
+                    station_masks[station_id] = station_masks.get(station_id, 0) | bit
+                if fetched_ids:
+                    replaced_mask |= bit
+                log_rows.append((area_id, date, now, 'success' if fetched_ids else 'unchanged'))
+
             cursor.execute('''
-                ALTER TABLE cron_jobs ADD COLUMN virtual_folder_id INTEGER
+                CREATE TEMP TABLE IF NOT EXISTS staged_station_masks (
+                    station_id TEXT PRIMARY KEY,
+                    area_mask INTEGER NOT NULL,
+                    fetched INTEGER NOT NULL
+                ) WITHOUT ROWID
             ''')
-            conn.commit()
-            logger.info('✅ Migration: Added virtual_folder_id to cron_jobs table')
-        else:
-            logger.info('ℹ️ Migration: virtual_folder_id already exists in cron_jobs table')
+            cursor.execute('DELETE FROM staged_station_masks')
+            cursor.executemany('''
+                INSERT INTO staged_station_masks (station_id, area_mask, fetched) VALUES (?, ?, ?)
+            ''', [
+                (station_id, mask, 0 if station_id in unchanged_stations else 1)
+                for station_id, mask in station_masks.items()
+            ])
+
+            # 番組ごとの新しい area_mask を求め、変わる番組だけ書き込む
+            # - 今回取得した放送局のあるエリア（replaced）は、その日付のビットを張り替える
+            # - 今回取得した放送局は取得した番組、変更のない放送局はその日付の既存の番組にビットを立てる
+            cursor.execute('''
+                CREATE TEMP TABLE IF NOT EXISTS staged_program_masks (
+                    program_id INTEGER PRIMARY KEY,
+                    area_mask INTEGER NOT NULL
+                )
+            ''')
+            cursor.execute('DELETE FROM staged_program_masks')
+            cursor.execute('''
+                INSERT INTO staged_program_masks (program_id, area_mask)
+                SELECT id, new_mask FROM (
+                    SELECT p.id, p.area_mask AS old_mask,
+                           (p.area_mask & ~:replaced) | IFNULL(m.area_mask, 0) AS new_mask
+                    FROM programs p
+                    LEFT JOIN staged_station_masks m ON m.station_id = p.station_id AND (
+                        m.fetched = 0 OR EXISTS (
+                            SELECT 1 FROM staged_programs s
+                            WHERE s.station_id = p.station_id AND s.start_time = p.start_time
+                        )
+                    )
+                    WHERE p.date = :date
+                )
+                WHERE new_mask != old_mask
+                UNION ALL
+                SELECT p.id, p.area_mask | m.area_mask
+                FROM staged_programs s
+                JOIN programs p ON p.station_id = s.station_id AND p.start_time = s.start_time
+                JOIN staged_station_masks m ON m.station_id = s.station_id
+                WHERE p.date != :date AND p.area_mask | m.area_mask != p.area_mask
+            ''', {'replaced': replaced_mask, 'date': date})
+
+            cursor.execute('''
+                UPDATE programs
+                SET area_mask = (SELECT m.area_mask FROM staged_program_masks m WHERE m.program_id = programs.id)
+                WHERE id IN (SELECT program_id FROM staged_program_masks)
+            ''')
+
+            # 更新ログを記録
+            cursor.executemany('''
+                INSERT OR REPLACE INTO update_log (area_id, date, updated_at, status)
+                VALUES (?, ?, ?, ?)
+            ''', log_rows)
+
+            area_count = sum(1 for row in log_rows if row[3] == 'success')
+            unchanged_count = len(log_rows) - area_count
+
+        _programs_changed()
+        logger.info(f'✅ Saved {saved_count} programs from {len(station_programs)} stations for {area_count} areas on {date} '
+                    f'(added/updated: {changed_count}, unchanged: {len(unchanged_stations)} stations, {unchanged_count} areas)')
+        return {'success': area_count, 'unchanged': unchanged_count}
+
+    except Exception as e:
+        logger.error(f'❌ Save date programs error: {str(e)}')
+        return None
+
+
+def get_fetch_cache() -> Dict[tuple, Dict]:
+    """条件付き取得用のキャッシュを全件取得
+
+    Returns:
+        {(station_id, date): {'etag': ..., 'last_modified': ..., 'content_hash': ..., 'covered_dates': [...]}}
+        covered_dates は週間番組表（date='weekly'）に含まれていた日付
+    """
+    try:
+        with connection() as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+
+            cursor.execute('SELECT station_id, date, etag, last_modified, content_hash, covered_dates FROM fetch_cache')
+            rows = cursor.fetchall()
+
+        return {
+            (row['station_id'], row['date']): {
+                'etag': row['etag'],
+                'last_modified': row['last_modified'],
+                'content_hash': row['content_hash'],
+                'covered_dates': row['covered_dates'].split(',') if row['covered_dates'] else []
+            }
+            for row in rows
+        }
+
+    except Exception as e:
+        logger.error(f'❌ Get fetch cache error: {str(e)}')
+        return {}
+
+
+@_writes
+def save_fetch_cache(entries: Dict[tuple, Dict]):
+    """条件付き取得用のキャッシュを保存
+
+    Args:
+        entries: {(station_id, date): {'etag': ..., 'last_modified': ..., 'content_hash': ..., 'covered_dates': [...]}}
+    """
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+
+            now = datetime.now().isoformat()
+            cursor.executemany('''
+                INSERT INTO fetch_cache (station_id, date, etag, last_modified, content_hash, covered_dates, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(station_id, date) DO UPDATE SET
+                    etag = excluded.etag,
+                    last_modified = excluded.last_modified,
+                    content_hash = excluded.content_hash,
+                    covered_dates = excluded.covered_dates,
+                    updated_at = excluded.updated_at
+            ''', [
+                (station_id, date, entry.get('etag'), entry.get('last_modified'), entry.get('content_hash'),
+                 ','.join(entry.get('covered_dates') or []) or None, now)
+                for (station_id, date), entry in entries.items()
+            ])
+        return True
+
+    except Exception as e:
+        logger.error(f'❌ Save fetch cache error: {str(e)}')
+        return False
+
+
+@_writes
+def save_archive_entry(kind: str, station_id: str, date: str, digest: str, size: int):
+    """アーカイブしたXMLを索引に記録（同じ内容なら取得時刻のみ更新）"""
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute('''
+                INSERT INTO xml_archive (kind, station_id, date, digest, size, fetched_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(kind, station_id, date, digest) DO UPDATE SET
+                    fetched_at = excluded.fetched_at
+            ''', (kind, station_id, date, digest, size, datetime.now().isoformat()))
+        return True
+
+    except Exception as e:
+        logger.error(f'❌ Save archive entry error: {str(e)}')
+        return False
+
+
+def get_archive_digest(kind: str, station_id: str, date: str) -> Optional[str]:
+    """放送局・日付ごとに最後にアーカイブしたXMLのSHA-256を取得"""
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute('''
+                SELECT digest FROM xml_archive
+                WHERE kind = ? AND station_id = ? AND date = ?
+                ORDER BY fetched_at DESC
+                LIMIT 1
+            ''', (kind, station_id, date))
+
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    except Exception as e:
+        logger.error(f'❌ Get archive digest error: {str(e)}')
+        return None
+
+
+@_writes
+def save_crawl_job(job_id: str, trigger: str, scope: str, dates: List[str], status: str,
+                   started_at: str, finished_at: str = None, result: Dict = None, error: str = None):
+    """クロールの実行状態を保存（同じIDがあれば上書き）"""
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute('''
+                INSERT OR REPLACE INTO crawl_jobs
+                    (id, trigger, scope, dates, status, started_at, finished_at, result, error)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (job_id, trigger, scope, ','.join(dates), status, started_at, finished_at,
+                  json.dumps(result) if result is not None else None, error))
+        return True
+
+    except Exception as e:
+        logger.error(f'❌ Save crawl job error: {str(e)}')
+        return False
+
+
+def get_running_crawl_jobs() -> List[Dict]:
+    """status='running' のまま残っているクロール（中断されたもの）を新しい順に取得"""
+    try:
+        with connection() as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+
+            cursor.execute('''
+                SELECT id, trigger, scope, dates, started_at FROM crawl_jobs
+                WHERE status = 'running'
+                ORDER BY started_at DESC
+            ''')
+
+            jobs = [
+                {
+                    'id': row['id'],
+                    'trigger': row['trigger'],
+                    'scope': row['scope'],
+                    'dates': row['dates'].split(','),
+                    'started_at': row['started_at']
+                }
+                for row in cursor.fetchall()
+            ]
+        return jobs
+
+    except Exception as e:
+        logger.error(f'❌ Get running crawl jobs error: {str(e)}')
+        return []
+
+
+def get_crawl_request_count(since: str) -> int:
+    """指定時刻以降に開始したクロールのradikoへのリクエスト数の合計"""
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute('''
+                SELECT result FROM crawl_jobs
+                WHERE started_at >= ? AND result IS NOT NULL
+            ''', (since,))
+
+            total = sum(json.loads(row[0]).get('requests', 0) for row in cursor.fetchall())
+        return total
+
+    except Exception as e:
+        logger.error(f'❌ Get crawl request count error: {str(e)}')
+        return 0
+
+
+@_writes
+def save_crawl_units(job_id: str, units: List[tuple]):
+    """クロールのチェックポイントを保存
+
+    Args:
+        job_id: クロールID
+        units: [(station_id, date, status, error), ...]  statusは 'done' または 'failed'
+
+    updated_atには取得（失敗の場合は失敗）した時刻を、failuresには連続して失敗した回数を記録する。
+    """
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+
+            now = datetime.now().isoformat()
+            cursor.executemany('''
+                INSERT INTO crawl_units (station_id, date, status, job_id, error, failures, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(station_id, date) DO UPDATE SET
+                    status = excluded.status,
+                    job_id = excluded.job_id,
+                    error = excluded.error,
+                    failures = CASE WHEN excluded.status = 'failed' THEN crawl_units.failures + 1 ELSE 0 END,
+                    updated_at = excluded.updated_at
+            ''', [(station_id, date, status, job_id, error, 1 if status == 'failed' else 0, now)
+                  for station_id, date, status, error in units])
+        return True
+
+    except Exception as e:
+        logger.error(f'❌ Save crawl units error: {str(e)}')
+        return False
+
+
+def get_crawl_units(dates: List[str]) -> Dict[tuple, Dict]:
+    """指定日付のチェックポイントを取得
 
-        conn.close()
-        return True
+    Returns:
+        {(station_id, date): {'status': ..., 'job_id': ..., 'error': ..., 'failures': ..., 'updated_at': ...}}
+    """
+    try:
+        with connection() as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+
+            placeholders = ','.join('?' * len(dates))
+            cursor.execute(f'''
+                SELECT station_id, date, status, job_id, error, failures, updated_at FROM crawl_units
+                WHERE date IN ({placeholders})
+            ''', dates)
+
+            units = {
+                (row['station_id'], row['date']): {
+                    'status': row['status'],
+                    'job_id': row['job_id'],
+                    'error': row['error'],
+                    'failures': row['failures'],
+                    'updated_at': row['updated_at']
+                }
+                for row in cursor.fetchall()
+            }
+        return units
 
     except Exception as e:
-        logger.error(f'❌ Migration error: {str(e)}')
-        return False
+        logger.error(f'❌ Get crawl units error: {str(e)}')
+        return {}
 
 
-def init_default_artwork():
-    """デフォルトアートワークをDBに登録（存在しない場合のみ）"""
+def get_program_station_dates(dates: List[str]) -> set:
+    """指定日付のうち番組データが保存済みの (station_id, date) の集合を取得"""
     try:
-        # 既にデフォルトアートワークが存在するかチェック
-        existing = get_artwork('__DEFAULT__')
-        if existing:
-            logger.info('ℹ️ Default artwork already exists')
-            return True
+        with connection() as conn:
+            cursor = conn.cursor()
 
-        # img/jacket.pngを読み込んでDBに登録
-        import os
-        jacket_path = os.path.join(os.path.dirname(__file__), 'img', 'jacket.png')
+            placeholders = ','.join('?' * len(dates))
+            cursor.execute(f'''
+                SELECT DISTINCT station_id, date FROM programs
+                WHERE date IN ({placeholders})
+            ''', list(dates))
 
-        if not os.path.exists(jacket_path):
-            logger.warning(f'⚠️ Default artwork file not found: {jacket_path}')
-            return False
+            rows = cursor.fetchall()
 
-        with open(jacket_path, 'rb') as f:
-            image_data = f.read()
+        return {(row[0], row[1]) for row in rows}
 
-        # __DEFAULT__というタイトルで保存
-        result = save_artwork('__DEFAULT__', image_data, 'image/png')
+    except Exception as e:
+        logger.error(f'❌ Get program station dates error: {str(e)}')
+        return set()
 
-        if result:
-            logger.info('✅ Default artwork registered successfully')
-        else:
-            logger.error('❌ Failed to register default artwork')
 
-        return result
+@_writes
+def save_area_stations(area_id: str, stations: List[tuple]):
+    """エリアの放送局一覧を保存（既存の一覧は置き換え）
+
+    Args:
+        stations: [(station_id, station_name), ...]
+    """
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+
+            now = datetime.now().isoformat()
+
+            cursor.executemany('''
+                INSERT INTO stations (station_id, station_name, updated_at)
+                VALUES (?, ?, ?)
+                ON CONFLICT(station_id) DO UPDATE SET
+                    station_name = excluded.station_name,
+                    updated_at = excluded.updated_at
+            ''', [(station_id, station_name, now) for station_id, station_name in stations])
+
+            cursor.execute('DELETE FROM area_stations WHERE area_id = ?', (area_id,))
+            cursor.executemany('''
+                INSERT OR IGNORE INTO area_stations (area_id, station_id, sort_order, updated_at)
+                VALUES (?, ?, ?, ?)
+            ''', [(area_id, station_id, idx, now) for idx, (station_id, _) in enumerate(stations)])
+
+        logger.info(f'✅ Saved {len(stations)} stations for {area_id}')
+        return True
 
     except Exception as e:
-        logger.error(f'❌ Init default artwork error: {str(e)}')
+        logger.error(f'❌ Save area stations error: {str(e)}')
         return False
 
 
-def save_programs(programs: List[Dict], area_id: str, date: str):
-    """番組データを保存（新スキーマ：programs + program_areas）
+def get_area_stations(area_id: str, max_age_hours: Optional[float] = 24) -> Optional[List[tuple]]:
+    """キャッシュ済みのエリアの放送局一覧を取得
 
-    同じ番組（station_id + start_time）は1回だけprogramsに保存し、
-    エリア情報はprogram_areasに保存することで重複を避ける
+    Args:
+        max_age_hours: この時間より古い一覧は無効として扱う（Noneで無期限）
+
+    Returns:
+        [(station_id, station_name), ...]。未取得または期限切れの場合はNone
     """
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        with connection() as conn:
+            cursor = conn.cursor()
 
-        # 該当エリア・日付のマッピングを削除
-        cursor.execute('''
-            DELETE FROM program_areas
-            WHERE program_id IN (
-                SELECT p.id FROM programs p
-                JOIN program_areas pa ON p.id = pa.program_id
-                WHERE pa.area_id = ? AND p.date = ?
-            )
-            AND area_id = ?
-        ''', (area_id, date, area_id))
-
-        saved_count = 0
-        skipped_count = 0
+            cursor.execute('''
+                SELECT a.station_id, s.station_name, a.updated_at
+                FROM area_stations a
+                LEFT JOIN stations s ON a.station_id = s.station_id
+                WHERE a.area_id = ?
+                ORDER BY a.sort_order ASC
+            ''', (area_id,))
 
-        for prog in programs:
-            station_id = prog.get('stationId', '')
-            start_time = prog.get('ft', '')
+            rows = cursor.fetchall()
 
-            # 番組データを挿入（既存の場合はスキップ）
-            cursor.execute('''
-                INSERT OR IGNORE INTO programs (
-                    station_id, station_name, title,
-                    start_time, end_time, description, performer,
-                    info, url, date, updated_at
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                station_id,
-                prog.get('stationName', ''),
-                prog.get('title', ''),
-                start_time,
-                prog.get('to', ''),
-                prog.get('desc', ''),
-                prog.get('pfm', ''),
-                prog.get('info', ''),
-                prog.get('url', ''),
-                date,
-                datetime.now().isoformat()
-            ))
-
-            # program_id を取得
-            cursor.execute('''
-                SELECT id FROM programs
-                WHERE station_id = ? AND start_time = ?
-            ''', (station_id, start_time))
+        if not rows:
+            return None
 
-            row = cursor.fetchone()
-            if row:
-                program_id = row[0]
+        if max_age_hours is not None:
+            updated_at = datetime.fromisoformat(min(row[2] for row in rows))
+            if (datetime.now() - updated_at).total_seconds() > max_age_hours * 3600:
+                return None
 
-                # エリアマッピングを追加
-                cursor.execute('''
-                    INSERT OR IGNORE INTO program_areas (program_id, area_id)
-                    VALUES (?, ?)
-                ''', (program_id, area_id))
+        return [(row[0], row[1]) for row in rows]
 
-                saved_count += 1
-            else:
-                skipped_count += 1
+    except Exception as e:
+        logger.error(f'❌ Get area stations error: {str(e)}')
+        return None
 
-        # 更新ログを記録
-        cursor.execute('''
-            INSERT OR REPLACE INTO update_log (area_id, date, updated_at, status)
-            VALUES (?, ?, ?, ?)
-        ''', (area_id, date, datetime.now().isoformat(), 'success'))
 
-        conn.commit()
-        conn.close()
+def _use_fts(cursor, keyword: str) -> bool:
+    """このキーワードを全文検索インデックスで検索できるか"""
+    global _fts_enabled
 
-        logger.info(f'✅ Saved {saved_count} programs for {area_id} on {date} (skipped: {skipped_count})')
-        return True
+    if _fts_enabled is None:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'programs_fts'")
+        _fts_enabled = cursor.fetchone() is not None
 
-    except Exception as e:
-        logger.error(f'❌ Save programs error: {str(e)}')
-        return False
+    return _fts_enabled and len(keyword) >= FTS_MIN_KEYWORD_LENGTH
 
 
 def search_programs(keyword: str, area_id: Optional[str] = None,
@@ -404,6 +1502,12 @@ def search_programs(keyword: str, area_id: Optional[str] = None,
                    date_to: Optional[str] = None) -> List[Dict]:
     """番組を検索（新スキーマ対応）
 
+    キーワードと番組はどちらも search_key で正規化して比較する
+    （全角/半角・カタカナ/ひらがな・大文字/小文字を区別しない）。
+    正規化後3文字以上のキーワードは全文検索インデックス（programs_fts）で検索し、
+    タイトル > 出演者 > 番組説明 の重みで関連度の高い順に返す。
+    短いキーワードはLIKEで部分一致検索する（新しい番組順）。
+
     Args:
         keyword: 検索キーワード
         area_id: エリアID（指定時はそのエリアで聴ける全番組）
@@ -411,83 +1515,97 @@ def search_programs(keyword: str, area_id: Optional[str] = None,
         date_to: 終了日付
     """
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-
-        # 基本クエリ：programsとprogram_areasをJOIN
-        if area_id:
-            # エリア指定時：そのエリアで聴ける番組のみ
-            query = '''
-                SELECT DISTINCT
-                    p.station_id, p.station_name, p.title,
-                    p.start_time, p.end_time, p.description, p.performer,
-                    p.info, p.url, p.date,
-                    GROUP_CONCAT(DISTINCT pa.area_id) as area_ids
-                FROM programs p
-                JOIN program_areas pa ON p.id = pa.program_id
-                WHERE (
-                    p.title LIKE ? OR
-                    p.performer LIKE ? OR
-                    p.description LIKE ?
+        key = search_key(keyword)
+
+        with connection() as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+
+            use_fts = _use_fts(cursor, key)
+            conditions = []
+            params = []
+
+            if area_id:
+                # エリア指定時：そのエリアで聴ける番組のみ
+                # LIKEの場合は全件を読まないよう、先にインデックス（idx_programs_date_area）だけでエリアの番組を絞る
+                if use_fts:
+                    conditions.append('p.area_mask & ?')
+                else:
+                    conditions.append('p.id IN (SELECT id FROM programs WHERE area_mask & ?)')
+                params.append(area_bit(area_id))
+
+            if use_fts:
+                # キーワード全体を1つのフレーズとして部分一致検索
+                source = '''
+                    FROM (
+                        SELECT rowid, rank
+                        FROM programs_fts
+                        WHERE programs_fts MATCH ? AND rank MATCH 'bm25(10.0, 5.0, 1.0)'
+                    ) f
+                    JOIN programs p ON p.id = f.rowid
+                '''
+                source_params = ['"' + key.replace('"', '""') + '"']
+                rank = 'f.rank'
+            else:
+                source = 'FROM programs p'
+                source_params = []
+                conditions.append('(p.title_key LIKE ? OR p.performer_key LIKE ? OR p.description_key LIKE ?)')
+                params.extend([f'%{key}%', f'%{key}%', f'%{key}%'])
+                rank = '0'
+
+            # 日付範囲フィルター
+            if date_from:
+                conditions.append('p.date >= ?')
+                params.append(date_from)
+
+            if date_to:
+                conditions.append('p.date <= ?')
+                params.append(date_to)
+
+            # 前後7日間の番組のみ（過去7日〜未来7日）
+            # 保存期間（15日）のほぼ全体にあたり絞り込めないため、idx_programs_start_ts は使わない（+start_ts）
+            now = int(time.time())
+            conditions.append('+p.start_ts BETWEEN ? AND ?')
+            params.extend([now - 7 * 86400, now + 7 * 86400])
+
+            # 先に番組IDだけで絞り込み・並べ替えを行い、上位1000件だけ番組データを読む
+            query = f'''
+                WITH matched AS (
+                    SELECT p.id, {rank} AS rank, p.start_ts
+                    {source}
+                    WHERE {' AND '.join(conditions)}
+                    ORDER BY rank, p.start_ts DESC
+                    LIMIT 1000
                 )
-                AND pa.area_id = ?
-            '''
-            params = [f'%{keyword}%', f'%{keyword}%', f'%{keyword}%', area_id]
-        else:
-            # 全体検索時：全番組（重複なし）
-            query = '''
-                SELECT DISTINCT
+                SELECT
                     p.station_id, p.station_name, p.title,
                     p.start_time, p.end_time, p.description, p.performer,
-                    p.info, p.url, p.date,
-                    GROUP_CONCAT(DISTINCT pa.area_id) as area_ids
-                FROM programs p
-                LEFT JOIN program_areas pa ON p.id = pa.program_id
-                WHERE (
-                    p.title LIKE ? OR
-                    p.performer LIKE ? OR
-                    p.description LIKE ?
-                )
+                    p.info, p.url, p.date, p.area_mask
+                FROM matched m
+                JOIN programs p ON p.id = m.id
+                ORDER BY m.rank, m.start_ts DESC
             '''
-            params = [f'%{keyword}%', f'%{keyword}%', f'%{keyword}%']
-
-        # 日付範囲フィルター
-        if date_from:
-            query += ' AND p.date >= ?'
-            params.append(date_from)
-
-        if date_to:
-            query += ' AND p.date <= ?'
-            params.append(date_to)
-
-        # 前後7日間の番組のみ（過去7日〜未来7日）
-        query += ' AND p.start_time >= datetime("now", "-7 days") AND p.start_time <= datetime("now", "+7 days")'
-
-        query += ' GROUP BY p.id ORDER BY p.start_time DESC LIMIT 1000'
-
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
-
-        results = []
-        for row in rows:
-            area_ids = row['area_ids'].split(',') if row['area_ids'] else []
-            results.append({
-                'areaId': area_ids[0] if area_ids else '',  # 最初のエリアIDを代表として返す
-                'areaIds': area_ids,  # 全エリアIDも返す
-                'stationId': row['station_id'],
-                'stationName': row['station_name'],
-                'title': row['title'],
-                'ft': row['start_time'],
-                'to': row['end_time'],
-                'desc': row['description'],
-                'pfm': row['performer'],
-                'info': row['info'],
-                'url': row['url'],
-                'date': row['date']
-            })
 
-        conn.close()
+            cursor.execute(query, source_params + params)
+            rows = cursor.fetchall()
+
+            results = []
+            for row in rows:
+                area_ids = area_ids_from_mask(row['area_mask'])
+                results.append({
+                    'areaId': area_id or (area_ids[0] if area_ids else ''),  # 指定エリア（なければ最初のエリア）を代表として返す
+                    'areaIds': area_ids,  # 全エリアIDも返す
+                    'stationId': row['station_id'],
+                    'stationName': row['station_name'],
+                    'title': row['title'],
+                    'ft': row['start_time'],
+                    'to': row['end_time'],
+                    'desc': row['description'],
+                    'pfm': row['performer'],
+                    'info': row['info'],
+                    'url': row['url'],
+                    'date': row['date']
+                })
 
         logger.info(f'🔍 Search "{keyword}": found {len(results)} programs')
         return results
@@ -500,83 +1618,147 @@ def search_programs(keyword: str, area_id: Optional[str] = None,
 def get_programs_by_area_date(area_id: str, date: str) -> List[Dict]:
     """特定エリア・日付の番組を取得（新スキーマ対応）"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        with connection() as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
 
-        cursor.execute('''
-            SELECT DISTINCT
-                p.station_id, p.station_name, p.title,
-                p.start_time, p.end_time, p.description, p.performer,
-                p.info, p.url, p.date,
-                GROUP_CONCAT(DISTINCT pa.area_id) as area_ids
-            FROM programs p
-            JOIN program_areas pa ON p.id = pa.program_id
-            WHERE pa.area_id = ? AND p.date = ?
-            GROUP BY p.id
-            ORDER BY p.start_time ASC
-        ''', (area_id, date))
+            # idx_programs_date_area を日付・開始時刻順に読み、エリアのビットが立った番組だけ返す
+            cursor.execute('''
+                SELECT
+                    p.station_id, p.station_name, p.title,
+                    p.start_time, p.end_time, p.description, p.performer,
+                    p.info, p.url, p.date, p.area_mask
+                FROM programs p
+                WHERE p.date = ? AND p.area_mask & ?
+                ORDER BY p.start_time ASC
+            ''', (date, area_bit(area_id)))
+
+            rows = cursor.fetchall()
+
+            results = []
+            for row in rows:
+                area_ids = area_ids_from_mask(row['area_mask'])
+                results.append({
+                    'areaId': area_id,  # リクエストされたエリアIDを返す
+                    'areaIds': area_ids,  # 全エリアIDも返す
+                    'stationId': row['station_id'],
+                    'stationName': row['station_name'],
+                    'title': row['title'],
+                    'ft': row['start_time'],
+                    'to': row['end_time'],
+                    'desc': row['description'],
+                    'pfm': row['performer'],
+                    'info': row['info'],
+                    'url': row['url'],
+                    'date': row['date']
+                })
 
-        rows = cursor.fetchall()
+        return results
 
-        results = []
-        for row in rows:
-            area_ids = row['area_ids'].split(',') if row['area_ids'] else []
-            results.append({
-                'areaId': area_id,  # リクエストされたエリアIDを返す
-                'areaIds': area_ids,  # 全エリアIDも返す
-                'stationId': row['station_id'],
-                'stationName': row['station_name'],
-                'title': row['title'],
-                'ft': row['start_time'],
-                'to': row['end_time'],
-                'desc': row['description'],
-                'pfm': row['performer'],
-                'info': row['info'],
-                'url': row['url'],
-                'date': row['date']
-            })
+    except Exception as e:
+        logger.error(f'❌ Get programs error: {str(e)}')
+        return []
 
-        conn.close()
 
-        return results
+def get_programs_between(start_ts: int, end_ts: int) -> List[Dict]:
+    """
+    指定した時間帯（エポック秒、start_ts〜end_ts）に放送される全エリアの番組を取得
+
+    放送局・開始時刻の順に返す。番組は放送日（5時区切り）をまたがないため24時間以内として、
+    idx_programs_start_ts の開始時刻の範囲で探す。
+
+    Returns:
+        [{'stationId', 'stationName', 'title', 'ft', 'to', 'desc', 'pfm', 'info', 'url',
+          'start_ts', 'end_ts', 'area_mask'}, ...]
+    """
+    try:
+        with connection() as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+
+            cursor.execute('''
+                SELECT
+                    station_id, station_name, title,
+                    start_time, end_time, description, performer,
+                    info, url, start_ts, end_ts, area_mask
+                FROM programs
+                WHERE start_ts >= ? AND start_ts < ? AND end_ts > ?
+                ORDER BY station_id, start_ts
+            ''', (start_ts - 86400, end_ts, start_ts))
+
+            rows = cursor.fetchall()
+
+        return [{
+            'stationId': row['station_id'],
+            'stationName': row['station_name'],
+            'title': row['title'],
+            'ft': row['start_time'],
+            'to': row['end_time'],
+            'desc': row['description'],
+            'pfm': row['performer'],
+            'info': row['info'],
+            'url': row['url'],
+            'start_ts': row['start_ts'],
+            'end_ts': row['end_ts'],
+            'area_mask': row['area_mask']
+        } for row in rows]
 
     except Exception as e:
-        logger.error(f'❌ Get programs error: {str(e)}')
+        logger.error(f'❌ Get programs between error: {str(e)}')
         return []
 
 
+def get_all_area_station_ids() -> Dict[str, List[str]]:
+    """キャッシュ済みの全エリアの放送局ID（radikoの並び順）: {area_id: [station_id, ...]}"""
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute('''
+                SELECT area_id, station_id FROM area_stations
+                ORDER BY area_id, sort_order ASC
+            ''')
+
+            area_station_ids = {}
+            for area_id, station_id in cursor.fetchall():
+                area_station_ids.setdefault(area_id, []).append(station_id)
+
+        return area_station_ids
+
+    except Exception as e:
+        logger.error(f'❌ Get all area stations error: {str(e)}')
+        return {}
+
+
 def get_update_status() -> Dict:
     """更新ステータスを取得"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            SELECT
-                area_id, date, updated_at, status
-            FROM update_log
-            ORDER BY updated_at DESC
-            LIMIT 100
-        ''')
+        with connection() as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
 
-        rows = cursor.fetchall()
+            cursor.execute('''
+                SELECT
+                    area_id, date, updated_at, status
+                FROM update_log
+                ORDER BY updated_at DESC
+                LIMIT 100
+            ''')
 
-        status = {
-            'total_updates': len(rows),
-            'recent_updates': []
-        }
+            rows = cursor.fetchall()
 
-        for row in rows:
-            status['recent_updates'].append({
-                'area_id': row['area_id'],
-                'date': row['date'],
-                'updated_at': row['updated_at'],
-                'status': row['status']
-            })
+            status = {
+                'total_updates': len(rows),
+                'recent_updates': []
+            }
 
-        conn.close()
+            for row in rows:
+                status['recent_updates'].append({
+                    'area_id': row['area_id'],
+                    'date': row['date'],
+                    'updated_at': row['updated_at'],
+                    'status': row['status']
+                })
 
         return status
 
@@ -585,30 +1767,66 @@ def get_update_status() -> Dict:
         return {'total_updates': 0, 'recent_updates': []}
 
 
+def get_area_date_updated_at(area_id: str, date: str) -> Optional[str]:
+    """エリア・日付の番組表を最後に更新した時刻（update_log）を取得"""
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute('''
+                SELECT updated_at FROM update_log
+                WHERE area_id = ? AND date = ?
+            ''', (area_id, date))
+
+            row = cursor.fetchone()
+
+        return row[0] if row else None
+
+    except Exception as e:
+        logger.error(f'❌ Get update time error: {str(e)}')
+        return None
+
+
+@_writes
 def cleanup_old_data(days_to_keep: int = 15):
     """古いデータを削除"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        with connection() as conn:
+            cursor = conn.cursor()
 
-        # 指定日数より古いデータを削除
-        cursor.execute('''
-            DELETE FROM programs
-            WHERE date < date('now', ? || ' days')
-        ''', (f'-{days_to_keep}',))
+            # 指定日数より前に放送が終わった番組を削除
+            # （終了時刻は開始時刻より後のため、開始時刻の条件で idx_programs_start_ts を使える）
+            cutoff_ts = int(time.time()) - days_to_keep * 86400
+            cursor.execute('''
+                DELETE FROM programs
+                WHERE start_ts < ? AND end_ts < ?
+            ''', (cutoff_ts, cutoff_ts))
 
-        deleted_programs = cursor.rowcount
+            deleted_programs = cursor.rowcount
 
-        cursor.execute('''
-            DELETE FROM update_log
-            WHERE date < date('now', ? || ' days')
-        ''', (f'-{days_to_keep}',))
+            cursor.execute('''
+                DELETE FROM update_log
+                WHERE date < strftime('%Y%m%d', 'now', ? || ' days')
+            ''', (f'-{days_to_keep}',))
+
+            deleted_logs = cursor.rowcount
+
+            cursor.execute('''
+                DELETE FROM fetch_cache
+                WHERE date != 'weekly' AND date < strftime('%Y%m%d', 'now', ? || ' days')
+            ''', (f'-{days_to_keep}',))
 
-        deleted_logs = cursor.rowcount
+            cursor.execute('''
+                DELETE FROM crawl_units
+                WHERE date < strftime('%Y%m%d', 'now', ? || ' days')
+            ''', (f'-{days_to_keep}',))
 
-        conn.commit()
-        conn.close()
+            cursor.execute('''
+                DELETE FROM crawl_jobs
+                WHERE status != 'running' AND started_at < datetime('now', 'localtime', ? || ' days')
+            ''', (f'-{days_to_keep}',))
 
+        _programs_changed()
         logger.info(f'🗑️ Cleaned up: {deleted_programs} programs, {deleted_logs} logs')
         return deleted_programs
 
@@ -621,21 +1839,20 @@ def cleanup_old_data(days_to_keep: int = 15):
 # 予約管理関連の関数
 # ========================================
 
+@_writes
 def save_cron_job(minute: str, hour: str, day_of_month: str, month: str, day_of_week: str,
                   command: str, title: str = '', station: str = '', start_time: str = '', end_time: str = '', virtual_folder_id: int = None):
     """cron予約をDBに保存"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        with connection() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute('''
-            INSERT INTO cron_jobs (minute, hour, day_of_month, month, day_of_week, command, title, station, start_time, end_time, virtual_folder_id)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (minute, hour, day_of_month, month, day_of_week, command, title, station, start_time, end_time, virtual_folder_id))
+            cursor.execute('''
+                INSERT INTO cron_jobs (minute, hour, day_of_month, month, day_of_week, command, title, station, start_time, end_time, virtual_folder_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (minute, hour, day_of_month, month, day_of_week, command, title, station, start_time, end_time, virtual_folder_id))
 
-        job_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+            job_id = cursor.lastrowid
 
         logger.info(f'✅ Cron job saved: {job_id} (folder_id={virtual_folder_id})')
         return job_id
@@ -648,13 +1865,12 @@ def save_cron_job(minute: str, hour: str, day_of_month: str, month: str, day_of_
 def get_all_cron_jobs():
     """全てのcron予約を取得"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        with connection() as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
 
-        cursor.execute('SELECT * FROM cron_jobs ORDER BY created_at DESC')
-        rows = cursor.fetchall()
-        conn.close()
+            cursor.execute('SELECT * FROM cron_jobs ORDER BY created_at DESC')
+            rows = cursor.fetchall()
 
         jobs = []
         for row in rows:
@@ -681,15 +1897,14 @@ def get_all_cron_jobs():
         return []
 
 
+@_writes
 def delete_cron_job(job_id: int):
     """cron予約を削除"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        with connection() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute('DELETE FROM cron_jobs WHERE id = ?', (job_id,))
-        conn.commit()
-        conn.close()
+            cursor.execute('DELETE FROM cron_jobs WHERE id = ?', (job_id,))
 
         logger.info(f'✅ Cron job deleted: {job_id}')
         return True
@@ -699,30 +1914,28 @@ def delete_cron_job(job_id: int):
         return False
 
 
+@_writes
 def save_at_job(job_id: str, schedule_time: str, command: str, title: str = '',
                 station: str = '', start_time: str = '', end_time: str = ''):
     """at予約をDBに保存（job_idがNoneの場合は自動生成されたIDを返す）"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-
-        if job_id is None:
-            # job_idを指定しない場合は自動生成
-            cursor.execute('''
-                INSERT INTO at_jobs (schedule_time, command, title, station, start_time, end_time)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (schedule_time, command, title, station, start_time, end_time))
-            generated_id = cursor.lastrowid
-        else:
-            # job_idを指定する場合
-            cursor.execute('''
-                INSERT INTO at_jobs (job_id, schedule_time, command, title, station, start_time, end_time)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (job_id, schedule_time, command, title, station, start_time, end_time))
-            generated_id = job_id
+        with connection() as conn:
+            cursor = conn.cursor()
 
-        conn.commit()
-        conn.close()
+            if job_id is None:
+                # job_idを指定しない場合は自動生成
+                cursor.execute('''
+                    INSERT INTO at_jobs (schedule_time, command, title, station, start_time, end_time)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (schedule_time, command, title, station, start_time, end_time))
+                generated_id = cursor.lastrowid
+            else:
+                # job_idを指定する場合
+                cursor.execute('''
+                    INSERT INTO at_jobs (job_id, schedule_time, command, title, station, start_time, end_time)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (job_id, schedule_time, command, title, station, start_time, end_time))
+                generated_id = job_id
 
         logger.info(f'✅ At job saved: {generated_id}')
         return generated_id
@@ -735,13 +1948,12 @@ def save_at_job(job_id: str, schedule_time: str, command: str, title: str = '',
 def get_all_at_jobs():
     """全てのat予約を取得"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        with connection() as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
 
-        cursor.execute('SELECT * FROM at_jobs ORDER BY schedule_time ASC')
-        rows = cursor.fetchall()
-        conn.close()
+            cursor.execute('SELECT * FROM at_jobs ORDER BY schedule_time ASC')
+            rows = cursor.fetchall()
 
         jobs = []
         for row in rows:
@@ -764,22 +1976,21 @@ def get_all_at_jobs():
         return []
 
 
+@_writes
 def delete_at_job(job_id):
     """at予約を削除（idまたはjob_idで削除）"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        with connection() as conn:
+            cursor = conn.cursor()
 
-        # idカラムで削除（主キー）
-        cursor.execute('DELETE FROM at_jobs WHERE id = ?', (job_id,))
+            # idカラムで削除（主キー）
+            cursor.execute('DELETE FROM at_jobs WHERE id = ?', (job_id,))
 
-        if cursor.rowcount == 0:
-            # idで見つからない場合はjob_idで試行
-            cursor.execute('DELETE FROM at_jobs WHERE job_id = ?', (job_id,))
+            if cursor.rowcount == 0:
+                # idで見つからない場合はjob_idで試行
+                cursor.execute('DELETE FROM at_jobs WHERE job_id = ?', (job_id,))
 
-        conn.commit()
-        affected_rows = cursor.rowcount
-        conn.close()
+            affected_rows = cursor.rowcount
 
         if affected_rows > 0:
             logger.info(f'✅ At job deleted: {job_id}')
@@ -793,23 +2004,21 @@ def delete_at_job(job_id):
         return False
 
 
+@_writes
 def save_artwork(title: str, image_data: bytes, mime_type: str):
     """アートワークを保存（同じタイトルの場合は更新）"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            INSERT INTO artworks (title, image_data, mime_type, updated_at)
-            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
-            ON CONFLICT(title) DO UPDATE SET
-                image_data = excluded.image_data,
-                mime_type = excluded.mime_type,
-                updated_at = CURRENT_TIMESTAMP
-        ''', (title, image_data, mime_type))
+        with connection() as conn:
+            cursor = conn.cursor()
 
-        conn.commit()
-        conn.close()
+            cursor.execute('''
+                INSERT INTO artworks (title, image_data, mime_type, updated_at)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(title) DO UPDATE SET
+                    image_data = excluded.image_data,
+                    mime_type = excluded.mime_type,
+                    updated_at = CURRENT_TIMESTAMP
+            ''', (title, image_data, mime_type))
 
         logger.info(f'✅ Artwork saved: {title}')
         return True
@@ -822,16 +2031,15 @@ def save_artwork(title: str, image_data: bytes, mime_type: str):
 def get_artwork(title: str):
     """タイトルに対応するアートワークを取得"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        with connection() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute(
-            'SELECT image_data, mime_type FROM artworks WHERE title = ?',
-            (title,)
-        )
+            cursor.execute(
+                'SELECT image_data, mime_type FROM artworks WHERE title = ?',
+                (title,)
+            )
 
-        result = cursor.fetchone()
-        conn.close()
+            result = cursor.fetchone()
 
         if result:
             return {
@@ -849,17 +2057,16 @@ def get_artwork(title: str):
 def list_artworks():
     """登録されているアートワーク一覧を取得"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        with connection() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute('''
-            SELECT id, title, mime_type, created_at, updated_at
-            FROM artworks
-            ORDER BY updated_at DESC
-        ''')
+            cursor.execute('''
+                SELECT id, title, mime_type, created_at, updated_at
+                FROM artworks
+                ORDER BY updated_at DESC
+            ''')
 
-        rows = cursor.fetchall()
-        conn.close()
+            rows = cursor.fetchall()
 
         artworks = []
         for row in rows:
@@ -878,17 +2085,16 @@ def list_artworks():
         return []
 
 
+@_writes
 def delete_artwork(title: str):
     """アートワークを削除"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        with connection() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute('DELETE FROM artworks WHERE title = ?', (title,))
+            cursor.execute('DELETE FROM artworks WHERE title = ?', (title,))
 
-        conn.commit()
-        affected_rows = cursor.rowcount
-        conn.close()
+            affected_rows = cursor.rowcount
 
         if affected_rows > 0:
             logger.info(f'✅ Artwork deleted: {title}')
@@ -906,46 +2112,46 @@ def delete_artwork(title: str):
 # 録音ファイル管理関連の関数
 # ========================================
 
+@_writes
 def register_recorded_file(file_path: str, file_name: str, program_id: int = None,
                           program_title: str = None, station_id: str = None, station_name: str = None,
                           broadcast_date: str = None, start_time: str = None, end_time: str = None,
                           file_size: int = None, duration: float = None, file_modified: str = None,
                           virtual_folder_id: int = None):
     """録音ファイルをDBに登録（既存の場合は更新）"""
-    def _register():
-        conn = get_db_connection()
-        cursor = conn.cursor()
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute('''
-            INSERT INTO recorded_files (
-                file_path, file_name, program_id, program_title, station_id, station_name,
-                broadcast_date, start_time, end_time, file_size, duration, file_modified,
-                virtual_folder_id, updated_at
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-            ON CONFLICT(file_path) DO UPDATE SET
-                file_name = excluded.file_name,
-                program_id = excluded.program_id,
-                program_title = excluded.program_title,
-                station_id = excluded.station_id,
-                station_name = excluded.station_name,
-                broadcast_date = excluded.broadcast_date,
-                start_time = excluded.start_time,
-                end_time = excluded.end_time,
-                file_size = excluded.file_size,
-                duration = excluded.duration,
-                file_modified = excluded.file_modified,
-                virtual_folder_id = excluded.virtual_folder_id,
-                updated_at = CURRENT_TIMESTAMP
-        ''', (file_path, file_name, program_id, program_title, station_id, station_name,
-              broadcast_date, start_time, end_time, file_size, duration, file_modified,
-              virtual_folder_id))
-
-        file_id = cursor.lastrowid
-        conn.close()
-        return file_id
+            cursor.execute('''
+                INSERT INTO recorded_files (
+                    file_path, file_name, program_id, program_title, station_id, station_name,
+                    broadcast_date, start_time, end_time, file_size, duration, file_modified,
+                    virtual_folder_id, program_title_key, file_name_key, start_ts, updated_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(file_path) DO UPDATE SET
+                    file_name = excluded.file_name,
+                    program_id = excluded.program_id,
+                    program_title = excluded.program_title,
+                    station_id = excluded.station_id,
+                    station_name = excluded.station_name,
+                    broadcast_date = excluded.broadcast_date,
+                    start_time = excluded.start_time,
+                    end_time = excluded.end_time,
+                    file_size = excluded.file_size,
+                    duration = excluded.duration,
+                    file_modified = excluded.file_modified,
+                    virtual_folder_id = excluded.virtual_folder_id,
+                    program_title_key = excluded.program_title_key,
+                    file_name_key = excluded.file_name_key,
+                    start_ts = excluded.start_ts,
+                    updated_at = CURRENT_TIMESTAMP
+            ''', (file_path, file_name, program_id, program_title, station_id, station_name,
+                  broadcast_date, start_time, end_time, file_size, duration, file_modified,
+                  virtual_folder_id, search_key(program_title), search_key(file_name), to_epoch(start_time)))
+
+            file_id = cursor.lastrowid
 
-    try:
-        file_id = execute_with_retry(_register)
         logger.info(f'✅ Recorded file registered: {file_path} (virtual_folder_id={virtual_folder_id})')
         return file_id
 
@@ -956,29 +2162,113 @@ def register_recorded_file(file_path: str, file_name: str, program_id: int = Non
         return None
 
 
-def get_all_recorded_files(limit: int = 1000, offset: int = 0):
-    """全ての録音ファイルを取得（番組情報も含む）"""
+def _encode_file_cursor(file_modified, file_id: int) -> str:
+    """ファイル一覧の続きを取得するためのカーソル（最後の行の file_modified と id）"""
+    return base64.urlsafe_b64encode(json.dumps([file_modified, file_id]).encode()).decode().rstrip('=')
+
+
+def _decode_file_cursor(cursor_value: str):
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        file_modified, file_id = json.loads(base64.urlsafe_b64decode(cursor_value + '=' * (-len(cursor_value) % 4)))
+    except Exception:
+        raise ValueError(f'Invalid cursor: {cursor_value}')
+    if not isinstance(file_id, int) or not (file_modified is None or isinstance(file_modified, str)):
+        raise ValueError(f'Invalid cursor: {cursor_value}')
+    return file_modified, file_id
 
-        cursor.execute('''
-            SELECT
-                rf.*,
-                p.title as program_db_title,
-                p.description as program_description,
-                p.performer as program_performer,
-                p.info as program_db_info,
-                p.url as program_url
-            FROM recorded_files rf
-            LEFT JOIN programs p ON rf.program_id = p.id
-            ORDER BY rf.file_modified DESC
-            LIMIT ? OFFSET ?
-        ''', (limit, offset))
 
-        rows = cursor.fetchall()
-        conn.close()
+def _select_recorded_files_page(cursor, folder_condition: str, folder_params: list,
+                                limit: int, after: Optional[str] = None):
+    """
+    録音ファイルを新しい順（file_modified DESC, id DESC）に1ページ分取得する（キーセットページング）
+
+    OFFSETで読み飛ばさず、前のページの最後の行（after）より後ろだけを
+    インデックス（virtual_folder_id, file_modified）の順に読むため、件数が増えても速度が変わらない。
+    file_modified がNULLのファイルは最後に並ぶ（id順）。
+
+    Returns:
+        (rows, next_cursor) 次のページがなければ next_cursor はNone
+    """
+    after_modified, after_id = _decode_file_cursor(after) if after else (None, None)
+
+    # file_modified があるファイルと NULLのファイルをそれぞれインデックス順に読み、つなげる
+    branches = []
+    params = []
+    if after is None or after_modified is not None:
+        keyset = 'AND (rf.file_modified, rf.id) < (?, ?)' if after else ''
+        branches.append(f'''
+            SELECT * FROM (
+                SELECT rf.id, rf.file_modified FROM recorded_files rf
+                WHERE {folder_condition} AND rf.file_modified IS NOT NULL {keyset}
+                ORDER BY rf.file_modified DESC, rf.id DESC
+                LIMIT ?
+            )
+        ''')
+        params.extend(folder_params + ([after_modified, after_id] if after else []) + [limit + 1])
+
+    keyset = 'AND rf.id < ?' if after and after_modified is None else ''
+    branches.append(f'''
+        SELECT * FROM (
+            SELECT rf.id, rf.file_modified FROM recorded_files rf
+            WHERE {folder_condition} AND rf.file_modified IS NULL {keyset}
+            ORDER BY rf.id DESC
+            LIMIT ?
+        )
+    ''')
+    params.extend(folder_params + ([after_id] if keyset else []) + [limit + 1])
+    params.append(limit + 1)
+
+    # 先にIDだけで1ページ分（+次ページの有無を見る1件）を決め、その行だけ番組情報と合わせて読む
+    cursor.execute(f'''
+        WITH page AS (
+            {' UNION ALL '.join(branches)}
+            ORDER BY file_modified DESC, id DESC
+            LIMIT ?
+        )
+        SELECT
+            rf.*,
+            p.title as program_db_title,
+            p.description as program_description,
+            p.performer as program_performer,
+            p.info as program_db_info,
+            p.url as program_url
+        FROM page
+        JOIN recorded_files rf ON rf.id = page.id
+        LEFT JOIN programs p ON rf.program_id = p.id
+        ORDER BY page.file_modified DESC, page.id DESC
+    ''', params)
+
+    rows = cursor.fetchall()
+    if len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    return rows, _encode_file_cursor(rows[-1]['file_modified'], rows[-1]['id'])
+
+
+def get_all_recorded_files(limit: int = 1000, after: str = None):
+    """
+    全ての録音ファイルを新しい順に取得（番組情報も含む）
+
+    Args:
+        limit: 1ページの件数
+        after: 前のページの next_cursor（省略時は先頭から）
+
+    Returns:
+        {'files': [...], 'next_cursor': 次のページのカーソル（なければNone）}
+
+    Raises:
+        ValueError: afterが不正なカーソルの場合（空のページと区別できるよう、エラーとして返す）
+    """
+    if after is not None:
+        _decode_file_cursor(after)
+
+    try:
+        with connection() as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+
+            rows, next_cursor = _select_recorded_files_page(cursor, '1', [], limit, after)
 
         files = []
         for row in rows:
@@ -1013,45 +2303,45 @@ def get_all_recorded_files(limit: int = 1000, offset: int = 0):
 
             files.append(file_data)
 
-        return files
+        return {'files': files, 'next_cursor': next_cursor}
 
     except Exception as e:
         logger.error(f'❌ Get recorded files error: {str(e)}')
-        return []
+        return {'files': [], 'next_cursor': None}
 
 
 def search_recorded_files(keyword: str = None, station_id: str = None,
                          broadcast_date_from: str = None, broadcast_date_to: str = None):
-    """録音ファイルを検索"""
+    """録音ファイルを検索（キーワードは search_key で正規化して比較する）"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        with connection() as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
 
-        query = 'SELECT * FROM recorded_files WHERE 1=1'
-        params = []
+            query = 'SELECT * FROM recorded_files WHERE 1=1'
+            params = []
 
-        if keyword:
-            query += ' AND (program_title LIKE ? OR file_name LIKE ?)'
-            params.extend([f'%{keyword}%', f'%{keyword}%'])
+            if keyword:
+                key = search_key(keyword)
+                query += ' AND (program_title_key LIKE ? OR file_name_key LIKE ?)'
+                params.extend([f'%{key}%', f'%{key}%'])
 
-        if station_id:
-            query += ' AND station_id = ?'
-            params.append(station_id)
+            if station_id:
+                query += ' AND station_id = ?'
+                params.append(station_id)
 
-        if broadcast_date_from:
-            query += ' AND broadcast_date >= ?'
-            params.append(broadcast_date_from)
+            if broadcast_date_from:
+                query += ' AND broadcast_date >= ?'
+                params.append(broadcast_date_from)
 
-        if broadcast_date_to:
-            query += ' AND broadcast_date <= ?'
-            params.append(broadcast_date_to)
+            if broadcast_date_to:
+                query += ' AND broadcast_date <= ?'
+                params.append(broadcast_date_to)
 
-        query += ' ORDER BY file_modified DESC LIMIT 1000'
+            query += ' ORDER BY file_modified DESC LIMIT 1000'
 
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
-        conn.close()
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
 
         files = []
         for row in rows:
@@ -1079,17 +2369,16 @@ def search_recorded_files(keyword: str = None, station_id: str = None,
         return []
 
 
+@_writes
 def delete_recorded_file(file_path: str):
     """録音ファイルをDBから削除"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        with connection() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute('DELETE FROM recorded_files WHERE file_path = ?', (file_path,))
+            cursor.execute('DELETE FROM recorded_files WHERE file_path = ?', (file_path,))
 
-        conn.commit()
-        affected_rows = cursor.rowcount
-        conn.close()
+            affected_rows = cursor.rowcount
 
         if affected_rows > 0:
             logger.info(f'✅ Recorded file deleted from DB: {file_path}')
@@ -1106,13 +2395,12 @@ def delete_recorded_file(file_path: str):
 def get_recorded_file_by_path(file_path: str):
     """ファイルパスで録音ファイル情報を取得"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        with connection() as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
 
-        cursor.execute('SELECT * FROM recorded_files WHERE file_path = ?', (file_path,))
-        row = cursor.fetchone()
-        conn.close()
+            cursor.execute('SELECT * FROM recorded_files WHERE file_path = ?', (file_path,))
+            row = cursor.fetchone()
 
         if row:
             return {
@@ -1142,18 +2430,17 @@ def get_recorded_file_by_path(file_path: str):
 def find_program_by_info(station_id: str, start_time: str):
     """局IDと開始時刻から番組を検索"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        with connection() as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
 
-        cursor.execute('''
-            SELECT id FROM programs
-            WHERE station_id = ? AND start_time = ?
-            LIMIT 1
-        ''', (station_id, start_time))
+            cursor.execute('''
+                SELECT id FROM programs
+                WHERE station_id = ? AND start_time = ?
+                LIMIT 1
+            ''', (station_id, start_time))
 
-        row = cursor.fetchone()
-        conn.close()
+            row = cursor.fetchone()
 
         if row:
             return row['id']
@@ -1169,20 +2456,19 @@ def find_program_by_info(station_id: str, start_time: str):
 # 仮想フォルダ管理
 # ========================================
 
+@_writes
 def create_virtual_folder(name: str, parent_id: int = None, color: str = None, icon: str = None):
     """仮想フォルダを作成"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        with connection() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute('''
-            INSERT INTO virtual_folders (name, parent_id, color, icon)
-            VALUES (?, ?, ?, ?)
-        ''', (name, parent_id, color, icon))
+            cursor.execute('''
+                INSERT INTO virtual_folders (name, parent_id, color, icon)
+                VALUES (?, ?, ?, ?)
+            ''', (name, parent_id, color, icon))
 
-        folder_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+            folder_id = cursor.lastrowid
 
         logger.info(f'✅ Virtual folder created: {name} (ID: {folder_id})')
         return folder_id
@@ -1195,12 +2481,11 @@ def create_virtual_folder(name: str, parent_id: int = None, color: str = None, i
 def get_virtual_folder_by_name(name: str):
     """フォルダ名からIDを取得"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        with connection() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute('SELECT id FROM virtual_folders WHERE name = ?', (name,))
-        row = cursor.fetchone()
-        conn.close()
+            cursor.execute('SELECT id FROM virtual_folders WHERE name = ?', (name,))
+            row = cursor.fetchone()
 
         if row:
             return row[0]
@@ -1214,17 +2499,16 @@ def get_virtual_folder_by_name(name: str):
 def get_all_virtual_folders():
     """全ての仮想フォルダを取得"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        with connection() as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
 
-        cursor.execute('''
-            SELECT * FROM virtual_folders
-            ORDER BY sort_order ASC, name ASC
-        ''')
+            cursor.execute('''
+                SELECT * FROM virtual_folders
+                ORDER BY sort_order ASC, name ASC
+            ''')
 
-        rows = cursor.fetchall()
-        conn.close()
+            rows = cursor.fetchall()
 
         folders = []
         for row in rows:
@@ -1246,40 +2530,39 @@ def get_all_virtual_folders():
         return []
 
 
+@_writes
 def update_virtual_folder(folder_id: int, name: str = None, color: str = None, icon: str = None, parent_id: int = None):
     """仮想フォルダを更新"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-
-        updates = []
-        params = []
-
-        if name is not None:
-            updates.append('name = ?')
-            params.append(name)
-        if color is not None:
-            updates.append('color = ?')
-            params.append(color)
-        if icon is not None:
-            updates.append('icon = ?')
-            params.append(icon)
-        if parent_id is not None:
-            updates.append('parent_id = ?')
-            params.append(parent_id)
-
-        if not updates:
-            return False
+        with connection() as conn:
+            cursor = conn.cursor()
+
+            updates = []
+            params = []
+
+            if name is not None:
+                updates.append('name = ?')
+                params.append(name)
+            if color is not None:
+                updates.append('color = ?')
+                params.append(color)
+            if icon is not None:
+                updates.append('icon = ?')
+                params.append(icon)
+            if parent_id is not None:
+                updates.append('parent_id = ?')
+                params.append(parent_id)
 
-        updates.append('updated_at = CURRENT_TIMESTAMP')
-        params.append(folder_id)
+            if not updates:
+                return False
 
-        query = f"UPDATE virtual_folders SET {', '.join(updates)} WHERE id = ?"
-        cursor.execute(query, params)
+            updates.append('updated_at = CURRENT_TIMESTAMP')
+            params.append(folder_id)
 
-        conn.commit()
-        affected_rows = cursor.rowcount
-        conn.close()
+            query = f"UPDATE virtual_folders SET {', '.join(updates)} WHERE id = ?"
+            cursor.execute(query, params)
+
+            affected_rows = cursor.rowcount
 
         if affected_rows > 0:
             logger.info(f'✅ Virtual folder updated: ID {folder_id}')
@@ -1292,25 +2575,24 @@ def update_virtual_folder(folder_id: int, name: str = None, color: str = None, i
         return False
 
 
+@_writes
 def delete_virtual_folder(folder_id: int):
     """仮想フォルダを削除（フォルダ内のファイルはルートに移動）"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        with connection() as conn:
+            cursor = conn.cursor()
 
-        # フォルダ内のファイルをルート（NULL）に移動
-        cursor.execute('''
-            UPDATE recorded_files
-            SET virtual_folder_id = NULL
-            WHERE virtual_folder_id = ?
-        ''', (folder_id,))
+            # フォルダ内のファイルをルート（NULL）に移動
+            cursor.execute('''
+                UPDATE recorded_files
+                SET virtual_folder_id = NULL
+                WHERE virtual_folder_id = ?
+            ''', (folder_id,))
 
-        # フォルダを削除
-        cursor.execute('DELETE FROM virtual_folders WHERE id = ?', (folder_id,))
+            # フォルダを削除
+            cursor.execute('DELETE FROM virtual_folders WHERE id = ?', (folder_id,))
 
-        conn.commit()
-        affected_rows = cursor.rowcount
-        conn.close()
+            affected_rows = cursor.rowcount
 
         if affected_rows > 0:
             logger.info(f'✅ Virtual folder deleted: ID {folder_id}')
@@ -1323,21 +2605,47 @@ def delete_virtual_folder(folder_id: int):
         return False
 
 
+@_writes
+def rename_recorded_file(file_path: str, new_path: str, new_name: str):
+    """録音ファイルのパスとファイル名を変更（ファイルのリネーム後に呼ぶ）"""
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute('''
+                UPDATE recorded_files
+                SET file_path = ?, file_name = ?, file_name_key = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE file_path = ?
+            ''', (new_path, new_name, search_key(new_name), file_path))
+
+            affected_rows = cursor.rowcount
+
+        if affected_rows > 0:
+            logger.info(f'✅ Recorded file renamed in DB: {file_path} -> {new_path}')
+            return True
+        else:
+            logger.warning(f'⚠️ Recorded file not found in DB: {file_path}')
+            return False
+
+    except Exception as e:
+        logger.error(f'❌ Rename recorded file error: {str(e)}')
+        return False
+
+
+@_writes
 def move_file_to_folder(file_path: str, folder_id: int = None):
     """ファイルを仮想フォルダに移動（folder_id=Noneでルートに移動）"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        with connection() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute('''
-            UPDATE recorded_files
-            SET virtual_folder_id = ?, updated_at = CURRENT_TIMESTAMP
-            WHERE file_path = ?
-        ''', (folder_id, file_path))
+            cursor.execute('''
+                UPDATE recorded_files
+                SET virtual_folder_id = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE file_path = ?
+            ''', (folder_id, file_path))
 
-        conn.commit()
-        affected_rows = cursor.rowcount
-        conn.close()
+            affected_rows = cursor.rowcount
 
         if affected_rows > 0:
             logger.info(f'✅ File moved to folder: {file_path} -> Folder ID {folder_id}')
@@ -1351,48 +2659,37 @@ def move_file_to_folder(file_path: str, folder_id: int = None):
         return False
 
 
-def get_files_in_folder(folder_id: int = None, limit: int = 1000, offset: int = 0):
-    """仮想フォルダ内のファイルを取得（folder_id=Noneでルートのファイル）"""
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+def get_files_in_folder(folder_id: int = None, limit: int = 1000, after: str = None):
+    """
+    仮想フォルダ内のファイルを新しい順に取得（folder_id=Noneでルートのファイル）
 
-        if folder_id is None:
-            # ルートのファイル（フォルダに属していないファイル）
-            cursor.execute('''
-                SELECT
-                    rf.*,
-                    p.title as program_db_title,
-                    p.description as program_description,
-                    p.performer as program_performer,
-                    p.info as program_db_info,
-                    p.url as program_url
-                FROM recorded_files rf
-                LEFT JOIN programs p ON rf.program_id = p.id
-                WHERE rf.virtual_folder_id IS NULL
-                ORDER BY rf.file_modified DESC
-                LIMIT ? OFFSET ?
-            ''', (limit, offset))
-        else:
-            # 指定されたフォルダ内のファイル
-            cursor.execute('''
-                SELECT
-                    rf.*,
-                    p.title as program_db_title,
-                    p.description as program_description,
-                    p.performer as program_performer,
-                    p.info as program_db_info,
-                    p.url as program_url
-                FROM recorded_files rf
-                LEFT JOIN programs p ON rf.program_id = p.id
-                WHERE rf.virtual_folder_id = ?
-                ORDER BY rf.file_modified DESC
-                LIMIT ? OFFSET ?
-            ''', (folder_id, limit, offset))
+    Args:
+        folder_id: 仮想フォルダID
+        limit: 1ページの件数
+        after: 前のページの next_cursor（省略時は先頭から）
 
-        rows = cursor.fetchall()
-        conn.close()
+    Returns:
+        {'files': [...], 'next_cursor': 次のページのカーソル（なければNone）}
+
+    Raises:
+        ValueError: afterが不正なカーソルの場合（空のページと区別できるよう、エラーとして返す）
+    """
+    if after is not None:
+        _decode_file_cursor(after)
+
+    try:
+        with connection() as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+
+            if folder_id is None:
+                # ルートのファイル（フォルダに属していないファイル）
+                rows, next_cursor = _select_recorded_files_page(
+                    cursor, 'rf.virtual_folder_id IS NULL', [], limit, after)
+            else:
+                # 指定されたフォルダ内のファイル
+                rows, next_cursor = _select_recorded_files_page(
+                    cursor, 'rf.virtual_folder_id = ?', [folder_id], limit, after)
 
         files = []
         for row in rows:
@@ -1438,11 +2735,11 @@ def get_files_in_folder(folder_id: int = None, limit: int = 1000, offset: int =
 
             files.append(file_data)
 
-        return files
+        return {'files': files, 'next_cursor': next_cursor}
 
     except Exception as e:
         logger.error(f'❌ Get files in folder error: {str(e)}')
-        return []
+        return {'files': [], 'next_cursor': None}
 
 
 if __name__ == '__main__':
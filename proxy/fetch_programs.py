@@ -2,15 +2,47 @@
 番組表を取得してDBに保存するバッチ処理
 APSchedulerで30分ごとに実行
 """
-import requests
+import atexit
+import hashlib
+import io
 import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, timedelta
 from xml.etree import ElementTree as ET
 import db
+import radiko_client
+import xml_archive
 import time
 
 logger = logging.getLogger(__name__)
 
+# 並列取得設定（環境変数で調整可能）
+# FETCH_MAX_WORKERS: 全体の同時リクエスト数
+# 同一ホストへの同時リクエスト数・流量は radiko_client（FETCH_PER_HOST_LIMIT, RADIKO_RATE等）で制限する
+FETCH_MAX_WORKERS = int(os.environ.get('FETCH_MAX_WORKERS', '8'))
+
+# 取得モード
+# daily: 放送局×日付ごとに v3/program/station/date を取得
+# weekly: 放送局ごとに v3/program/station/weekly を1回取得し、含まれない日付のみdailyで補完
+FETCH_MODE = os.environ.get('FETCH_MODE', 'weekly')
+
+# 条件付き取得（ETag/Last-Modified/内容ハッシュ）で変更のない番組表をスキップするか
+FETCH_CONDITIONAL = os.environ.get('FETCH_CONDITIONAL', '1') == '1'
+
+# 番組表XMLを解析するプロセス数
+# 解析をFlaskのリクエスト処理と同じプロセス（GIL）で行わないよう、別プロセスで行う。0の場合は取得スレッドで解析する
+PARSE_PROCESSES = int(os.environ.get('PARSE_PROCESSES', '2'))
+
+# 放送局一覧キャッシュの有効期限（時間）
+STATION_LIST_TTL_HOURS = float(os.environ.get('STATION_LIST_TTL_HOURS', '24'))
+
+# 条件付き取得で前回から変更がなかったことを示す戻り値
+UNCHANGED = object()
+
 # 全エリアID
 ALL_AREA_IDS = [
     'JP1', 'JP2', 'JP3', 'JP4', 'JP5', 'JP6', 'JP7', 'JP8', 'JP9', 'JP10',
@@ -24,83 +56,363 @@ ALL_AREA_IDS = [
 def parse_radiko_time(time_str: str) -> str:
     """
     radikoの時刻文字列（YYYYMMDDHHmmss）をISO形式に変換
+
+    番組ごとに呼ばれるため、strptimeを使わず文字列のスライスで組み立てる
+    """
+    if len(time_str) == 14 and time_str.isdigit():
+        return f'{time_str[0:4]}-{time_str[4:6]}-{time_str[6:8]}T{time_str[8:10]}:{time_str[10:12]}:{time_str[12:14]}'
+    return time_str
+
+
+def _http_get(url: str, headers=None):
+    """
+    共有HTTPクライアント（接続プール・リトライ・ホスト単位の同時接続制限付き）でGETする
+    """
+    return radiko_client.get(url, headers=headers)
+
+
+def _conditional_get(url: str, validators=None):
+    """
+    条件付きGET
+
+    validators: 前回取得時の {'etag', 'last_modified', 'content_hash'}。
+                Noneの場合は通常のGET。指定した場合は取得後に新しい値で上書きされる。
+
+    戻り値: レスポンスボディ。304または内容ハッシュが同じ場合はUNCHANGED、失敗時はNone
+    """
+    headers = {}
+    if validators:
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+
+    response = _http_get(url, headers=headers or None)
+
+    if validators is not None and response.status_code == 304:
+        return UNCHANGED
+
+    if not response.ok:
+        return None
+
+    if validators is None:
+        return response.content
+
+    content_hash = hashlib.sha1(response.content).hexdigest()
+    unchanged = bool(validators.get('content_hash')) and validators['content_hash'] == content_hash
+
+    validators['etag'] = response.headers.get('ETag')
+    validators['last_modified'] = response.headers.get('Last-Modified')
+    validators['content_hash'] = content_hash
+
+    return UNCHANGED if unchanged else response.content
+
+
+def _fetch_document(kind: str, station_id: str, date: str, path: str, validators=None, replay: bool = False):
+    """
+    番組表XMLを取得し、XML_ARCHIVEが有効ならアーカイブに保存する
+
+    replay=True の場合はradikoにアクセスせず、アーカイブの最新のXMLを返す（なければNone）。
+    戻り値は _conditional_get と同じ
+    """
+    if replay:
+        return xml_archive.load_latest(kind, station_id, date)
+
+    content = _conditional_get(radiko_client.build_url(path), validators)
+    if content is not None and content is not UNCHANGED:
+        xml_archive.store(kind, station_id, date, content)
+    return content
+
+
+def fetch_area_stations(area_id: str, replay: bool = False) -> list:
+    """
+    エリアの放送局一覧を取得
+    replay: Trueの場合はアーカイブから読み込む
+    戻り値: [(station_id, station_name), ...]
+    """
+    logger.info(f'Fetching stations for {area_id}...')
+
+    content = _fetch_document('now', area_id, 'now', f'v3/program/now/{area_id}.xml', replay=replay)
+    if content is None:
+        logger.warning(f'Failed to fetch stations for {area_id}')
+        return []
+
+    now_xml = ET.fromstring(content)
+
+    stations = []
+    for station in now_xml.findall('.//station'):
+        station_name_elem = station.find('name')
+        station_name = station_name_elem.text if station_name_elem is not None else 'Unknown'
+        stations.append((station.get('id'), station_name))
+
+    logger.info(f'Found {len(stations)} stations for {area_id}')
+    return stations
+
+
+def get_area_stations(area_id: str, force: bool = False, replay: bool = False) -> list:
+    """
+    エリアの放送局一覧を取得（DBキャッシュ優先）
+
+    キャッシュが STATION_LIST_TTL_HOURS 以内ならradikoへアクセスしない。
+    期限切れでradikoから取得できなかった場合は古いキャッシュを使う。
+    replay=True の場合はアーカイブ、なければ期限切れを含むキャッシュを使う（radikoへはアクセスしない）。
+    戻り値: [(station_id, station_name), ...]
     """
+    if replay:
+        stations = fetch_area_stations(area_id, replay=True)
+        return stations or db.get_area_stations(area_id, max_age_hours=None)
+
+    if not force:
+        cached = db.get_area_stations(area_id, max_age_hours=STATION_LIST_TTL_HOURS)
+        if cached:
+            return cached
+
     try:
-        dt = datetime.strptime(time_str, '%Y%m%d%H%M%S')
-        return dt.isoformat()
-    except Exception:
-        return time_str
+        stations = fetch_area_stations(area_id)
+    except Exception as e:
+        logger.warning(f'Error fetching stations for {area_id}: {str(e)}')
+        stations = []
+
+    if stations:
+        db.save_area_stations(area_id, stations)
+        return stations
+
+    stale = db.get_area_stations(area_id, max_age_hours=None)
+    if stale:
+        logger.info(f'Using stale station list for {area_id}')
+        return stale
+
+    return []
+
+
+# 番組dictに取り込む<prog>の子要素
+_PROG_FIELDS = frozenset(('title', 'desc', 'pfm', 'info', 'url'))
+
+
+def _prog_dict(elem, station_id: str, station_name: str):
+    """<prog>要素を番組dictに変換（ft/toがない場合はNone）"""
+    ft_str = elem.get('ft')
+    to_str = elem.get('to')
+    if not ft_str or not to_str:
+        return None
+
+    program = {
+        'stationId': station_id,
+        'stationName': station_name,
+        'title': '',
+        'ft': parse_radiko_time(ft_str),
+        'to': parse_radiko_time(to_str),
+        'desc': '',
+        'pfm': '',
+        'info': '',
+        'url': ''
+    }
+    for child in elem:
+        if child.tag in _PROG_FIELDS and child.text:
+            program[child.tag] = program[child.tag] or child.text
+    return program
 
 
-def fetch_area_programs(area_id: str, date: str) -> list:
+def iter_station_programs(content: bytes, station_id: str, station_name: str):
     """
-    特定エリア・日付の番組表を取得
-    date: YYYYMMDD形式
+    番組表XML（date/weekly共通）をストリーミング解析し、番組dictを順に返す
+
+    iterparseで<prog>の終了タグごとに処理し、処理済みの要素は都度clearするため
+    XML全体のツリーをメモリに保持しない。ft/toがない番組は読み飛ばす。
     """
-    programs = []
+    for _, elem in ET.iterparse(io.BytesIO(content)):
+        if elem.tag != 'prog':
+            continue
+
+        program = _prog_dict(elem, station_id, station_name)
+        elem.clear()
+        if program is not None:
+            yield program
+
+
+def fetch_now_programs(area_id: str) -> list:
+    """
+    radikoのnow.xml（v3/program/now/{area_id}.xml）からエリアの放送中・次の番組を取得
+    （DBに番組表がない場合に now_playing の代わりに使う）
+
+    戻り値: [{'stationId', 'stationName', 'now': 番組dict or None, 'next': 番組dict or None}, ...]
+    """
+    content = _fetch_document('now', area_id, 'now', f'v3/program/now/{area_id}.xml')
+    if content is None:
+        logger.warning(f'Failed to fetch now programs for {area_id}')
+        return []
+
+    now_iso = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+    stations = []
+    for station in ET.fromstring(content).findall('.//station'):
+        station_id = station.get('id')
+        station_name_elem = station.find('name')
+        station_name = station_name_elem.text if station_name_elem is not None else 'Unknown'
+
+        programs = [_prog_dict(elem, station_id, station_name) for elem in station.iter('prog')]
+        programs = sorted((p for p in programs if p is not None), key=lambda p: p['ft'])
+        stations.append({
+            'stationId': station_id,
+            'stationName': station_name,
+            'now': next((p for p in programs if p['ft'] <= now_iso < p['to']), None),
+            'next': next((p for p in programs if p['ft'] > now_iso), None)
+        })
+
+    return stations
+
+
+# 番組レコード（解析プロセスから返すタプル）の項目。programsテーブルの列順に合わせている
+PROGRAM_RECORD_FIELDS = ('stationName', 'title', 'ft', 'to', 'desc', 'pfm', 'info', 'url')
+
+
+def parse_station_records(content: bytes, station_name: str) -> list:
+    """番組表XMLを番組レコード（PROGRAM_RECORD_FIELDSの順のタプル）のリストに変換"""
+    return [
+        (station_name, p['title'], p['ft'], p['to'], p['desc'], p['pfm'], p['info'], p['url'])
+        for p in iter_station_programs(content, '', station_name)
+    ]
+
+
+def parse_weekly_records(content: bytes, station_name: str) -> dict:
+    """週間番組表XMLを放送日（5時区切り）ごとの番組レコードに分割: {YYYYMMDD: [レコード, ...]}"""
+    records_by_date = {}
+    for record in parse_station_records(content, station_name):
+        records_by_date.setdefault(broadcast_date(record[2]), []).append(record)
+    return records_by_date
+
+
+def program_dict(station_id: str, record: tuple) -> dict:
+    """番組レコードを番組dictに変換"""
+    program = {'stationId': station_id}
+    program.update(zip(PROGRAM_RECORD_FIELDS, record))
+    return program
+
+
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+
+def _get_parse_pool():
+    """解析用のプロセスプールを取得（初回のみ作成）。PARSE_PROCESSES=0の場合はNone"""
+    global _parse_pool
+
+    if PARSE_PROCESSES <= 0:
+        return None
+
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            # スレッド（スケジューラー・Flask）を持つプロセスからforkしないようspawnで起動する
+            _parse_pool = ProcessPoolExecutor(
+                max_workers=PARSE_PROCESSES,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            logger.info(f'Started {PARSE_PROCESSES} parser processes')
+        return _parse_pool
+
+
+def _discard_parse_pool(pool):
+    """異常終了したプロセスプールを破棄する（次回の解析時に作り直す）"""
+    global _parse_pool
+
+    with _parse_pool_lock:
+        if _parse_pool is pool:
+            _parse_pool = None
+    pool.shutdown(wait=False)
+
+
+@atexit.register
+def _shutdown_parse_pool():
+    if _parse_pool is not None:
+        _parse_pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _parse(func, content: bytes, station_name: str):
+    """解析用のプロセスで解析して結果を待つ（プロセスプールを使わない場合はこのスレッドで解析）"""
+    pool = _get_parse_pool()
+    if pool is None:
+        return func(content, station_name)
 
     try:
-        # まず放送局一覧を取得
-        now_url = f'http://radiko.jp/v3/program/now/{area_id}.xml'
-        logger.info(f'Fetching stations for {area_id}...')
+        return pool.submit(func, content, station_name).result()
+    except BrokenProcessPool:
+        _discard_parse_pool(pool)
+        raise
 
-        now_response = requests.get(now_url, timeout=30)
-        if not now_response.ok:
-            logger.warning(f'Failed to fetch stations for {area_id}: {now_response.status_code}')
-            return programs
 
-        now_xml = ET.fromstring(now_response.content)
-        stations = now_xml.findall('.//station')
+def broadcast_date(time_str: str) -> str:
+    """
+    ISO形式の番組開始時刻から放送日（YYYYMMDD）を求める
+    朝5時未満は前日の放送として扱う
+    """
+    date_str = time_str[0:4] + time_str[5:7] + time_str[8:10]
+    if time_str[11:13] < '05':
+        date_str = (datetime.strptime(date_str, '%Y%m%d') - timedelta(days=1)).strftime('%Y%m%d')
+    return date_str
 
-        logger.info(f'Found {len(stations)} stations for {area_id}')
 
-        # 各放送局の番組表を取得
-        for station in stations:
-            station_id = station.get('id')
-            station_name_elem = station.find('name')
-            station_name = station_name_elem.text if station_name_elem is not None else 'Unknown'
+def _station_date_path(station_id: str, date: str) -> str:
+    return f'v3/program/station/date/{date}/{station_id}.xml'
 
-            try:
-                station_url = f'http://radiko.jp/v3/program/station/date/{date}/{station_id}.xml'
-                station_response = requests.get(station_url, timeout=30)
 
-                if not station_response.ok:
-                    continue
+def _station_weekly_path(station_id: str) -> str:
+    return f'v3/program/station/weekly/{station_id}.xml'
 
-                station_xml = ET.fromstring(station_response.content)
-                progs = station_xml.findall('.//prog')
 
-                for prog in progs:
-                    title_elem = prog.find('title')
-                    desc_elem = prog.find('desc')
-                    pfm_elem = prog.find('pfm')
-                    info_elem = prog.find('info')
-                    url_elem = prog.find('url')
+def fetch_station_programs(station_id: str, station_name: str, date: str, validators=None, replay: bool = False):
+    """
+    特定放送局・日付の番組表を取得
+    date: YYYYMMDD形式
+    validators: 条件付き取得用のキャッシュ（_conditional_get参照）
+    replay: Trueの場合はアーカイブから読み込む
 
-                    ft_str = prog.get('ft')
-                    to_str = prog.get('to')
+    validatorsを指定し前回から変更がない場合はUNCHANGEDを返す（XMLは解析しない）
+    """
+    programs = []
 
-                    if not ft_str or not to_str:
-                        continue
+    try:
+        content = _fetch_document('date', station_id, date, _station_date_path(station_id, date), validators, replay)
 
-                    programs.append({
-                        'stationId': station_id,
-                        'stationName': station_name,
-                        'title': title_elem.text if title_elem is not None else '',
-                        'ft': parse_radiko_time(ft_str),
-                        'to': parse_radiko_time(to_str),
-                        'desc': desc_elem.text if desc_elem is not None else '',
-                        'pfm': pfm_elem.text if pfm_elem is not None else '',
-                        'info': info_elem.text if info_elem is not None else '',
-                        'url': url_elem.text if url_elem is not None else ''
-                    })
-
-                # レート制限対策
-                time.sleep(0.1)
+        if content is UNCHANGED:
+            return UNCHANGED
 
-            except Exception as e:
-                logger.warning(f'Error fetching {station_id}: {str(e)}')
-                continue
+        if content is None:
+            return programs
+
+        programs = [
+            program_dict(station_id, record)
+            for record in _parse(parse_station_records, content, station_name)
+        ]
+
+    except Exception as e:
+        logger.warning(f'Error fetching {station_id}: {str(e)}')
+
+    return programs
+
+
+def fetch_area_programs(area_id: str, date: str) -> list:
+    """
+    特定エリア・日付の番組表を取得
+    date: YYYYMMDD形式
+
+    放送局ごとの取得はスレッドプールで並列実行する
+    """
+    programs = []
+
+    try:
+        # まず放送局一覧を取得（DBキャッシュ優先）
+        stations = get_area_stations(area_id)
+        if not stations:
+            return programs
+
+        # 各放送局の番組表を並列取得（結果は放送局一覧の順序で結合）
+        max_workers = max(1, min(FETCH_MAX_WORKERS, len(stations)))
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='fetch') as executor:
+            results = executor.map(
+                lambda station: fetch_station_programs(station[0], station[1], date),
+                stations
+            )
+            for station_programs in results:
+                programs.extend(station_programs)
 
     except Exception as e:
         logger.error(f'Error fetching programs for {area_id} on {date}: {str(e)}')
@@ -108,86 +420,378 @@ def fetch_area_programs(area_id: str, date: str) -> list:
     return programs
 
 
-def update_all_areas(days=7):
+def broadcast_today() -> datetime:
+    """放送日基準（朝5時未満は前日扱い）の今日"""
+    today = datetime.now()
+    if today.hour < 5:
+        today = today - timedelta(days=1)
+    return today
+
+
+def crawl_dates(start: int, end: int) -> list:
+    """放送日基準の今日からstart日〜end日（両端含む）の日付リスト（YYYYMMDD）"""
+    today = broadcast_today()
+    return [(today + timedelta(days=i)).strftime('%Y%m%d') for i in range(start, end + 1)]
+
+
+def update_all_areas(days=7, mode=None, conditional=None, dates=None, on_event=None,
+                     select_units=None, job_id=None, replay=False):
     """
     全エリアの番組表を更新
 
+    通常は crawler 経由で呼び出す（同時に複数のクロールが走らないようにするため）。
+
     Args:
         days: 取得する日数（デフォルト: 7）
               過去days日間 + 今日 + 未来days日間を取得
+        mode: 'daily' または 'weekly'（省略時は FETCH_MODE）
+        conditional: 変更のない番組表をスキップするか（省略時は FETCH_CONDITIONAL）
+        dates: 取得する日付リスト（指定時はdaysより優先）
+        on_event: 進捗イベントの通知先 on_event(event_type, **fields)
+        select_units: 取得する放送局×日付を選ぶ関数 select_units(station_ids, dates) -> {(station_id, date), ...}
+                      （対象外の放送局は既存の番組をそのまま使う）
+        job_id: 指定した場合、保存した放送局×日付をチェックポイント（crawl_units）に記録する
+        replay: Trueの場合はradikoにアクセスせず、アーカイブ（xml_archive）のXMLから取り込み直す
+
+    複数エリアに属する放送局（NHK等）は放送局×日付ごとに1回だけ取得し、
+    FETCH_MAX_WORKERS（全体）/ FETCH_PER_HOST_LIMIT（ホスト単位）の範囲で並列に取得する。
+    取得スレッドはXMLを取得するだけで、解析は解析用のプロセス（PARSE_PROCESSES）で行い、
+    番組レコード（タプル）として受け取る。
+    weeklyモードでは放送局ごとに週間番組表を1回だけ取得し、
+    週間番組表に含まれない日付のみ日付指定で補完する。
+    条件付き取得では前回のETag/Last-Modified/内容ハッシュと比較し、
+    変更のない番組表は解析もDB書き込みも行わない。
+    DBへの保存は日付単位で揃った時点で、その放送局を持つ全エリア分を
+    呼び出し元スレッドからまとめて行う。
     """
-    logger.info('=' * 60)
-    logger.info(f'Starting program data update for all areas ({days} days range)')
-    logger.info('=' * 60)
+    mode = mode or FETCH_MODE
+    if conditional is None:
+        conditional = FETCH_CONDITIONAL
+    if replay:
+        # アーカイブの内容をすべて取り込み直す
+        conditional = False
 
-    start_time = time.time()
+    def emit(event_type, **fields):
+        if on_event is not None:
+            on_event(event_type, **fields)
 
-    # 日付リストを生成（朝5時基準）
-    now = datetime.now()
-    today = datetime.now()
+    # 日付リストを生成（朝5時基準で -days日〜+days日）
+    if dates is None:
+        dates = crawl_dates(-days, days)
 
-    # 朝5時未満の場合は前日として扱う
-    if today.hour < 5:
-        today = today - timedelta(days=1)
+    logger.info('=' * 60)
+    logger.info(f'Starting program data update for all areas ({len(dates)} days, {mode} mode'
+                f'{", replay from archive" if replay else ""})')
+    logger.info(f'Concurrency: {FETCH_MAX_WORKERS} workers, {radiko_client.PER_HOST_LIMIT} per host')
+    logger.info('=' * 60)
 
-    dates = []
-    for i in range(-days, days + 1):  # -days日〜+days日
-        date = today + timedelta(days=i)
-        date_str = date.strftime('%Y%m%d')
-        dates.append(date_str)
+    start_time = time.time()
 
     logger.info(f'Date range: {dates[0]} to {dates[-1]} ({len(dates)} days)')
 
+    total_tasks = len(ALL_AREA_IDS) * len(dates)
+    emit('start', message=f'{len(dates)}日分の番組表更新を開始します...')
+    emit('info', message=f'全{len(ALL_AREA_IDS)}エリア × {len(dates)}日 = {total_tasks}件の処理')
+
     total_programs = 0
     success_count = 0
+    unchanged_count = 0
+    warning_count = 0
     error_count = 0
-
-    # 各エリアを処理
-    for idx, area_id in enumerate(ALL_AREA_IDS, 1):
-        logger.info(f'[{idx}/{ len(ALL_AREA_IDS)}] Processing {area_id}...')
-
-        for date in dates:
+    request_count = 0
+    completed_tasks = 0
+
+    def emit_percent():
+        emit('percent',
+             percent=int(completed_tasks / total_tasks * 100) if total_tasks else 100,
+             completed=completed_tasks,
+             total=total_tasks,
+             success=success_count + unchanged_count,
+             unchanged=unchanged_count,
+             error=error_count,
+             warning=warning_count)
+
+    # 条件付き取得用のキャッシュ（番組がDBに残っている放送局×日付のみ有効）
+    fetch_cache = {}
+    saved_station_dates = set()
+    if conditional:
+        fetch_cache = db.get_fetch_cache()
+        saved_station_dates = db.get_program_station_dates(dates)
+
+    # 取得後の新しいキャッシュ: {(station_id, date or 'weekly'): (validators, 対象日付の集合)}
+    new_cache = {}
+    failed_dates = set()
+
+    def validators_for(station_id, key):
+        if not conditional:
+            return None
+        if key != 'weekly' and (station_id, key) not in saved_station_dates:
+            return {}
+        return dict(fetch_cache.get((station_id, key), {}))
+
+    with ThreadPoolExecutor(max_workers=max(1, FETCH_MAX_WORKERS), thread_name_prefix='fetch') as executor:
+        # 各エリアの放送局一覧を取得し（DBキャッシュ優先）、エリア→放送局の対応表を作る
+        area_stations = {}
+        station_names = {}
+        station_list_futures = {
+            executor.submit(get_area_stations, area_id, replay=replay): area_id
+            for area_id in ALL_AREA_IDS
+        }
+        for future in as_completed(station_list_futures):
+            area_id = station_list_futures[future]
             try:
-                programs = fetch_area_programs(area_id, date)
+                stations = future.result()
+            except Exception as e:
+                error_count += len(dates)
+                completed_tasks += len(dates)
+                logger.error(f'  ❌ {area_id}: {str(e)}')
+                for date in dates:
+                    emit('error', area=area_id, date=date, message=f'放送局一覧の取得に失敗しました: {str(e)}')
+                continue
 
-                if programs:
-                    db.save_programs(programs, area_id, date)
-                    total_programs += len(programs)
-                    success_count += 1
-                    logger.info(f'  ✅ {area_id} {date}: {len(programs)} programs')
+            area_stations[area_id] = [station_id for station_id, _ in stations]
+            for station_id, station_name in stations:
+                station_names.setdefault(station_id, station_name)
+
+        logger.info(f'Unique stations: {len(station_names)} '
+                    f'(listed {sum(len(ids) for ids in area_stations.values())} times across areas)')
+        # 取得対象の放送局×日付（select_unitsで絞り込み）
+        if select_units is None:
+            wanted = {station_id: set(dates) for station_id in station_names}
+        else:
+            wanted = {}
+            for station_id, date in select_units(list(station_names), dates):
+                if station_id in station_names and date in dates:
+                    wanted.setdefault(station_id, set()).add(date)
+        wanted_units = sum(len(wanted_dates) for wanted_dates in wanted.values())
+
+        if select_units is None:
+            emit('info', message=f'{len(station_names)}局（重複を除く）の番組表を取得しています...')
+        else:
+            logger.info(f'Units to fetch: {wanted_units} / {len(station_names) * len(dates)}')
+            emit('info', message=f'{len(station_names) * len(dates)}件中 {wanted_units}件'
+                                 f'（{len(wanted)}局）の番組表を取得しています...')
+
+        pending = {
+            date: sum(1 for wanted_dates in wanted.values() if date in wanted_dates)
+            for date in dates
+        }
+        results = {date: {} for date in dates}
+        futures = {}
+
+        # 取得対象のない日付は保存しない
+        skipped_dates = [date for date in dates if pending[date] == 0]
+        if skipped_dates:
+            completed_tasks += len(area_stations) * len(skipped_dates)
+            emit('info', message=f'{len(skipped_dates)}日分は取得済みのためスキップします')
+            emit_percent()
+
+        # 解析はプロセスプール（無効の場合は取得スレッド）で行う
+        parse_executor = _get_parse_pool() or executor
+
+        def submit_daily(station_id, date):
+            validators = validators_for(station_id, date)
+            future = executor.submit(
+                _fetch_document, 'date', station_id, date, _station_date_path(station_id, date), validators, replay
+            )
+            futures[future] = ('daily', station_id, date, validators)
+
+        def submit_parse(kind, station_id, date, validators, content):
+            func = parse_weekly_records if kind == 'weekly' else parse_station_records
+            future = parse_executor.submit(func, content, station_names[station_id])
+            futures[future] = (f'parse_{kind}', station_id, date, validators)
+
+        # 放送局ごと（weekly）または放送局×日付ごと（daily）に1回だけ取得
+        for station_id, wanted_dates in wanted.items():
+            if mode == 'weekly':
+                validators = validators_for(station_id, 'weekly')
+                future = executor.submit(
+                    _fetch_document, 'weekly', station_id, 'weekly', _station_weekly_path(station_id), validators, replay
+                )
+                futures[future] = ('weekly', station_id, None, validators)
+            else:
+                for date in dates:
+                    if date in wanted_dates:
+                        submit_daily(station_id, date)
+
+        # 日付単位で揃った時点で、全エリア分をまとめてDBへ保存
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            completed = []
+
+            for future in done:
+                kind, station_id, date, validators = futures.pop(future)
+                label = f'{station_id} {date or "weekly"}'
+
+                if kind in ('daily', 'weekly'):
+                    # 取得完了: 内容があれば解析に回す
+                    request_count += 1
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        result = None
+                        logger.warning(f'  ⚠️ {label}: {str(e)}')
+
+                    if result is not None and result is not UNCHANGED:
+                        submit_parse(kind, station_id, date, validators, result)
+                        continue
                 else:
-                    logger.warning(f'  ⚠️ {area_id} {date}: No programs found')
+                    # 解析完了
+                    kind = kind[len('parse_'):]
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        result = None
+                        logger.warning(f'  ⚠️ {label}: parse error: {str(e)}')
+                        if isinstance(e, BrokenProcessPool) and parse_executor is not executor:
+                            _discard_parse_pool(parse_executor)
+                            parse_executor = executor
+
+                if kind == 'weekly':
+                    programs_by_date = result
+
+                    # 変更がない場合は前回の週間番組表に含まれていた日付のみスキップ
+                    previous_dates = set(validators.get('covered_dates') or []) if validators else set()
+                    covered_dates = set()
+                    for date in dates:
+                        if (programs_by_date is UNCHANGED
+                                and date in previous_dates
+                                and (station_id, date) in saved_station_dates):
+                            programs = UNCHANGED
+                        elif isinstance(programs_by_date, dict) and date in programs_by_date:
+                            programs = programs_by_date[date]
+                        else:
+                            programs = None
+
+                        if programs is not None:
+                            covered_dates.add(date)
+                        if date not in wanted[station_id]:
+                            continue
+                        if programs is not None:
+                            completed.append((station_id, date, programs))
+                        else:
+                            # 週間番組表に含まれない日付は日付指定で補完
+                            submit_daily(station_id, date)
+
+                    # 取得対象外の日付を含む場合、その日付は保存しないためキャッシュも更新しない
+                    if (validators is not None and programs_by_date is not None
+                            and covered_dates <= wanted[station_id]):
+                        validators['covered_dates'] = sorted(covered_dates)
+                        new_cache[(station_id, 'weekly')] = (validators, covered_dates)
+                    continue
 
-                # レート制限対策
-                time.sleep(0.2)
+                programs = [] if result is None else result
+                completed.append((station_id, date, programs))
+                if result is not None and validators is not None and validators.get('content_hash'):
+                    new_cache[(station_id, date)] = (validators, {date})
 
-            except Exception as e:
-                error_count += 1
-                logger.error(f'  ❌ {area_id} {date}: {str(e)}')
+            for station_id, date, programs in completed:
+                results[date][station_id] = programs
+                pending[date] -= 1
+                if pending[date] > 0:
+                    continue
+
+                date_results = results.pop(date)
+                # 変更のない放送局と取得対象外の放送局は既存の番組をそのまま使う
+                unchanged_stations = [
+                    sid for sid in station_names
+                    if sid not in date_results or date_results[sid] is UNCHANGED
+                ]
+                station_programs = {
+                    sid: progs for sid, progs in date_results.items() if progs is not UNCHANGED
+                }
+
+                saved = db.save_date_programs(station_programs, area_stations, date, unchanged_stations)
+                completed_tasks += len(area_stations)
+
+                if job_id is not None:
+                    if saved is None:
+                        units = [(sid, date, 'failed', 'save failed') for sid in date_results]
+                    else:
+                        units = [
+                            (sid, date, 'failed', 'no programs') if not progs else (sid, date, 'done', None)
+                            for sid, progs in date_results.items()
+                        ]
+                    db.save_crawl_units(job_id, units)
+
+                if saved is None:
+                    error_count += len(area_stations)
+                    failed_dates.add(date)
+                    logger.error(f'  ❌ {date}: failed to save programs')
+                    for area_id in area_stations:
+                        emit('error', area=area_id, date=date, message='DBへの保存に失敗しました')
+                    emit_percent()
+                    continue
+
+                total_programs += sum(len(progs) for progs in station_programs.values())
+                success_count += saved['success']
+                unchanged_count += saved['unchanged']
+
+                for area_id in ALL_AREA_IDS:
+                    if area_id not in area_stations:
+                        continue
+                    area_program_count = sum(
+                        len(station_programs.get(sid, [])) for sid in area_stations[area_id]
+                    )
+                    if area_program_count:
+                        logger.info(f'  ✅ {area_id} {date}: {area_program_count} programs')
+                        emit('success', area=area_id, date=date, programs=area_program_count)
+                    elif any(sid in unchanged_stations for sid in area_stations[area_id]):
+                        logger.info(f'  ⏭️ {area_id} {date}: unchanged')
+                        emit('unchanged', area=area_id, date=date)
+                    else:
+                        warning_count += 1
+                        logger.warning(f'  ⚠️ {area_id} {date}: No programs found')
+                        emit('warning', area=area_id, date=date, message='No programs found')
+
+                emit_percent()
+
+    # 保存に成功した日付の分だけ条件付き取得用のキャッシュを更新
+    if conditional:
+        db.save_fetch_cache({
+            key: validators
+            for key, (validators, covered_dates) in new_cache.items()
+            if not (covered_dates & failed_dates)
+        })
 
     elapsed_time = time.time() - start_time
 
     logger.info('=' * 60)
     logger.info(f'Update completed in {elapsed_time:.1f} seconds')
-    logger.info(f'Total programs: {total_programs}')
-    logger.info(f'Success: {success_count}, Errors: {error_count}')
+    logger.info(f'Total programs: {total_programs} (unique)')
+    logger.info(f'Program requests: {request_count}')
+    logger.info(f'Success: {success_count}, Unchanged: {unchanged_count}, '
+                f'Warnings: {warning_count}, Errors: {error_count}')
     logger.info('=' * 60)
 
     # 古いデータを削除
+    emit('info', message='古いデータを削除中...')
     db.cleanup_old_data(days_to_keep=15)
 
     # 結果を返す
     return {
         'areas': len(ALL_AREA_IDS),
+        'dates': len(dates),
         'programs': total_programs,
         'success': success_count,
+        'unchanged': unchanged_count,
+        'warnings': warning_count,
         'errors': error_count,
+        'requests': request_count,
         'elapsed_time': elapsed_time
     }
 
 
 if __name__ == '__main__':
     # 直接実行時
+    import argparse
+
+    parser = argparse.ArgumentParser(description='全エリアの番組表を取得してDBに保存')
+    parser.add_argument('--days', type=int, default=7, help='取得する日数（-days〜+days日）')
+    parser.add_argument('--mode', choices=('daily', 'weekly'), default=None, help='取得モード（省略時は FETCH_MODE）')
+    parser.add_argument('--replay', action='store_true', help='radikoにアクセスせず、アーカイブから取り込み直す')
+    args = parser.parse_args()
+
     logging.basicConfig(
         level=logging.INFO,
         format='%(asctime)s [%(levelname)s] %(message)s'
@@ -197,4 +801,4 @@ if __name__ == '__main__':
     db.init_database()
 
     # 番組表更新
-    update_all_areas()
+    update_all_areas(days=args.days, mode=args.mode, replay=args.replay)
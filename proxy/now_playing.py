@@ -0,0 +1,149 @@
+"""
+放送中・次の番組の検索（メモリ上の区間インデックス）
+
+DBの番組表から現在時刻以降 NOW_INDEX_HOURS 時間分の番組を読み込み、放送局ごとに
+開始時刻順の配列として保持する。各エリアの放送局について、開始時刻の二分探索で
+放送中・次の番組を求めるため、radikoへの問い合わせなしに数マイクロ秒で返せる。
+
+番組はエリアをまたいで共有されるため、インデックスは放送局単位で1つだけ持ち、
+エリアの絞り込みは番組ごとの area_mask で行う。
+番組表が保存・削除される（db.programs_version() が変わる）か、
+読み込んだ時間帯の半分を過ぎると、次の検索時に作り直す。
+"""
+import logging
+import os
+import threading
+import time
+from bisect import bisect_right
+
+import db
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# インデックスに読み込む時間帯（現在時刻から何時間先まで）
+NOW_INDEX_HOURS = float(os.environ.get('NOW_INDEX_HOURS', '24'))
+
+_PROGRAM_EXTRA_KEYS = ('start_ts', 'end_ts', 'area_mask')
+
+
+class _Index:
+    """ある時点の番組表から作ったインデックス"""
+
+    def __init__(self, version: int, start_ts: int, refresh_ts: int, stations: dict, area_stations: dict):
+        self.version = version
+        self.start_ts = start_ts
+        self.refresh_ts = refresh_ts
+        # {station_id: (開始時刻の配列, [(start_ts, end_ts, area_mask, 番組dict), ...])}
+        self.stations = stations
+        # {area_id: [station_id, ...]}（放送局の表示順）
+        self.area_stations = area_stations
+
+    def is_fresh(self, now: int) -> bool:
+        return self.version == db.programs_version() and self.start_ts <= now < self.refresh_ts
+
+
+_index = None
+_index_lock = threading.Lock()
+_build_flight = SingleFlight()
+
+
+def _build(now: int) -> _Index:
+    """DBの番組表からインデックスを作る"""
+    started = time.perf_counter()
+    # 読み込み中に保存された番組表を取りこぼさないよう、先に番号を取っておく
+    version = db.programs_version()
+    window = int(NOW_INDEX_HOURS * 3600)
+
+    stations = {}
+    station_masks = {}
+    for program in db.get_programs_between(now, now + window):
+        station_id = program['stationId']
+        start_ts, end_ts, area_mask = (program.pop(key) for key in _PROGRAM_EXTRA_KEYS)
+        if start_ts is None or end_ts is None:
+            continue
+
+        starts, entries = stations.setdefault(station_id, ([], []))
+        starts.append(start_ts)
+        entries.append((start_ts, end_ts, area_mask, program))
+        station_masks[station_id] = station_masks.get(station_id, 0) | area_mask
+
+    # エリアの放送局はstationsテーブルの順、そこにない放送局は放送局IDの順で後ろに並べる
+    listed_stations = db.get_all_area_station_ids()
+    area_stations = {}
+    for area_number in range(1, db.AREA_COUNT + 1):
+        area_id = f'JP{area_number}'
+        bit = db.area_bit(area_id)
+        ordered = [station_id for station_id in listed_stations.get(area_id, [])
+                   if station_masks.get(station_id, 0) & bit]
+        listed = set(ordered)
+        ordered.extend(sorted(station_id for station_id, mask in station_masks.items()
+                              if mask & bit and station_id not in listed))
+        area_stations[area_id] = ordered
+
+    logger.info(f'🗂️ Built now-playing index: {sum(len(s[0]) for s in stations.values())} programs, '
+                f'{len(stations)} stations ({(time.perf_counter() - started) * 1000:.1f}ms)')
+    return _Index(version, now, now + window // 2, stations, area_stations)
+
+
+def _get_index(now: int) -> _Index:
+    """有効なインデックスを返す（古ければ作り直す。同時に作り直すのは1回だけ）"""
+    global _index
+    index = _index
+    if index is not None and index.is_fresh(now):
+        return index
+
+    index = _build_flight.do('build', _build, now)
+    with _index_lock:
+        _index = index
+    return index
+
+
+def _find(entries_of_station: tuple, bit: int, now: int):
+    """放送局の番組から、エリアで放送中の番組と次の番組を返す"""
+    starts, entries = entries_of_station
+    position = bisect_right(starts, now)
+
+    current = None
+    if position:
+        start_ts, end_ts, area_mask, program = entries[position - 1]
+        if end_ts > now and area_mask & bit:
+            current = program
+
+    upcoming = None
+    for start_ts, end_ts, area_mask, program in entries[position:]:
+        if area_mask & bit:
+            upcoming = program
+            break
+
+    return current, upcoming
+
+
+def get_now_programs(area_id: str, at: int = None) -> list:
+    """
+    エリアの各放送局の放送中・次の番組を取得
+
+    Args:
+        area_id: エリアID（JP1〜JP47）
+        at: 基準時刻（エポック秒、省略時は現在時刻）
+
+    Returns:
+        [{'stationId', 'stationName', 'now': 番組dict or None, 'next': 番組dict or None}, ...]
+        （DBにエリアの番組がなければ空のリスト）
+    """
+    now = int(time.time()) if at is None else int(at)
+    bit = db.area_bit(area_id)
+    index = _get_index(now)
+
+    results = []
+    for station_id in index.area_stations.get(area_id, []):
+        entries_of_station = index.stations[station_id]
+        current, upcoming = _find(entries_of_station, bit, now)
+        station_name = (current or upcoming or entries_of_station[1][0][3])['stationName']
+        results.append({
+            'stationId': station_id,
+            'stationName': station_name,
+            'now': current,
+            'next': upcoming
+        })
+    return results
@@ -0,0 +1,313 @@
+"""
+radiko向けの共有HTTPクライアント
+
+番組表の取得（fetch_programs）と /radiko/<path> プロキシ（app.py）の両方から使う。
+- 1つのrequests.Sessionを共有し、Keep-Aliveで接続を再利用する
+- ホストごとの同時接続数を制限する
+- 5xx・タイムアウトは指数バックオフでリトライする
+- 連続して失敗したホストへはサーキットブレーカーで一定時間リクエストを止める
+- ホストごとのトークンバケットで流量を制限し、応答時間や429/5xxに応じてレートを自動調整する
+"""
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+# 接続先（ローカルのスタブサーバーなどに向ける場合に変更）
+RADIKO_BASE_URL = os.environ.get('RADIKO_BASE_URL', 'http://radiko.jp').rstrip('/')
+
+# 接続プール設定
+POOL_MAXSIZE = int(os.environ.get('RADIKO_POOL_MAXSIZE', '8'))
+PER_HOST_LIMIT = int(os.environ.get('FETCH_PER_HOST_LIMIT', '4'))
+
+# タイムアウト（接続, 読み込み）秒
+CONNECT_TIMEOUT = float(os.environ.get('RADIKO_CONNECT_TIMEOUT', '5'))
+READ_TIMEOUT = float(os.environ.get('RADIKO_READ_TIMEOUT', '30'))
+
+# リトライ設定（5xx・タイムアウト時）
+MAX_RETRIES = int(os.environ.get('RADIKO_MAX_RETRIES', '3'))
+BACKOFF_FACTOR = float(os.environ.get('RADIKO_BACKOFF_FACTOR', '0.5'))
+
+# サーキットブレーカー設定
+BREAKER_THRESHOLD = int(os.environ.get('RADIKO_BREAKER_THRESHOLD', '10'))  # 連続失敗回数
+BREAKER_COOLDOWN = float(os.environ.get('RADIKO_BREAKER_COOLDOWN', '60'))  # 遮断する秒数
+
+# 流量制限（トークンバケット）設定
+RATE_INITIAL = float(os.environ.get('RADIKO_RATE', '10'))          # 初期レート（リクエスト/秒）
+RATE_MIN = float(os.environ.get('RADIKO_RATE_MIN', '1'))           # 下限
+RATE_MAX = float(os.environ.get('RADIKO_RATE_MAX', '30'))          # 上限
+RATE_BURST = float(os.environ.get('RADIKO_RATE_BURST', '5'))       # バースト許容量
+TARGET_LATENCY = float(os.environ.get('RADIKO_TARGET_LATENCY', '1.0'))  # この応答時間を超えたら減速（秒）
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36'
+}
+
+
+class CircuitOpenError(requests.RequestException):
+    """サーキットブレーカーが開いているためリクエストを送らなかった"""
+
+
+class _CircuitBreaker:
+    """ホスト単位のサーキットブレーカー"""
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            # クールダウン後は試しに通す（half-open）
+            if time.monotonic() - self.opened_at >= self.cooldown:
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                if self.opened_at is None:
+                    logger.warning(f'⚠️ Circuit opened after {self.failures} consecutive failures')
+                self.opened_at = time.monotonic()
+
+    @property
+    def state(self) -> str:
+        with self.lock:
+            if self.opened_at is None:
+                return 'closed'
+            if time.monotonic() - self.opened_at >= self.cooldown:
+                return 'half-open'
+            return 'open'
+
+
+class _AdaptiveTokenBucket:
+    """
+    応答状況に応じてレートを調整するトークンバケット
+
+    - 速い応答が続く間はレートを少しずつ上げる（加算的増加）
+    - 429/5xx・通信エラー時はレートを半分にする（乗算的減少）
+    - 応答が TARGET_LATENCY より遅い場合は少し下げる
+    - 429のRetry-Afterが指定された場合はその間トークンを出さない
+    """
+
+    def __init__(self, rate: float, burst: float, min_rate: float, max_rate: float, target_latency: float):
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.rate = min(max(rate, min_rate), max_rate)
+        self.burst = max(burst, 1.0)
+        self.target_latency = target_latency
+        self.tokens = self.burst
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self):
+        """トークンを1つ取得する（足りなければ待つ）"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(min(wait, 1.0))
+
+    def observe(self, latency: float, status_code=None, throttled: bool = False, retry_after=None):
+        """リクエスト結果をレートに反映する"""
+        with self.lock:
+            if throttled or status_code is None or status_code == 429 or status_code >= 500:
+                self.rate = max(self.min_rate, self.rate / 2)
+                if retry_after:
+                    self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+            elif latency > self.target_latency:
+                self.rate = max(self.min_rate, self.rate * 0.9)
+            else:
+                self.rate = min(self.max_rate, self.rate + 0.5)
+
+
+def _retry_after_seconds(response):
+    """Retry-Afterヘッダー（秒指定のみ）を取得"""
+    value = response.headers.get('Retry-After')
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+_session = None
+_adapter = None
+_session_lock = threading.Lock()
+
+_host_semaphores = {}
+_breakers = {}
+_buckets = {}
+_host_lock = threading.Lock()
+
+_stats = {
+    'requests': 0,
+    'errors': 0,
+    'server_errors': 0,
+    'circuit_rejected': 0,
+}
+_stats_lock = threading.Lock()
+
+
+def _get_session() -> requests.Session:
+    """共有セッションを取得（初回のみ作成）"""
+    global _session, _adapter
+
+    if _session is not None:
+        return _session
+
+    with _session_lock:
+        if _session is None:
+            retry = Retry(
+                total=MAX_RETRIES,
+                connect=MAX_RETRIES,
+                read=MAX_RETRIES,
+                status=MAX_RETRIES,
+                backoff_factor=BACKOFF_FACTOR,
+                status_forcelist=(500, 502, 503, 504),
+                allowed_methods=frozenset(['GET', 'HEAD']),
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(
+                pool_connections=4,
+                pool_maxsize=POOL_MAXSIZE,
+                pool_block=True,
+                max_retries=retry,
+            )
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers.update(DEFAULT_HEADERS)
+
+            _adapter = adapter
+            _session = session
+
+    return _session
+
+
+def _host_state(host: str):
+    """ホストごとのセマフォ・サーキットブレーカー・トークンバケットを取得"""
+    with _host_lock:
+        semaphore = _host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = threading.BoundedSemaphore(PER_HOST_LIMIT)
+            _host_semaphores[host] = semaphore
+            _breakers[host] = _CircuitBreaker(BREAKER_THRESHOLD, BREAKER_COOLDOWN)
+            _buckets[host] = _AdaptiveTokenBucket(RATE_INITIAL, RATE_BURST, RATE_MIN, RATE_MAX, TARGET_LATENCY)
+        return semaphore, _breakers[host], _buckets[host]
+
+
+def _count(key: str):
+    with _stats_lock:
+        _stats[key] += 1
+
+
+def build_url(path: str) -> str:
+    """radikoのパス（例: v3/program/now/JP13.xml）から完全なURLを組み立てる"""
+    return f'{RADIKO_BASE_URL}/{path.lstrip("/")}'
+
+
+def get(url: str, headers=None, timeout=None) -> requests.Response:
+    """
+    共有セッションでGETする
+
+    パス（v3/...）を渡した場合は RADIKO_BASE_URL を付与する。
+    5xx・タイムアウトはリトライし、それでも失敗した場合は
+    レスポンス（5xx）または requests.RequestException を返す/送出する。
+    """
+    if not url.startswith(('http://', 'https://')):
+        url = build_url(url)
+
+    host = urlparse(url).netloc
+    semaphore, breaker, bucket = _host_state(host)
+
+    if not breaker.allow():
+        _count('circuit_rejected')
+        raise CircuitOpenError(f'Circuit open for {host}')
+
+    session = _get_session()
+
+    with semaphore:
+        bucket.acquire()
+        _count('requests')
+        started = time.monotonic()
+        try:
+            response = session.get(
+                url,
+                headers=headers,
+                timeout=timeout or (CONNECT_TIMEOUT, READ_TIMEOUT)
+            )
+        except requests.RequestException:
+            _count('errors')
+            breaker.record_failure()
+            bucket.observe(time.monotonic() - started)
+            raise
+
+    # urllib3内部でリトライした場合も混雑の兆候として扱う
+    retries = getattr(response.raw, 'retries', None)
+    throttled = bool(retries and retries.history)
+    bucket.observe(
+        time.monotonic() - started,
+        response.status_code,
+        throttled=throttled,
+        retry_after=_retry_after_seconds(response) if response.status_code == 429 else None
+    )
+
+    if response.status_code >= 500:
+        _count('server_errors')
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+
+    return response
+
+
+def get_stats() -> dict:
+    """接続の再利用状況などの統計を取得"""
+    with _stats_lock:
+        stats = dict(_stats)
+
+    new_connections = 0
+    pooled_requests = 0
+    if _adapter is not None:
+        pools = _adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            new_connections += pool.num_connections
+            pooled_requests += pool.num_requests
+
+    stats['new_connections'] = new_connections
+    stats['reused_connections'] = max(0, pooled_requests - new_connections)
+
+    with _host_lock:
+        stats['circuits'] = {host: breaker.state for host, breaker in _breakers.items()}
+        stats['rates'] = {host: round(bucket.rate, 2) for host, bucket in _buckets.items()}
+
+    return stats
@@ -0,0 +1,61 @@
+"""
+同じキーの処理を同時に1回だけ実行するためのヘルパー（single-flight）
+
+同じキーで同時に呼ばれた場合、最初の呼び出しだけが処理を実行し、
+後から来た呼び出しはその完了を待って同じ結果（または例外）を受け取る。
+"""
+import threading
+
+
+class _Call:
+    """実行中の処理1件分の状態"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """キー単位で処理の同時実行をまとめる"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func, *args, **kwargs):
+        """
+        keyの処理が実行中ならその完了を待って結果を返し、
+        実行中でなければfuncを実行して結果を返す
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result
+
+    def in_flight(self, key) -> bool:
+        """keyの処理が実行中かどうか"""
+        with self._lock:
+            return key in self._calls
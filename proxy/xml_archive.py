@@ -0,0 +1,92 @@
+"""
+番組表XMLのアーカイブ（圧縮・内容アドレス）
+
+radikoから取得した番組表XMLをそのまま保存し、後からネットワークなしで再取り込みできるようにする。
+- 内容のSHA-256をファイル名にしてgzipで保存する（同じ内容は1回だけ保存）
+- どの放送局・日付の応答がどの内容だったかはDB（xml_archive）に記録する
+- XML_ARCHIVE=1 のときだけ保存する（読み込みは常に可能）
+
+種類（kind）:
+    now:    エリアの放送局一覧（v3/program/now/{area_id}.xml）。station_idにエリアID、dateは'now'
+    date:   放送局・日付の番組表（v3/program/station/date/{date}/{station_id}.xml）
+    weekly: 放送局の週間番組表（v3/program/station/weekly/{station_id}.xml）。dateは'weekly'
+"""
+import gzip
+import hashlib
+import logging
+import os
+import tempfile
+
+import db
+
+logger = logging.getLogger(__name__)
+
+# 取得したXMLを保存するか
+XML_ARCHIVE_ENABLED = os.environ.get('XML_ARCHIVE', '0') == '1'
+
+# 保存先（デフォルトはDBと同じdataディレクトリ）
+XML_ARCHIVE_DIR = os.environ.get('XML_ARCHIVE_DIR', os.path.join(db.BASE_DIR, 'data', 'archive'))
+
+
+def _path(digest: str) -> str:
+    return os.path.join(XML_ARCHIVE_DIR, digest[:2], digest[2:4], f'{digest}.xml.gz')
+
+
+def store(kind: str, station_id: str, date: str, content: bytes):
+    """
+    XMLを保存（XML_ARCHIVEが無効なら何もしない）
+
+    Args:
+        kind: 'now' / 'date' / 'weekly'
+        station_id: 放送局ID（nowの場合はエリアID）
+        date: 日付（YYYYMMDD）、'weekly' または 'now'
+
+    Returns:
+        内容のSHA-256（保存しなかった場合はNone）
+    """
+    if not XML_ARCHIVE_ENABLED:
+        return None
+
+    try:
+        digest = hashlib.sha256(content).hexdigest()
+        path = _path(digest)
+
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 書きかけのファイルを読まないよう、一時ファイルに書いてから置き換える
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(gzip.compress(content, compresslevel=6))
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+
+        db.save_archive_entry(kind, station_id, date, digest, len(content))
+        return digest
+
+    except Exception as e:
+        logger.warning(f'⚠️ Archive store error ({kind} {station_id} {date}): {str(e)}')
+        return None
+
+
+def load(digest: str):
+    """SHA-256からXMLを読み込む（見つからない場合はNone）"""
+    try:
+        with open(_path(digest), 'rb') as f:
+            return gzip.decompress(f.read())
+    except FileNotFoundError:
+        return None
+
+
+def load_latest(kind: str, station_id: str, date: str):
+    """放送局・日付ごとに最後に保存したXMLを読み込む（見つからない場合はNone）"""
+    digest = db.get_archive_digest(kind, station_id, date)
+    if digest is None:
+        return None
+
+    content = load(digest)
+    if content is None:
+        logger.warning(f'⚠️ Archived XML missing: {digest} ({kind} {station_id} {date})')
+    return content